@@ -0,0 +1,56 @@
+"""
+Daphne entrypoint with permessage-deflate enabled for WebSockets.
+
+Stock daphne never accepts the permessage-deflate extension browsers offer,
+so every chat frame (which carries rendered message HTML) goes out
+uncompressed. Run this module instead of the `daphne` script; it takes the
+exact same arguments:
+
+    python -m core.daphne_server -b 0.0.0.0 -p 8000 core.asgi:application
+
+Compression state is kept per connection, so the window and memory level are
+deliberately smaller than zlib's defaults to bound RSS with many open sockets.
+"""
+import os
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.cli import CommandLineInterface
+from daphne.server import Server
+from twisted.internet import reactor
+
+# 2**12 byte sliding window and memLevel 5 keep each connection's deflate
+# state in the tens of kilobytes instead of ~256KB with the defaults.
+WEBSOCKET_DEFLATE_WINDOW_BITS = int(os.environ.get('WEBSOCKET_DEFLATE_WINDOW_BITS', 12))
+WEBSOCKET_DEFLATE_MEM_LEVEL = int(os.environ.get('WEBSOCKET_DEFLATE_MEM_LEVEL', 5))
+
+
+def accept_permessage_deflate(offers):
+    """Accepts the first permessage-deflate offer made by the client."""
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(
+                offer,
+                window_bits=WEBSOCKET_DEFLATE_WINDOW_BITS,
+                mem_level=WEBSOCKET_DEFLATE_MEM_LEVEL,
+            )
+    return None
+
+
+class CompressedServer(Server):
+    def run(self):
+        # Server.run() builds the WebSocket factory and then blocks in the
+        # reactor, so the extra protocol options are applied once it starts.
+        # Autobahn copies factory options onto each new connection.
+        reactor.callWhenRunning(self.enable_permessage_deflate)
+        super().run()
+
+    def enable_permessage_deflate(self):
+        self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+
+
+class CompressedCommandLineInterface(CommandLineInterface):
+    server_class = CompressedServer
+
+
+if __name__ == '__main__':
+    CompressedCommandLineInterface.entrypoint()
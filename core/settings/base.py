@@ -63,10 +63,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.gzip.GZipMiddleware',
+    'marketplace.profiling.QueryProfilerMiddleware',  # No-op unless QUERY_PROFILER_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'core.middleware.CSPMiddleware',
     'django_permissions_policy.PermissionsPolicyMiddleware',
+    'marketplace.middleware.SiteConfigMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -152,6 +154,18 @@ AUTH_PASSWORD_VALIDATORS = [
 LOGIN_ATTEMPTS_LIMIT = 5
 LOGIN_ATTEMPTS_TIMEOUT = 300  # 5 minutes lockout
 
+# Order side effects (marketplace.order_events) run after commit on a small
+# thread pool; the process_order_events sweeper retries any left behind.
+# Set ORDER_EVENTS_ASYNC to False to run them inline in the on_commit callback.
+ORDER_EVENTS_ASYNC = config('ORDER_EVENTS_ASYNC', default=True, cast=bool)
+ORDER_EVENT_WORKERS = config('ORDER_EVENT_WORKERS', default=2, cast=int)
+
+# Per-request query/latency profiler (marketplace.profiling), off by default
+QUERY_PROFILER_ENABLED = config('QUERY_PROFILER_ENABLED', default=False, cast=bool)
+QUERY_PROFILER_SLOW_MS = config('QUERY_PROFILER_SLOW_MS', default=500, cast=int)
+QUERY_PROFILER_MAX_QUERIES = config('QUERY_PROFILER_MAX_QUERIES', default=30, cast=int)
+QUERY_PROFILER_REPEAT_THRESHOLD = config('QUERY_PROFILER_REPEAT_THRESHOLD', default=5, cast=int)
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Asia/Karachi'
@@ -1,7 +1,7 @@
 from .base import *
 
 # Ensure security middleware runs even in development (for lockout testing)
-insert_index = 4  # After CSP middleware to keep ordering similar to production
+insert_index = MIDDLEWARE.index('core.middleware.CSPMiddleware') + 1  # After CSP middleware to keep ordering similar to production
 if 'marketplace.security_middleware.SecurityMiddleware' not in MIDDLEWARE:
     MIDDLEWARE.insert(insert_index, 'marketplace.security_middleware.SecurityMiddleware')
 
@@ -14,7 +14,7 @@ ALLOWED_HOSTS = ['localhost', '127.0.0.1', '192.168.100.11', '0.0.0.0']
 # Enable caching for development (in-memory)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'marketplace.cache_metrics.InstrumentedLocMemCache',
         'LOCATION': 'unique-snowflake',
         'OPTIONS': {
             'MAX_ENTRIES': 1000,
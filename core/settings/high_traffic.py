@@ -19,7 +19,7 @@ DATABASES = {
 # Redis Configuration with Clustering
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'marketplace.cache_metrics.InstrumentedRedisCache',
         'LOCATION': [
             config('REDIS_URL_1', default='redis://127.0.0.1:6379/1'),
             config('REDIS_URL_2', default='redis://127.0.0.1:6380/1'),
@@ -32,7 +32,7 @@ SECURE_REFERRER_POLICY = 'strict-origin-when-cross-origin'
 # Production caching with Redis
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'marketplace.cache_metrics.InstrumentedRedisCache',
         'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/1'),
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
@@ -180,10 +180,12 @@ DATABASE_BACKUP_SCHEDULE = config('DATABASE_BACKUP_SCHEDULE', default='daily')
 # Add security middleware
 MIDDLEWARE = [
     'django.middleware.gzip.GZipMiddleware',
+    'marketplace.profiling.QueryProfilerMiddleware',  # No-op unless QUERY_PROFILER_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'core.middleware.CSPMiddleware',
     'marketplace.security_middleware.SecurityMiddleware',  # Custom security middleware
+    'marketplace.middleware.SiteConfigMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
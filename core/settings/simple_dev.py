@@ -10,7 +10,7 @@ INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'daphne']
 # Basic development caching
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'marketplace.cache_metrics.InstrumentedLocMemCache',
         'LOCATION': 'unique-snowflake',
     }
 }
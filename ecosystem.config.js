@@ -3,7 +3,7 @@ module.exports = {
     name: 'games-bazaar',
     cwd: '/home/gamersmarket/app',
     script: '/bin/bash',
-    args: ['-c', 'source /home/gamersmarket/app/venv/bin/activate && cd /home/gamersmarket/app && daphne -b 0.0.0.0 -p 8000 core.asgi:application'],
+    args: ['-c', 'source /home/gamersmarket/app/venv/bin/activate && cd /home/gamersmarket/app && python -m core.daphne_server -b 0.0.0.0 -p 8000 core.asgi:application'],
     instances: 1,
     autorestart: true,
     watch: false,
@@ -18,5 +18,53 @@ module.exports = {
     time: true,
     merge_logs: true,
     log_date_format: 'YYYY-MM-DD HH:mm:ss Z'
+  }, {
+    name: 'games-bazaar-held-funds',
+    cwd: '/home/gamersmarket/app',
+    script: '/bin/bash',
+    args: ['-c', 'source /home/gamersmarket/app/venv/bin/activate && cd /home/gamersmarket/app && python manage.py release_held_funds --loop --interval 60'],
+    instances: 1,
+    autorestart: true,
+    watch: false,
+    env: {
+      DJANGO_SETTINGS_MODULE: 'core.settings.production',
+      PYTHONPATH: '/home/gamersmarket/app'
+    },
+    error_file: '/home/gamersmarket/app/logs/pm2-held-funds-error.log',
+    out_file: '/home/gamersmarket/app/logs/pm2-held-funds-out.log',
+    time: true,
+    log_date_format: 'YYYY-MM-DD HH:mm:ss Z'
+  }, {
+    name: 'games-bazaar-order-events',
+    cwd: '/home/gamersmarket/app',
+    script: '/bin/bash',
+    args: ['-c', 'source /home/gamersmarket/app/venv/bin/activate && cd /home/gamersmarket/app && python manage.py process_order_events --loop --interval 10'],
+    instances: 1,
+    autorestart: true,
+    watch: false,
+    env: {
+      DJANGO_SETTINGS_MODULE: 'core.settings.production',
+      PYTHONPATH: '/home/gamersmarket/app'
+    },
+    error_file: '/home/gamersmarket/app/logs/pm2-order-events-error.log',
+    out_file: '/home/gamersmarket/app/logs/pm2-order-events-out.log',
+    time: true,
+    log_date_format: 'YYYY-MM-DD HH:mm:ss Z'
+  }, {
+    name: 'games-bazaar-daily-rollups',
+    cwd: '/home/gamersmarket/app',
+    script: '/bin/bash',
+    args: ['-c', 'source /home/gamersmarket/app/venv/bin/activate && cd /home/gamersmarket/app && python manage.py build_daily_rollups --loop --interval 300'],
+    instances: 1,
+    autorestart: true,
+    watch: false,
+    env: {
+      DJANGO_SETTINGS_MODULE: 'core.settings.production',
+      PYTHONPATH: '/home/gamersmarket/app'
+    },
+    error_file: '/home/gamersmarket/app/logs/pm2-daily-rollups-error.log',
+    out_file: '/home/gamersmarket/app/logs/pm2-daily-rollups-out.log',
+    time: true,
+    log_date_format: 'YYYY-MM-DD HH:mm:ss Z'
   }]
 };
\ No newline at end of file
@@ -2,19 +2,18 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from django.utils import timezone
 from django.utils.html import format_html
 from django.db.models import Q, Case, When, Value, IntegerField
 from django.db import models
-from django.core.cache import cache
 from django.urls import reverse, path
 from django.shortcuts import get_object_or_404, redirect
 from .models import (
     SiteConfiguration, FlatPage, Game, Profile, Category, 
     Product, Order, Review, ReviewReply, Conversation, Message, WithdrawalRequest, DepositRequest,
-    SupportTicket, Transaction, Filter, FilterOption, GameCategory, ProductImage, HeldFund
+    SupportTicket, Transaction, Filter, FilterOption, GameCategory, ProductImage, HeldFund, UserBalance,
+    StockItem, OrderEvent, DailyMarketplaceStats
 )
-from . import admin_views
+from . import admin_views, bulk_actions
 
 # Site Configuration
 @admin.register(SiteConfiguration)
@@ -53,16 +52,6 @@ class GameAdmin(admin.ModelAdmin):
     def category_count(self, obj):
         return obj.categories.count()
     category_count.short_description = 'Categories'
-    
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        # Clear cache when games are added/modified
-        cache.delete('home_games_list')
-        
-    def delete_model(self, request, obj):
-        super().delete_model(request, obj)
-        # Clear cache when games are deleted
-        cache.delete('home_games_list')
 
 
 @admin.register(GameCategory)
@@ -86,11 +75,6 @@ class CategoryAdmin(admin.ModelAdmin):
     def game_count(self, obj):
         return obj.games.count()
     game_count.short_description = 'Games Using This'
-    
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        # Clear cache when categories are modified (affects game display)
-        cache.delete('home_games_list') 
 
 # ==== FILTERS SYSTEM ====
 class FilterOptionInline(admin.TabularInline):
@@ -120,6 +104,7 @@ class ProductImageInline(admin.TabularInline):
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('listing_title', 'game', 'category', 'seller', 'price', 'is_active', 'created_at')
     list_filter = ('is_active', 'game', 'category', 'automatic_delivery')
+    readonly_fields = ('available_stock_items',)
     search_fields = ('listing_title', 'game__title', 'seller__username')
     filter_horizontal = ('filter_options',)
     inlines = [ProductImageInline]
@@ -130,7 +115,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('seller', 'game', 'category', 'listing_title', 'description', 'price')
         }),
         ('Settings', {
-            'fields': ('is_active', 'automatic_delivery', 'stock', 'stock_details', 'post_purchase_message')
+            'fields': ('is_active', 'automatic_delivery', 'stock', 'stock_details', 'available_stock_items', 'post_purchase_message')
         }),
         ('Filters', {
             'fields': ('filter_options',),
@@ -138,6 +123,21 @@ class ProductAdmin(admin.ModelAdmin):
         })
     )
 
+@admin.register(StockItem)
+class StockItemAdmin(admin.ModelAdmin):
+    """Automatic-delivery codes. Add codes through the listing's stock field so the available count stays right."""
+    list_display = ('id', 'product', 'is_claimed', 'claimed_at', 'order', 'created_at')
+    list_filter = ('is_claimed',)
+    search_fields = ('product__listing_title', 'product__seller__username')
+    raw_id_fields = ('product', 'order')
+    readonly_fields = ('product', 'is_claimed', 'claimed_at', 'order', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # ==== ORDERS & TRANSACTIONS ====
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -277,13 +277,13 @@ class OrderAdmin(admin.ModelAdmin):
     
     # Admin actions
     def mark_completed(self, request, queryset):
-        updated = queryset.update(status='COMPLETED')
-        self.message_user(request, f"{updated} orders marked as completed.")
+        result = bulk_actions.complete_orders(queryset)
+        self.message_user(request, result.summary('order', 'marked as completed'))
     mark_completed.short_description = "✅ Mark selected orders as completed"
     
     def mark_cancelled(self, request, queryset):
-        updated = queryset.update(status='CANCELLED')
-        self.message_user(request, f"{updated} orders marked as cancelled.")
+        result = bulk_actions.cancel_orders(queryset)
+        self.message_user(request, result.summary('order', 'marked as cancelled'))
     mark_cancelled.short_description = "❌ Mark selected orders as cancelled"
 
 @admin.register(Transaction)
@@ -323,13 +323,24 @@ class HeldFundAdmin(admin.ModelAdmin):
     can_be_released_now.short_description = 'Can Release'
     
     def release_funds(self, request, queryset):
-        released_count = 0
-        for held_fund in queryset:
-            if held_fund.release_fund():
-                released_count += 1
-        self.message_user(request, f"{released_count} funds released successfully.")
+        _result, released = bulk_actions.release_held_funds(queryset)
+        self.message_user(request, f"Released Rs{sum(released.values())} for {len(released)} users.")
     release_funds.short_description = "Release selected funds (if eligible)"
 
+@admin.register(UserBalance)
+class UserBalanceAdmin(admin.ModelAdmin):
+    """Read-only view of the running balances; they are only written alongside ledger entries."""
+    list_display = ('user', 'balance', 'held', 'available', 'updated_at')
+    search_fields = ('user__username',)
+    list_select_related = ('user',)
+    readonly_fields = ('user', 'balance', 'held', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # ==== USER MANAGEMENT ====
 @admin.register(WithdrawalRequest)
 class WithdrawalRequestAdmin(admin.ModelAdmin):
@@ -353,12 +364,14 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
         })
     )
     
-    def approve_requests(self, request, queryset): 
-        queryset.update(status='APPROVED', processed_at=timezone.now())
+    def approve_requests(self, request, queryset):
+        result = bulk_actions.approve_withdrawals(queryset)
+        self.message_user(request, result.summary('withdrawal', 'approved'))
     approve_requests.short_description = "✅ Approve selected requests"
     
-    def reject_requests(self, request, queryset): 
-        queryset.update(status='REJECTED', processed_at=timezone.now())
+    def reject_requests(self, request, queryset):
+        result = bulk_actions.reject_withdrawals(queryset)
+        self.message_user(request, result.summary('withdrawal', 'rejected'))
     reject_requests.short_description = "❌ Reject selected requests"
 
 @admin.register(DepositRequest)
@@ -412,21 +425,13 @@ class DepositRequestAdmin(admin.ModelAdmin):
     transaction_link.short_description = 'Transaction'
     
     def mark_approved(self, request, queryset):
-        updated = 0
-        for deposit in queryset.select_related('transaction'):
-            if deposit.status != DepositRequest.STATUS_APPROVED:
-                deposit.mark_approved()
-                updated += 1
-        self.message_user(request, f"{updated} deposit request{'s' if updated != 1 else ''} approved.")
+        result = bulk_actions.approve_deposits(queryset)
+        self.message_user(request, result.summary('deposit request', 'approved'))
     mark_approved.short_description = "✅ Approve selected deposits"
     
     def mark_rejected(self, request, queryset):
-        updated = 0
-        for deposit in queryset.select_related('transaction'):
-            if deposit.status != DepositRequest.STATUS_REJECTED:
-                deposit.mark_rejected()
-                updated += 1
-        self.message_user(request, f"{updated} deposit request{'s' if updated != 1 else ''} rejected.")
+        result = bulk_actions.reject_deposits(queryset)
+        self.message_user(request, result.summary('deposit request', 'rejected'))
     mark_rejected.short_description = "❌ Reject selected deposits"
 
 @admin.register(SupportTicket)
@@ -745,6 +750,35 @@ admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 
 # ==== REVIEWS & COMMUNICATION ====
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    """Outbox of order side effects; unprocessed rows are retried by process_order_events."""
+    list_display = ('id', 'order', 'event_type', 'status', 'created_at', 'processed_at', 'attempts')
+    list_filter = ('event_type', 'status', ('processed_at', admin.EmptyFieldListFilter))
+    search_fields = ('order__order_id',)
+    raw_id_fields = ('order',)
+    readonly_fields = (
+        'order', 'event_type', 'status', 'previous_status', 'created_at',
+        'claimed_at', 'processed_at', 'attempts', 'last_error',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(DailyMarketplaceStats)
+class DailyMarketplaceStatsAdmin(admin.ModelAdmin):
+    """Read-only view of the daily rollups maintained by build_daily_rollups."""
+    list_display = ('day', 'game', 'category', 'orders', 'completed_orders', 'gmv', 'commission', 'refunds', 'new_listings', 'new_users')
+    list_filter = ('game', 'category')
+    date_hierarchy = 'day'
+    list_select_related = ('game', 'category')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('buyer', 'seller', 'rating', 'created_at', 'has_reply')
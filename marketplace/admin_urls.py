@@ -6,6 +6,7 @@ app_name = 'admin_chat'
 urlpatterns = [
     path('test/', admin_views.test_view, name='test'),
     path('support-dashboard/', admin_views.support_dashboard, name='support_dashboard'),
+    path('cache-metrics/', admin_views.cache_metrics_view, name='cache_metrics'),
     path('conversation/<int:conversation_id>/chat/', admin_views.admin_chat_view, name='admin_chat'),
     path('conversation/<int:conversation_id>/join/', admin_views.admin_join_conversation, name='admin_join_conversation'),
     path('conversation/<int:conversation_id>/leave/', admin_views.admin_leave_conversation, name='admin_leave_conversation'),
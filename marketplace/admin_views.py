@@ -219,3 +219,24 @@ def support_dashboard(request):
     }
     
     return render(request, 'admin/support_dashboard.html', context)
+
+
+@staff_member_required
+def cache_metrics_view(request):
+    """Per key family cache hit ratio, latency and value size, summed across workers"""
+    from django.core.cache import cache
+    from . import cache_metrics
+
+    if request.method == 'POST' and hasattr(cache, 'reset_metrics'):
+        cache.reset_metrics()
+        messages.success(request, 'Cache metrics reset.')
+        return redirect('admin_chat:cache_metrics')
+
+    families = cache_metrics.report(cache)
+    context = {
+        'title': 'Cache Metrics',
+        'instrumented': hasattr(cache, 'read_metrics'),
+        'families': [{'name': name, **summary} for name, summary in families.items()],
+        'flush_seconds': cache_metrics.FLUSH_SECONDS,
+    }
+    return render(request, 'admin/cache_metrics.html', context)
@@ -0,0 +1,373 @@
+# marketplace/bulk_actions.py
+"""
+Set-based status transitions for the admin bulk actions.
+
+Saving rows one at a time runs the whole signal chain per row: ledger
+writes, counter updates and a channel send for each user, which times out
+on a few hundred rows. These services lock the selected rows, validate them
+and write the status, ledger and running-balance changes with a handful of
+UPDATE/INSERT statements in one DB transaction. Each affected user gets one
+coalesced notification after commit.
+"""
+import datetime
+import logging
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = 500
+# Orders an admin may still complete or cancel
+OPEN_ORDER_STATUSES = ('PENDING_PAYMENT', 'PROCESSING', 'DELIVERED', 'DISPUTED')
+PAID_ORDER_STATUSES = ('PROCESSING', 'DELIVERED', 'DISPUTED')
+HOLD_PERIOD = datetime.timedelta(hours=72)
+
+
+class BulkResult:
+    """Outcome of a bulk transition, plus the per-user notices it produced."""
+
+    def __init__(self, total):
+        self.total = total
+        self.processed = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.notices = defaultdict(Counter)
+
+    def notice(self, user_id, text, count=1):
+        """Adds to a user's notice; `text` may hold a {} for the running count."""
+        self.notices[user_id][text] += count
+
+    def summary(self, noun, verb):
+        parts = [f"{self.processed} {noun}{'s' if self.processed != 1 else ''} {verb}"]
+        if self.rejected:
+            parts.append(f"{self.rejected} rejected")
+        if self.skipped:
+            parts.append(f"{self.skipped} skipped")
+        return ', '.join(parts) + '.'
+
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _report(progress, done, total):
+    logger.info("Bulk transition progress: %s/%s", done, total)
+    if progress:
+        progress(done, total)
+
+
+def _write_ledger(updates):
+    """
+    Applies {transaction_pk: {field: value}} to ledger rows with bulk_update
+    (one UPDATE per chunk) and moves each owner's running balance by the
+    change in their COMPLETED total. Call inside a transaction.
+    """
+    from .models import Transaction, UserBalance, invalidate_user_balance_cache
+
+    if not updates:
+        return
+    rows = Transaction.objects.select_for_update().filter(pk__in=list(updates)).only('pk', 'user_id', 'amount', 'status', 'description')
+    deltas = defaultdict(Decimal)
+    fields = set()
+    changed = []
+    for row in rows:
+        old_total = row.amount if row.status == 'COMPLETED' else Decimal('0.00')
+        for field, value in updates[row.pk].items():
+            setattr(row, field, value)
+            fields.add(field)
+        new_total = Decimal(row.amount) if row.status == 'COMPLETED' else Decimal('0.00')
+        deltas[row.user_id] += new_total - old_total
+        changed.append(row)
+
+    Transaction.objects.bulk_update(changed, sorted(fields), batch_size=BULK_CHUNK_SIZE)
+    for user_id, delta in deltas.items():
+        UserBalance.objects.adjust(user_id, balance=delta)
+    invalidate_user_balance_cache(*deltas)
+
+
+def _count_orders(transitions):
+    """Moves per-user order counters for [(buyer_id, seller_id, old_status, new_status)]."""
+    from .models import UserOrderCount
+
+    changes = defaultdict(Counter)
+    for buyer_id, seller_id, old_status, new_status in transitions:
+        for key in ((buyer_id, UserOrderCount.ROLE_BUYER), (seller_id, UserOrderCount.ROLE_SELLER)):
+            changes[key][old_status] -= 1
+            changes[key][new_status] += 1
+    for (user_id, role), deltas in changes.items():
+        UserOrderCount.objects.adjust(user_id, role, dict(deltas))
+
+
+def notify_users(notices):
+    """
+    Sends each user one order_update notification summarising
+    {user_id: Counter(text)}, with fresh navbar counters.
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from django.contrib.auth.models import User
+    from . import caching
+    from .signals import get_user_context
+
+    if not notices:
+        return
+    channel_layer = get_channel_layer()
+    for user in User.objects.filter(id__in=list(notices)):
+        counts = notices[user.id]
+        message = '; '.join(text.format(count) for text, count in sorted(counts.items()))
+        caching.bump('notifications', user.id)
+        try:
+            async_to_sync(channel_layer.group_send)(
+                f'notifications_{user.username}',
+                {
+                    "type": "send_notification",
+                    "notification_type": "order_update",
+                    "data": {"message": message, **get_user_context(user)},
+                }
+            )
+        except Exception:
+            logger.exception("Could not notify user %s of bulk changes", user.id)
+
+
+def _locked(queryset):
+    """
+    The queryset's rows again, selected by primary key and locked. Admin
+    querysets carry joins (list_select_related) that PostgreSQL will not
+    lock through when they are outer joins.
+    """
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    return queryset.model.objects.select_for_update().filter(pk__in=pks)
+
+
+def _finish(result):
+    notices = {user_id: counts for user_id, counts in result.notices.items()}
+    transaction.on_commit(lambda: notify_users(notices))
+    return result
+
+
+def complete_orders(queryset, progress=None):
+    """
+    Marks paid orders as COMPLETED: buyer and seller ledger rows complete
+    (the sale at its net amount), unverified sellers get a 72-hour hold and
+    the order counters move. Orders in any other status are skipped.
+    """
+    from .models import HeldFund, Order, Transaction, UserBalance, invalidate_user_balance_cache
+
+    now = timezone.now()
+    with transaction.atomic():
+        selected = list(queryset.order_by('pk').values_list('pk', flat=True))
+        result = BulkResult(len(selected))
+        done = 0
+        for chunk in _chunks(selected):
+            orders = list(
+                Order.objects.select_for_update(of=('self',)).filter(pk__in=chunk, status__in=PAID_ORDER_STATUSES)
+                .values_list('pk', 'buyer_id', 'seller_id', 'status', 'total_price', 'commission_paid', 'seller__profile__is_verified_seller')
+            )
+            result.skipped += len(chunk) - len(orders)
+            if orders:
+                Order.objects.filter(pk__in=[order[0] for order in orders]).update(status='COMPLETED', updated_at=now)
+
+                parties = {pk: (buyer_id, seller_id) for pk, buyer_id, seller_id, *_ in orders}
+                nets = {pk: total - (commission or 0) for pk, _b, _s, _st, total, commission, _v in orders}
+                updates = {}
+                for tx_pk, order_id, user_id in Transaction.objects.filter(order_id__in=list(parties)).values_list('pk', 'order_id', 'user_id'):
+                    buyer_id, seller_id = parties[order_id]
+                    if user_id == seller_id:
+                        updates[tx_pk] = {'status': 'COMPLETED', 'amount': nets[order_id]}
+                    elif user_id == buyer_id:
+                        updates[tx_pk] = {'status': 'COMPLETED'}
+                _write_ledger(updates)
+
+                held_orders = set(HeldFund.objects.filter(order_id__in=list(parties)).values_list('order_id', flat=True))
+                holds = [
+                    HeldFund(user_id=seller_id, order_id=pk, amount=nets[pk], release_at=now + HOLD_PERIOD)
+                    for pk, _buyer, seller_id, _st, _t, _c, verified in orders
+                    if not verified and pk not in held_orders
+                ]
+                HeldFund.objects.bulk_create(holds, batch_size=BULK_CHUNK_SIZE)
+                held = defaultdict(Decimal)
+                for hold in holds:
+                    held[hold.user_id] += hold.amount
+                for user_id, amount in held.items():
+                    UserBalance.objects.adjust(user_id, held=amount)
+                invalidate_user_balance_cache(*held, held=True)
+
+                _count_orders([(buyer_id, seller_id, status, 'COMPLETED') for _pk, buyer_id, seller_id, status, *_ in orders])
+                for _pk, buyer_id, seller_id, *_ in orders:
+                    result.notice(buyer_id, '{} purchase(s) marked completed')
+                    result.notice(seller_id, '{} sale(s) marked completed')
+                result.processed += len(orders)
+            done += len(chunk)
+            _report(progress, done, result.total)
+    return _finish(result)
+
+
+def cancel_orders(queryset, progress=None):
+    """Cancels open orders and their ledger rows; finished orders are skipped."""
+    from .models import Order, Transaction
+
+    now = timezone.now()
+    with transaction.atomic():
+        selected = list(queryset.order_by('pk').values_list('pk', flat=True))
+        result = BulkResult(len(selected))
+        done = 0
+        for chunk in _chunks(selected):
+            orders = list(
+                Order.objects.select_for_update().filter(pk__in=chunk, status__in=OPEN_ORDER_STATUSES)
+                .values_list('pk', 'buyer_id', 'seller_id', 'status')
+            )
+            result.skipped += len(chunk) - len(orders)
+            if orders:
+                pks = [order[0] for order in orders]
+                Order.objects.filter(pk__in=pks).update(status='CANCELLED', updated_at=now)
+                Transaction.objects.filter(order_id__in=pks).update_with_balances(status='CANCELLED')
+                _count_orders([(buyer_id, seller_id, status, 'CANCELLED') for _pk, buyer_id, seller_id, status in orders])
+                for _pk, buyer_id, seller_id, _status in orders:
+                    result.notice(buyer_id, '{} purchase(s) cancelled')
+                    result.notice(seller_id, '{} sale(s) cancelled')
+                result.processed += len(orders)
+            done += len(chunk)
+            _report(progress, done, result.total)
+    return _finish(result)
+
+
+def approve_withdrawals(queryset, progress=None):
+    """
+    Approves pending withdrawals oldest first while each user's available
+    balance covers them; the rest are rejected with a note, as a single
+    approval would be. Balance rows are locked for the whole run.
+    """
+    from .models import Transaction, UserBalance, WithdrawalRequest
+
+    now = timezone.now()
+    with transaction.atomic():
+        locked = _locked(queryset)
+        requests = list(locked.filter(status='PENDING').order_by('requested_at', 'pk'))
+        result = BulkResult(locked.count())
+        result.skipped = result.total - len(requests)
+
+        user_ids = {request.user_id for request in requests}
+        UserBalance.objects.seed(user_ids)
+        available = {
+            row.user_id: row.available
+            for row in UserBalance.objects.select_for_update().filter(user_id__in=user_ids)
+        }
+
+        payment_methods = dict(WithdrawalRequest.PAYMENT_METHOD_CHOICES)
+        done = 0
+        for chunk in _chunks(requests):
+            ledger = {}
+            cancelled = []
+            for request in chunk:
+                request.processed_at = now
+                method = payment_methods.get(request.payment_method, request.payment_method)
+                if available[request.user_id] >= request.amount:
+                    available[request.user_id] -= request.amount
+                    request.status = 'APPROVED'
+                    ledger[request.pk] = {
+                        'status': 'COMPLETED', 'amount': -request.amount,
+                        'description': f'Withdrawal - {method} - {request.account_title}',
+                    }
+                    result.processed += 1
+                    result.notice(request.user_id, '{} withdrawal(s) approved')
+                else:
+                    request.status = 'REJECTED'
+                    request.admin_notes = (
+                        f'Insufficient available balance at the time of approval. '
+                        f'Available: Rs{available[request.user_id]:.2f}, Requested: Rs{request.amount:.2f}'
+                    )
+                    cancelled.append(request.pk)
+                    result.rejected += 1
+                    result.notice(request.user_id, '{} withdrawal(s) rejected for insufficient balance')
+
+            WithdrawalRequest.objects.bulk_update(chunk, ['status', 'processed_at', 'admin_notes'])
+            _write_ledger({
+                tx_pk: ledger[withdrawal_id]
+                for tx_pk, withdrawal_id in Transaction.objects.filter(withdrawal_id__in=list(ledger)).values_list('pk', 'withdrawal_id')
+            })
+            Transaction.objects.filter(withdrawal_id__in=cancelled).update_with_balances(
+                status='CANCELLED', description='Withdrawal Cancelled - Insufficient Balance'
+            )
+            done += len(chunk)
+            _report(progress, done, len(requests))
+    return _finish(result)
+
+
+def reject_withdrawals(queryset, progress=None):
+    """Rejects withdrawals and cancels their ledger rows, returning any approved amount."""
+    from .models import Transaction
+
+    now = timezone.now()
+    with transaction.atomic():
+        locked = _locked(queryset)
+        requests = list(locked.exclude(status='REJECTED').values_list('pk', 'user_id'))
+        result = BulkResult(locked.count())
+        result.skipped = result.total - len(requests)
+        done = 0
+        for chunk in _chunks(requests):
+            pks = [pk for pk, _user_id in chunk]
+            queryset.model.objects.filter(pk__in=pks).update(status='REJECTED', processed_at=now)
+            Transaction.objects.filter(withdrawal_id__in=pks).update_with_balances(
+                status='CANCELLED', description='Withdrawal Request Rejected'
+            )
+            for _pk, user_id in chunk:
+                result.notice(user_id, '{} withdrawal(s) rejected')
+            result.processed += len(chunk)
+            done += len(chunk)
+            _report(progress, done, len(requests))
+    return _finish(result)
+
+
+def _set_deposit_status(queryset, status, ledger_status, verb, progress):
+    from django.db.models import CharField, Value
+    from django.db.models.functions import Cast, Concat
+    from .models import Transaction
+
+    now = timezone.now()
+    with transaction.atomic():
+        locked = _locked(queryset)
+        deposits = list(locked.exclude(status=status).values_list('pk', 'user_id'))
+        result = BulkResult(locked.count())
+        result.skipped = result.total - len(deposits)
+        done = 0
+        for chunk in _chunks(deposits):
+            pks = [pk for pk, _user_id in chunk]
+            queryset.model.objects.filter(pk__in=pks).update(status=status, processed_at=now)
+            Transaction.objects.filter(deposit_id__in=pks).update_with_balances(
+                status=ledger_status,
+                description=Concat(
+                    Value('Manual deposit #'), Cast('deposit_id', CharField()), Value(f' {verb}'),
+                    output_field=CharField(),
+                ),
+            )
+            for _pk, user_id in chunk:
+                result.notice(user_id, '{} deposit(s) ' + verb)
+            result.processed += len(chunk)
+            done += len(chunk)
+            _report(progress, done, len(deposits))
+    return _finish(result)
+
+
+def approve_deposits(queryset, progress=None):
+    """Approves deposits and completes their ledger rows, crediting the balances."""
+    return _set_deposit_status(queryset, 'APPROVED', 'COMPLETED', 'approved', progress)
+
+
+def reject_deposits(queryset, progress=None):
+    """Rejects deposits and cancels their ledger rows."""
+    return _set_deposit_status(queryset, 'REJECTED', 'CANCELLED', 'rejected', progress)
+
+
+def release_held_funds(queryset):
+    """Releases the due funds in one UPDATE and tells each seller once."""
+    with transaction.atomic():
+        released = queryset.release_due()
+        result = BulkResult(len(released))
+        result.processed = len(released)
+        for user_id, amount in released.items():
+            result.notice(user_id, f'Rs{amount} of held funds released')
+    return _finish(result), released
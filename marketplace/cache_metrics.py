@@ -0,0 +1,411 @@
+# marketplace/cache_metrics.py
+"""
+Per key family cache instrumentation.
+
+The cache backends configured in settings (InstrumentedRedisCache,
+InstrumentedLocMemCache) wrap every read and write and record, per key
+family, hits, misses, sets, deletes, a latency histogram for reads and
+writes, and a sample of value sizes. A key's family is its stable prefix:
+'ns:product_detail:12' -> 'ns:product_detail', 'rate_limit_login_5_1.2.3.4'
+-> 'rate_limit_login' (see key_family).
+
+Counts are aggregated in process. At most every CACHE_METRICS_FLUSH_SECONDS
+the cache call that finds a flush due hands them to a metrics thread, which
+adds them to one Redis hash per family (HINCRBY in a pipeline); the request
+itself never waits on the publish. report() flushes and waits, then reads
+the merged numbers back for the performance_monitor command and the admin
+page.
+"""
+import logging
+import pickle
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+
+from .profiling import record_cache_time
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'cache_metrics'
+FAMILIES_KEY = f'{METRICS_PREFIX}:families'
+FLUSH_SECONDS = getattr(settings, 'CACHE_METRICS_FLUSH_SECONDS', 10)
+# Pickling a value to measure it costs about as much as the write, so sample
+SIZE_SAMPLE_EVERY = 10
+# Upper bounds in milliseconds; the last bucket takes everything slower
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)
+LATENCY_KINDS = ('read', 'write')
+
+# Families with a fixed number of leading ':' segments; others stop at the first segment with a digit
+_SEGMENTS = {'ns': 2, 'gen': 2, 'lock': 3, 'cache_stats': 2, METRICS_PREFIX: 1}
+_DIGIT = re.compile(r'\d')
+_MISSING = object()
+# One thread, so publishes run in order and report() can wait for earlier ones
+_flush_executor = None
+_flush_executor_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def key_family(key):
+    key = str(key)
+    if ':' in key:
+        parts = key.split(':')
+        limit = _SEGMENTS.get(parts[0], 2)
+        family = [parts[0]]
+        for part in parts[1:limit]:
+            # Ids, addresses and {hash tags} are per-key, not part of the family
+            if _DIGIT.search(part) or part.startswith('{'):
+                break
+            family.append(part)
+        return ':'.join(family)
+    words = []
+    for word in key.split('_'):
+        if _DIGIT.search(word) or not word:
+            break
+        words.append(word)
+    return '_'.join(words) or key
+
+
+def _bucket_field(kind, seconds):
+    elapsed_ms = seconds * 1000
+    for bound in LATENCY_BUCKETS_MS:
+        if elapsed_ms <= bound:
+            return f'{kind}_le_{bound}'
+    return f'{kind}_le_inf'
+
+
+class Recorder:
+    """Process-local aggregate, drained by the backend when a flush is due."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(Counter)
+        self._last_flush = time.monotonic()
+        self._writes = 0
+
+    def record(self, families, kind, seconds, hits=None, misses=None, sets=None, deletes=None):
+        """`families` is every key's family; hits etc. are Counters by family."""
+        with self._lock:
+            bucket = _bucket_field(kind, seconds)
+            for family in set(families):
+                counts = self._pending[family]
+                counts[bucket] += 1
+                counts[f'{kind}_ms'] += seconds * 1000
+            for field, by_family in (('hits', hits), ('misses', misses), ('sets', sets), ('deletes', deletes)):
+                for family, amount in (by_family or {}).items():
+                    self._pending[family][field] += amount
+
+    def sample_size(self):
+        """True for every SIZE_SAMPLE_EVERY-th write."""
+        with self._lock:
+            self._writes += 1
+            return self._writes % SIZE_SAMPLE_EVERY == 1
+
+    def record_size(self, family, value):
+        try:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return
+        with self._lock:
+            counts = self._pending[family]
+            counts['size_samples'] += 1
+            counts['size_bytes'] += size
+
+    def due(self):
+        return self._pending and time.monotonic() - self._last_flush >= FLUSH_SECONDS
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+            self._last_flush = time.monotonic()
+        return pending
+
+
+recorder = Recorder()
+
+
+def _get_flush_executor():
+    global _flush_executor
+    if _flush_executor is None:
+        with _flush_executor_lock:
+            if _flush_executor is None:
+                _flush_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-metrics')
+    return _flush_executor
+
+
+class _Call:
+    """Counts for one backend call; only the outermost call is recorded."""
+    __slots__ = ('kind', 'keys', 'outermost', 'counts')
+
+    def __init__(self, kind, keys, outermost):
+        self.kind = kind
+        self.keys = keys
+        self.outermost = outermost
+        self.counts = {}
+
+    def count(self, field, key, amount=1):
+        by_family = self.counts.setdefault(field, Counter())
+        by_family[key_family(key)] += amount
+
+
+class InstrumentedCacheMixin:
+    """
+    Records every call in `recorder` and flushes it when due. Stores only
+    through the wrapped backend's own methods, so publishing the metrics is
+    not itself recorded. Calls the backend makes to its own public methods
+    (BaseCache.get_many looping over get, ...) are counted once, as the outer call.
+    """
+    _nesting = threading.local()
+
+    @contextmanager
+    def _measure(self, kind, keys):
+        depth = getattr(self._nesting, 'depth', 0)
+        call = _Call(kind, keys, outermost=not depth)
+        self._nesting.depth = depth + 1
+        started = time.perf_counter()
+        try:
+            yield call
+        finally:
+            self._nesting.depth = depth
+            if call.outermost:
+                elapsed = time.perf_counter() - started
+                recorder.record([key_family(key) for key in keys], kind, elapsed, **call.counts)
+                record_cache_time(elapsed)
+                if recorder.due():
+                    self.flush_metrics(wait=False)
+
+    def _sample_sizes(self, call, items):
+        if not call.outermost:
+            return
+        for key, value in items:
+            if recorder.sample_size():
+                recorder.record_size(key_family(key), value)
+
+    def get(self, key, default=None, version=None, **kwargs):
+        with self._measure('read', [key]) as call:
+            value = super().get(key, _MISSING, version=version, **kwargs)
+            call.count('misses' if value is _MISSING else 'hits', key)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None, **kwargs):
+        keys = list(keys)
+        with self._measure('read', keys) as call:
+            found = super().get_many(keys, version=version, **kwargs)
+            for key in keys:
+                call.count('hits' if key in found else 'misses', key)
+        return found
+
+    def has_key(self, key, version=None, **kwargs):
+        with self._measure('read', [key]) as call:
+            found = super().has_key(key, version=version, **kwargs)
+            call.count('hits' if found else 'misses', key)
+        return found
+
+    def set(self, key, value, *args, **kwargs):
+        with self._measure('write', [key]) as call:
+            self._sample_sizes(call, [(key, value)])
+            call.count('sets', key)
+            return super().set(key, value, *args, **kwargs)
+
+    def add(self, key, value, *args, **kwargs):
+        with self._measure('write', [key]) as call:
+            self._sample_sizes(call, [(key, value)])
+            call.count('sets', key)
+            return super().add(key, value, *args, **kwargs)
+
+    def incr(self, key, *args, **kwargs):
+        with self._measure('write', [key]) as call:
+            call.count('sets', key)
+            return super().incr(key, *args, **kwargs)
+
+    def decr(self, key, *args, **kwargs):
+        with self._measure('write', [key]) as call:
+            call.count('sets', key)
+            return super().decr(key, *args, **kwargs)
+
+    def touch(self, key, *args, **kwargs):
+        with self._measure('write', [key]) as call:
+            call.count('sets', key)
+            return super().touch(key, *args, **kwargs)
+
+    def set_many(self, data, *args, **kwargs):
+        with self._measure('write', list(data)) as call:
+            self._sample_sizes(call, data.items())
+            for key in data:
+                call.count('sets', key)
+            return super().set_many(data, *args, **kwargs)
+
+    def delete(self, key, *args, **kwargs):
+        with self._measure('write', [key]) as call:
+            call.count('deletes', key)
+            return super().delete(key, *args, **kwargs)
+
+    def delete_many(self, keys, *args, **kwargs):
+        keys = list(keys)
+        with self._measure('write', keys) as call:
+            for key in keys:
+                call.count('deletes', key)
+            return super().delete_many(keys, *args, **kwargs)
+
+    def flush_metrics(self, wait=True):
+        """
+        Adds this process's pending counts to the shared per-family totals on
+        the metrics thread. With wait=True, returns once they and every
+        earlier flush are published.
+        """
+        future = _get_flush_executor().submit(self._publish_pending, recorder.drain())
+        if wait:
+            future.result()
+
+    def _publish_pending(self, pending):
+        if not pending:
+            return
+        try:
+            self._publish_metrics(pending)
+        except Exception:
+            # Metrics must never break a request; this batch is dropped
+            logger.exception("Could not publish cache metrics for %d key families", len(pending))
+
+    def _publish_metrics(self, pending):
+        # Non-Redis backends (development): read-modify-write one dict per family
+        families = super().get(FAMILIES_KEY) or set()
+        for family, counts in pending.items():
+            key = f'{METRICS_PREFIX}:{family}'
+            stored = super().get(key) or Counter()
+            stored.update(counts)
+            super().set(key, stored, None)
+            families.add(family)
+        super().set(FAMILIES_KEY, families, None)
+
+    def read_metrics(self):
+        """{family: Counter of fields} summed over every process that flushed."""
+        metrics = {}
+        for family in super().get(FAMILIES_KEY) or set():
+            metrics[family] = Counter(super().get(f'{METRICS_PREFIX}:{family}') or {})
+        return metrics
+
+    def reset_metrics(self):
+        for family in super().get(FAMILIES_KEY) or set():
+            super().delete(f'{METRICS_PREFIX}:{family}')
+        super().delete(FAMILIES_KEY)
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+try:
+    from django_redis.cache import RedisCache
+except ImportError:  # Redis backend not installed (simple local setups)
+    RedisCache = None
+
+if RedisCache is not None:
+    class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+        """Publishes metrics as one Redis hash per family, with HINCRBY in a pipeline."""
+
+        def _connection(self, raw_key):
+            client = self.client
+            if hasattr(client, 'get_server'):
+                # ShardClient: the hash lives on the shard its key maps to
+                return client.get_server(raw_key)
+            return client.get_client(write=True)
+
+        def _publish_metrics(self, pending):
+            families_key = self.make_key(FAMILIES_KEY)
+            pipelines = {}
+            for family, counts in pending.items():
+                key = self.make_key(f'{METRICS_PREFIX}:{family}')
+                connection = self._connection(key)
+                pipe = pipelines.setdefault(id(connection), connection.pipeline(transaction=False))
+                for field, amount in counts.items():
+                    if isinstance(amount, float):
+                        pipe.hincrbyfloat(key, field, amount)
+                    else:
+                        pipe.hincrby(key, field, amount)
+            families_connection = self._connection(families_key)
+            pipe = pipelines.setdefault(id(families_connection), families_connection.pipeline(transaction=False))
+            pipe.sadd(families_key, *pending)
+            for pipe in pipelines.values():
+                pipe.execute()
+
+        def read_metrics(self):
+            families_key = self.make_key(FAMILIES_KEY)
+            families = {
+                member.decode() if isinstance(member, bytes) else member
+                for member in self._connection(families_key).smembers(families_key)
+            }
+            metrics = {}
+            for family in families:
+                key = self.make_key(f'{METRICS_PREFIX}:{family}')
+                raw = self._connection(key).hgetall(key)
+                metrics[family] = Counter({
+                    field.decode(): float(value) if b'.' in value else int(value) for field, value in raw.items()
+                })
+            return metrics
+
+        def reset_metrics(self):
+            families_key = self.make_key(FAMILIES_KEY)
+            for family in self.read_metrics():
+                key = self.make_key(f'{METRICS_PREFIX}:{family}')
+                self._connection(key).delete(key)
+            self._connection(families_key).delete(families_key)
+
+
+def _percentile(counts, kind, total, fraction):
+    if not total:
+        return None
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS + ('inf',):
+        seen += counts.get(f'{kind}_le_{bound}', 0)
+        if seen >= total * fraction:
+            return bound
+    return 'inf'
+
+
+def summarize(counts):
+    """Derived numbers for one family: hit ratio, average size, latency percentiles."""
+    hits, misses = counts.get('hits', 0), counts.get('misses', 0)
+    lookups = hits + misses
+    summary = {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / lookups, 4) if lookups else None,
+        'sets': counts.get('sets', 0),
+        'deletes': counts.get('deletes', 0),
+        'avg_size': counts['size_bytes'] // counts['size_samples'] if counts.get('size_samples') else None,
+    }
+    for kind in LATENCY_KINDS:
+        total = sum(counts.get(f'{kind}_le_{bound}', 0) for bound in LATENCY_BUCKETS_MS + ('inf',))
+        summary[kind] = {
+            'ops': total,
+            'avg_ms': round(counts.get(f'{kind}_ms', 0) / total, 3) if total else None,
+            'p50_ms': _percentile(counts, kind, total, 0.5),
+            'p95_ms': _percentile(counts, kind, total, 0.95),
+            'p99_ms': _percentile(counts, kind, total, 0.99),
+            'histogram': [
+                (bound, counts.get(f'{kind}_le_{bound}', 0)) for bound in LATENCY_BUCKETS_MS + ('inf',)
+            ],
+        }
+    return summary
+
+
+def report(cache=None):
+    """
+    Per-family summaries, busiest first, after flushing this process.
+    Empty when the configured backend is not instrumented.
+    """
+    if cache is None:
+        from django.core.cache import cache
+    if not hasattr(cache, 'read_metrics'):
+        return {}
+    cache.flush_metrics()
+    summaries = {family: summarize(counts) for family, counts in cache.read_metrics().items()}
+    return dict(sorted(
+        summaries.items(), key=lambda item: -(item[1]['read']['ops'] + item[1]['write']['ops'])
+    ))
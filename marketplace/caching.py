@@ -0,0 +1,621 @@
+# marketplace/caching.py
+"""
+Declared cache namespaces with generation-based invalidation.
+
+Every cached object is registered below as a Namespace: its key arguments,
+TTL and the entities it is built from ("tags", e.g. a product page depends
+on ('product', pk), ('user', seller_id) and ('game', game_id)). Each tag has
+a generation token in the cache. An entry stores the tokens its tags had when
+it was written, and a read whose tokens have since moved is a miss.
+
+Writers never build or delete keys: saving or deleting a model bumps the
+tags listed in MODEL_TAGS (connected in signals.py), and code that changes
+rows with queryset.update() calls bump() itself. Every bump of an entity
+also bumps its ('entity', '*') tag, which collection caches depend on.
+
+Catalog namespaces (games, categories, filter trees, flat pages) also keep a
+per-process tier: a bounded LRU holding the live objects for a short TTL, in
+front of the shared cache. A local entry records the catalog version it was
+stored under; bumping any LOCAL_ENTITIES tag moves that version, so every
+worker drops its local entries at once. Inside a request the version is read
+at most once (SiteConfigMiddleware opens the scope). Hits and misses are
+counted per namespace and tier, see tier_stats().
+
+Read through Namespace.get_or_set() wherever a value can be rebuilt: it
+rebuilds each entry in one worker at a time, refreshes hot entries slightly
+before they expire, and can serve the previous value while the rebuild runs.
+"""
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+
+from .snapshots import codec
+
+logger = logging.getLogger(__name__)
+
+ALL = '*'
+NAMESPACES = {}
+
+# Entities whose bumps move the catalog version (and so clear local tiers)
+LOCAL_ENTITIES = frozenset({'game', 'category', 'game_category', 'filter', 'flatpage'})
+CATALOG_VERSION_KEY = 'gen:catalog'
+LOCAL_MAX_ENTRIES = getattr(settings, 'LOCAL_CACHE_MAX_ENTRIES', 2000)
+STATS_KEY_PREFIX = 'cache_stats'
+STATS_FLUSH_EVERY = 100
+TIER_COUNTERS = ('local_hit', 'local_miss', 'shared_hit', 'shared_miss', 'shared_stale')
+
+# Single-flight rebuilds: lock lifetime, and how long other readers wait on it
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 1.0
+LOCK_POLL = 0.05
+
+# Shared entry states, see Namespace._load()
+FRESH = 'fresh'
+REFRESH = 'refresh'
+INVALID = 'invalid'
+
+_MISSING = object()
+_refresh_executor = None
+_refresh_executor_lock = threading.Lock()
+# Per-request scratch space; None outside a request, so commands always check
+_request_state = ContextVar('cache_request_state', default=None)
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def _generation_key(entity, entity_id):
+    return f'gen:{entity}:{entity_id}'
+
+
+def generations(tags):
+    """
+    Current tokens for `tags`, in order, in one round trip. A missing token
+    (never bumped, or evicted) is published fresh, so an entry written
+    before an eviction can never match again.
+    """
+    keys = [_generation_key(entity, entity_id) for entity, entity_id in tags]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_token(), None)
+        found.update(cache.get_many(missing))
+    return [found.get(key) for key in keys]
+
+
+def bump(entity, *entity_ids):
+    """
+    Invalidates everything cached from these entities. Bumped immediately
+    and again on commit, so a reader cannot cache pre-commit rows under the
+    new generation.
+    """
+    keys = [_generation_key(entity, entity_id) for entity_id in set(entity_ids) if entity_id is not None]
+    if not keys:
+        return
+    keys.append(_generation_key(entity, ALL))
+    if entity in LOCAL_ENTITIES:
+        keys.append(CATALOG_VERSION_KEY)
+
+    def publish():
+        cache.set_many({key: _new_token() for key in keys}, None)
+        state = _request_state.get()
+        if state is not None:
+            # This request must see its own writes, not the version it read
+            state.pop('catalog_version', None)
+
+    publish()
+    transaction.on_commit(publish)
+
+
+def bump_tags(tags):
+    entities = {}
+    for entity, entity_id in tags:
+        entities.setdefault(entity, []).append(entity_id)
+    for entity, entity_ids in entities.items():
+        bump(entity, *entity_ids)
+
+
+def catalog_version():
+    """The shared catalog version, read at most once per request."""
+    state = _request_state.get()
+    if state is not None and 'catalog_version' in state:
+        return state['catalog_version']
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Evicted or never published: publish one so all workers agree on it
+        cache.add(CATALOG_VERSION_KEY, _new_token(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    if state is not None:
+        state['catalog_version'] = version
+    return version
+
+
+@contextmanager
+def request_scope():
+    """Limits catalog version checks to one for the code run inside (one request)."""
+    token = _request_state.set({})
+    try:
+        yield
+    finally:
+        _request_state.reset(token)
+
+
+class LocalTier:
+    """
+    Per-process LRU of live objects. Bounded by entry count; each entry
+    expires after its namespace's local TTL or when the catalog version it
+    was stored under is no longer current.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, stored_version, value = entry
+            if stored_version != version or expires <= time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, version, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_tier = LocalTier(LOCAL_MAX_ENTRIES)
+
+_pending_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _stats_key(name, counter):
+    return f'{STATS_KEY_PREFIX}:{name}:{counter}'
+
+
+def _count(name, counter):
+    global _pending_stats
+    with _stats_lock:
+        _pending_stats[(name, counter)] += 1
+        if sum(_pending_stats.values()) < STATS_FLUSH_EVERY:
+            return
+        pending, _pending_stats = _pending_stats, Counter()
+    _publish_stats(pending)
+
+
+def _publish_stats(pending):
+    for (name, counter), amount in pending.items():
+        key = _stats_key(name, counter)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # First count, or evicted: start it (another worker may win the add)
+            if not cache.add(key, amount, None):
+                cache.incr(key, amount)
+
+
+def flush_tier_stats():
+    """Adds this process's unpublished hit/miss counts to the shared counters."""
+    global _pending_stats
+    with _stats_lock:
+        pending, _pending_stats = _pending_stats, Counter()
+    _publish_stats(pending)
+
+
+def tier_stats():
+    """
+    Hits, misses and hit ratio per namespace and tier, summed over every
+    worker: {'game_detail': {'local': {...}, 'shared': {...}}}. A shared
+    lookup only happens after a local miss on local namespaces. Shared misses
+    answered with a stale value while another worker rebuilt it are also
+    counted as 'stale'.
+    """
+    flush_tier_stats()
+    keys = {_stats_key(name, counter): (name, counter) for name in NAMESPACES for counter in TIER_COUNTERS}
+    found = cache.get_many(list(keys))
+    report = {}
+    for name, namespace in NAMESPACES.items():
+        tiers = {}
+        for tier in ('local', 'shared'):
+            if tier == 'local' and not namespace.local_timeout:
+                continue
+            hits = found.get(_stats_key(name, f'{tier}_hit'), 0)
+            misses = found.get(_stats_key(name, f'{tier}_miss'), 0)
+            lookups = hits + misses
+            tiers[tier] = {
+                'hits': hits, 'misses': misses,
+                'ratio': round(hits / lookups, 4) if lookups else None,
+            }
+        tiers['shared']['stale'] = found.get(_stats_key(name, 'shared_stale'), 0)
+        report[name] = tiers
+    return report
+
+
+class Namespace:
+    """
+    One kind of cached object. `tags(*args, value)` returns the (entity, id)
+    pairs the value was built from; it sees the value so dependencies only
+    known after loading (a product's seller) can be declared.
+
+    With `local_timeout` set, values are also kept in this process for that
+    many seconds. Local values are shared between requests, so callers must
+    treat them as read-only, and every tag must be one of LOCAL_ENTITIES.
+
+    Shared entries are fresh for `timeout` seconds and kept `stale_ttl`
+    seconds longer, during which get_or_set() may serve them while one worker
+    refreshes (see get_or_set). `beta` scales probabilistic early refresh.
+
+    With a `codec` (snapshots.codec) values are stored as its bytes instead
+    of being pickled; the local tier keeps the decoded objects. Keys then
+    include the codec's layout_version, and an entry that does not decode
+    is treated as missing.
+    """
+
+    def __init__(self, name, timeout, tags, description, local_timeout=None, stale_ttl=0, beta=1.0, codec=None):
+        self.name = name
+        self.timeout = timeout
+        self.tags = tags
+        self.description = description
+        self.local_timeout = min(local_timeout, timeout) if local_timeout else None
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self.codec = codec
+
+    def key(self, *args):
+        prefix = ['ns', self.name]
+        if self.codec:
+            # A deploy that changes a snapshot class starts on fresh keys
+            prefix.append(f'v{self.codec.layout_version}')
+        return ':'.join([*prefix, *(str(arg) for arg in args)])
+
+    def _get_local(self, key):
+        version = catalog_version()
+        value = local_tier.get(key, version)
+        _count(self.name, 'local_miss' if value is _MISSING else 'local_hit')
+        return value, version
+
+    def _load(self, key):
+        """
+        Reads the shared entry: (state, value), state being FRESH, REFRESH
+        (valid but due: expired or picked for early refresh), INVALID (a tag
+        has been bumped since) or None when nothing is stored.
+        """
+        stored = cache.get(key)
+        if stored is None or len(stored) != 5:
+            return None, None
+        tags, tokens, value, expires_at, delta = stored
+        if self.codec:
+            try:
+                value = self.codec.loads(value)
+            except Exception:
+                logger.warning("Could not decode %s, treating it as a miss", key, exc_info=True)
+                return None, None
+        if tags and generations(tags) != tokens:
+            return INVALID, value
+        # XFetch: the closer the expiry and the slower the rebuild, the more
+        # likely one reader refreshes early, so readers rarely expire together
+        now = time.time()
+        if now - delta * self.beta * math.log(1.0 - random.random()) >= expires_at:
+            return REFRESH, value
+        return FRESH, value
+
+    def get(self, *args, default=None):
+        key = self.key(*args)
+        if self.local_timeout:
+            value, version = self._get_local(key)
+            if value is not _MISSING:
+                return value
+
+        state, value = self._load(key)
+        if state is FRESH or state is REFRESH:
+            _count(self.name, 'shared_hit')
+            if self.local_timeout:
+                local_tier.set(key, value, version, self.local_timeout)
+            return value
+        _count(self.name, 'shared_miss')
+        return default
+
+    def set(self, value, *args, delta=0.0):
+        """Stores `value`; `delta` is how many seconds it took to build."""
+        key = self.key(*args)
+        tags = list(self.tags(*args, value=value))
+        if self.local_timeout:
+            outside = {entity for entity, _ in tags} - LOCAL_ENTITIES
+            if outside:
+                raise ValueError(f"Local namespace '{self.name}' depends on non-catalog entities {sorted(outside)}")
+            # Read before publishing, like get(): a bump in between only expires it early
+            version = catalog_version()
+        payload = self.codec.dumps(value) if self.codec else value
+        entry = (tags, generations(tags), payload, time.time() + self.timeout, delta)
+        cache.set(key, entry, self.timeout + self.stale_ttl)
+        if self.local_timeout:
+            local_tier.set(key, value, version, self.local_timeout)
+        return value
+
+    def get_or_set(self, *args, compute):
+        """
+        Returns the cached value, building it with `compute()` at most once
+        across workers at a time:
+
+        - fresh: returned as is.
+        - due for refresh (expired within stale_ttl, or picked early): the
+          current value is returned and whoever takes the lock rebuilds it
+          in the background.
+        - invalidated: the lock holder rebuilds inline; with stale_ttl the
+          other readers get the old value meanwhile.
+        - missing: the lock holder rebuilds inline; the others wait up to
+          LOCK_WAIT for its result before building it themselves.
+
+        A `compute()` returning None is not cached.
+        """
+        key = self.key(*args)
+        version = None
+        if self.local_timeout:
+            value, version = self._get_local(key)
+            if value is not _MISSING:
+                return value
+
+        state, value = self._load(key)
+        if state is FRESH:
+            _count(self.name, 'shared_hit')
+            if self.local_timeout:
+                local_tier.set(key, value, version, self.local_timeout)
+            return value
+        if state is REFRESH:
+            _count(self.name, 'shared_hit')
+            if _acquire(key):
+                _refresh_later(self, args, compute)
+            return value
+
+        _count(self.name, 'shared_miss')
+        if _acquire(key):
+            try:
+                return self._build(args, compute)
+            finally:
+                _release(key)
+        if state is INVALID and self.stale_ttl:
+            _count(self.name, 'shared_stale')
+            return value
+
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline and cache.get(_lock_key(key)) is not None:
+            time.sleep(LOCK_POLL)
+        state, value = self._load(key)
+        if state is FRESH or state is REFRESH:
+            return value
+        return self._build(args, compute)
+
+    def warm(self, *args, compute, force=False):
+        """
+        Builds the entry ahead of its first reader, unless a fresh one is
+        cached (and not `force`) or another worker is already building it.
+        Returns True when this call built it.
+        """
+        key = self.key(*args)
+        if not force and self._load(key)[0] is FRESH:
+            return False
+        if not _acquire(key):
+            return False
+        try:
+            self._build(args, compute)
+        finally:
+            _release(key)
+        return True
+
+    def _build(self, args, compute):
+        started = time.perf_counter()
+        value = compute()
+        if value is not None:
+            self.set(value, *args, delta=time.perf_counter() - started)
+        return value
+
+    def __repr__(self):
+        return f'<Namespace {self.name}>'
+
+
+def _lock_key(key):
+    return f'lock:{key}'
+
+
+def _acquire(key):
+    """Single-flight: only the worker that adds the lock key rebuilds `key`."""
+    return cache.add(_lock_key(key), 1, LOCK_TIMEOUT)
+
+
+def _release(key):
+    cache.delete(_lock_key(key))
+
+
+def _get_refresh_executor():
+    global _refresh_executor
+    if _refresh_executor is None:
+        with _refresh_executor_lock:
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'CACHE_REFRESH_WORKERS', 2),
+                    thread_name_prefix='cache-refresh',
+                )
+    return _refresh_executor
+
+
+def _refresh_later(namespace, args, compute):
+    """Rebuilds an entry off the request path; the caller already holds its lock."""
+    if getattr(settings, 'CACHE_REFRESH_ASYNC', True):
+        _get_refresh_executor().submit(_refresh_in_worker, namespace, args, compute)
+    else:
+        _refresh(namespace, args, compute)
+
+
+def _refresh_in_worker(namespace, args, compute):
+    close_old_connections()
+    try:
+        _refresh(namespace, args, compute)
+    finally:
+        close_old_connections()
+
+
+def _refresh(namespace, args, compute):
+    key = namespace.key(*args)
+    try:
+        namespace._build(args, compute)
+    except Exception:
+        # Readers keep getting the current value until it expires
+        logger.exception("Refreshing cache entry %s failed", key)
+    finally:
+        _release(key)
+
+
+def register(name, timeout, tags, description, **options):
+    if name in NAMESPACES:
+        raise ValueError(f"Cache namespace '{name}' is already registered")
+    namespace = Namespace(name, timeout, tags, description, **options)
+    NAMESPACES[name] = namespace
+    return namespace
+
+
+# --- Registry: every cached object in the marketplace app ---
+
+PRODUCT_DETAIL = register(
+    'product_detail', 300,
+    lambda pk, value: [('product', pk), ('user', value.seller.pk), ('game', value.game.pk)],
+    'Product page ProductSnapshot (with seller, images and filter options), by product pk.',
+    stale_ttl=60,
+    codec=codec,
+)
+GAME_DETAIL = register(
+    'game_detail', 300,
+    lambda pk, value: [('game', pk)] + [('category', category.pk) for category in value['categories']],
+    'Game page: the game and its categories in admin order (snapshots), by game pk.',
+    local_timeout=60,
+    stale_ttl=300,
+    codec=codec,
+)
+GAME_CATEGORY = register(
+    'game_category', 600,
+    lambda game_pk, category_pk, value: [
+        ('game', game_pk), ('category', category_pk), ('game_category', value[2].pk),
+    ] + ([('filter', value[2].primary_filter.pk)] if value[2].primary_filter else []),
+    'Listing page header: (game, category, GameCategory link with its primary filter) snapshots, '
+    'by game and category pk.',
+    local_timeout=60,
+    stale_ttl=600,
+    codec=codec,
+)
+CATEGORY_FILTERS = register(
+    'category_filters', 600,
+    lambda game_category_pk, value: [('game_category', game_category_pk), ('filter', ALL)],
+    "A GameCategory's filters in display order with their options (snapshots), by GameCategory pk.",
+    local_timeout=60,
+    stale_ttl=600,
+    codec=codec,
+)
+HOME_GAMES = register(
+    'home_games_list', 600,
+    lambda value: [('game', ALL), ('category', ALL)],
+    'Every game with its ordered categories (snapshots), for the home page.',
+    local_timeout=60,
+    stale_ttl=600,
+    codec=codec,
+)
+TOTAL_GAMES = register(
+    'total_games_count', 1800,
+    lambda value: [('game', ALL)],
+    'Number of games, shown in the site-wide context.',
+    local_timeout=60,
+    stale_ttl=1800,
+)
+SEARCH = register(
+    'search', 120,
+    lambda query, value: [('game', ALL), ('category', ALL)],
+    'Live search results (games and category links), by lower-cased query.',
+    local_timeout=60,
+    stale_ttl=120,
+    codec=codec,
+)
+FLAT_PAGE = register(
+    'flat_page', 3600,
+    lambda slug, value: [('flatpage', value.pk)],
+    'A FlatPageSnapshot, by slug.',
+    local_timeout=300,
+    stale_ttl=3600,
+    codec=codec,
+)
+REVIEW_STATS = register(
+    'review_stats', 600,
+    lambda seller_id, value: [('reviews', seller_id)],
+    "Average rating and review count for a seller.",
+    stale_ttl=600,
+)
+MESSAGE_COUNT = register(
+    'conversation_message_count', 300,
+    lambda conversation_id, value: [('conversation', conversation_id)],
+    'Number of messages in a conversation.',
+)
+USER_NOTIFICATIONS = register(
+    'user_notifications', 60,
+    lambda user_id, value: [('notifications', user_id)],
+    'Navbar counters (active purchases/sales, unread conversations) for a user.',
+    stale_ttl=60,
+)
+USER_BALANCE = register(
+    'user_balance', 300,
+    lambda user_id, value: [('balance', user_id)],
+    "A user's balance (sum of COMPLETED transactions), as a string.",
+)
+USER_HELD_BALANCE = register(
+    'user_held_balance', 120,
+    lambda user_id, value: [('held_balance', user_id)],
+    "A user's unreleased held funds, as a string.",
+)
+
+# Tags bumped when an instance of these models is saved or deleted
+MODEL_TAGS = {
+    'marketplace.Product': lambda obj: [('product', obj.pk)],
+    'marketplace.ProductImage': lambda obj: [('product', obj.product_id)],
+    'marketplace.Game': lambda obj: [('game', obj.pk)],
+    'marketplace.Category': lambda obj: [('category', obj.pk)],
+    'marketplace.GameCategory': lambda obj: [
+        ('game', obj.game_id), ('category', obj.category_id), ('game_category', obj.pk),
+    ],
+    'marketplace.Filter': lambda obj: [('filter', obj.pk)],
+    'marketplace.FilterOption': lambda obj: [('filter', obj.filter_id)],
+    'marketplace.FlatPage': lambda obj: [('flatpage', obj.pk)],
+    'auth.User': lambda obj: [('user', obj.pk)],
+    'marketplace.Profile': lambda obj: [('user', obj.user_id)],
+    'marketplace.Review': lambda obj: [('reviews', obj.seller_id)],
+    'marketplace.Message': lambda obj: [('conversation', obj.conversation_id)],
+}
+
+
+def tags_for_instance(instance):
+    tags = MODEL_TAGS.get(instance._meta.label)
+    return tags(instance) if tags else []
@@ -1,6 +1,5 @@
 # marketplace/consumers.py
 
-import json
 import asyncio
 import logging
 from datetime import timedelta
@@ -11,13 +10,17 @@ from django.db import models
 from django.utils import timezone
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from django.core.cache import cache
+from . import caching
+
+from .ws_framing import FramedConsumerMixin
 
 # NOTE: All model imports have been removed from the top level to prevent the AppRegistryNotReady error.
 # They are now "lazily" imported inside the functions that need them.
 # from django.contrib.auth.models import User  <-- REMOVED
 # from .models import Conversation, Message, Profile <-- REMOVED
 
+logger = logging.getLogger(__name__)
+
 # Security logging
 security_logger = logging.getLogger('security.websocket')
 
@@ -69,7 +72,7 @@ def mark_message_as_read_in_db(message_id, user):
             message.is_read = True
             message.save(update_fields=['is_read'])
             # Clear the cached notification counts so a quick refresh shows the latest numbers
-            cache.delete(f'user_notifications_{user.id}')
+            caching.bump('notifications', user.id)
             return message
         return None # Return None if no update was needed
     except Message.DoesNotExist:
@@ -199,11 +202,99 @@ async def broadcast_offline_status_for_user(user, channel_layer):
     # Mark that we've broadcasted this user's offline status
     await mark_offline_broadcasted(user)
 
+async def refresh_presence(user, channel_layer):
+    """
+    Marks the user as online, tells their conversation partners and flushes
+    any pending offline broadcasts. Runs on connect and on every heartbeat.
+    """
+    # Update last_seen timestamp
+    await update_user_last_seen(user)
+
+    # Broadcast current online status to conversation partners
+    await broadcast_presence(user, {
+        'username': user.username,
+        'is_online': True,
+        'last_seen_iso': timezone.now().isoformat()
+    }, channel_layer)
+
+    # Check for recently offline users and broadcast their status
+    recently_offline = await get_recently_offline_users()
+    for profile in recently_offline:
+        await broadcast_offline_status_for_user(profile.user, channel_layer)
+
+# --- Chat Room Helpers ---
+
+@database_sync_to_async
+def get_authorized_conversation(user, other_username, scope=None):
+    """
+    Returns the existing conversation between `user` and `other_username` if
+    the user may join its chat group, otherwise None. Mirrors the checks
+    ChatConsumer.connect() performs, including the security logging.
+    """
+    from django.contrib.auth.models import User  # LAZY IMPORT
+    from .models import Conversation  # LAZY IMPORT
+    client_ip = (scope or {}).get('client', ['unknown'])[0]
+
+    try:
+        other_user = User.objects.get(username=other_username)
+    except User.DoesNotExist:
+        security_logger.warning(
+            f"WebSocket subscription attempt to non-existent user '{other_username}' by {user.username} "
+            f"from {client_ip}"
+        )
+        return None
+
+    # Canonical ordering for participants to prevent duplicate conversations
+    user1, user2 = (user, other_user) if user.id < other_user.id else (other_user, user)
+    conversation = Conversation.objects.select_related(
+        'participant1', 'participant2', 'moderator'
+    ).filter(participant1=user1, participant2=user2).first()
+    if not conversation:
+        security_logger.warning(
+            f"Unauthorized WebSocket subscription by {user.username} to chat with {other_username} "
+            f"(no existing conversation) from {client_ip}"
+        )
+        return None
+
+    if not (conversation.is_participant(user) or user.is_staff or user.is_superuser):
+        security_logger.error(
+            f"CRITICAL: User {user.username} attempted to subscribe to conversation {conversation.id} "
+            f"where they are not a participant from {client_ip}"
+        )
+        return None
+
+    return conversation
+
+@database_sync_to_async
+def get_conversation_by_id(conversation_id):
+    from .models import Conversation  # LAZY IMPORT
+    return Conversation.objects.filter(id=conversation_id).first()
+
+async def mark_conversation_read(conversation, user, channel_layer):
+    """Marks every message the user received in the conversation as read."""
+    # Batch update for better performance
+    @database_sync_to_async
+    def batch_update_messages():
+        return conversation.messages.filter(is_read=False).exclude(sender=user).update(is_read=True)
+
+    updated_count = await batch_update_messages()
+
+    # If any messages were updated, we need to send a notification
+    if updated_count > 0:
+        # Get the last message efficiently
+        @database_sync_to_async
+        def get_last_message():
+            return conversation.messages.select_related('conversation').last()
+
+        last_message = await get_last_message()
+        if last_message:
+            await notify_read_receipt(last_message, user, channel_layer)
+
 # --- Offline Status Checking ---
 
 # --- Main Consumers ---
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         if not self.user.is_authenticated:
@@ -258,7 +349,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_group_name = f'chat_{self.conversation.id}'
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_negotiated()
 
         # Mark messages as read upon connection
         await self.mark_messages_as_read(self.conversation, self.user)
@@ -267,12 +358,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if hasattr(self, 'room_group_name') and self.room_group_name:
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Handles inbound events from the client, like "mark as read".
         """
         try:
-            data = json.loads(text_data)
+            data = self.decode_frame(text_data, bytes_data)
             event_type = data.get('type')
 
             if event_type == 'mark_as_read' and self.user.is_authenticated:
@@ -289,10 +380,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             elif event_type == 'ping':
                 # Handle heartbeat ping - respond with pong
-                await self.send(text_data=json.dumps({
+                await self.send_frame({
                     'type': 'pong',
                     'timestamp': timezone.now().isoformat()
-                }))
+                })
 
         except Exception as e:
             # It's good practice to log errors, even if we don't crash the consumer.
@@ -311,11 +402,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # the tab is not active or browser is minimized
 
         # The event now contains the pre-rendered HTML, which we forward directly.
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'new_message',
             'message_html': message_html,
             'message_id': message_id
-        }))
+        })
 
     # --- Helper Methods for ChatConsumer ---
 
@@ -386,26 +477,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def mark_messages_as_read(self, conversation, user):
         """Marks all messages in the conversation as read when it's opened by the recipient."""
-        # Batch update for better performance
-        @database_sync_to_async
-        def batch_update_messages():
-            return conversation.messages.filter(is_read=False).exclude(sender=user).update(is_read=True)
-
-        updated_count = await batch_update_messages()
-
-        # If any messages were updated, we need to send a notification
-        if updated_count > 0:
-            # Get the last message efficiently
-            @database_sync_to_async
-            def get_last_message():
-                return conversation.messages.select_related('conversation').last()
-
-            last_message = await get_last_message()
-            if last_message:
-                await notify_read_receipt(last_message, user, self.channel_layer)
+        await mark_conversation_read(conversation, user, self.channel_layer)
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         if not self.user.is_authenticated:
@@ -414,20 +489,10 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
         self.room_group_name = f"notifications_{self.user.username}"
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_negotiated()
 
         # Update presence on connection
-        await update_user_last_seen(self.user)
-        await broadcast_presence(self.user, {
-            'username': self.user.username,
-            'is_online': True,
-            'last_seen_iso': timezone.now().isoformat()
-        }, self.channel_layer)
-
-        # Check for recently offline users on connection
-        recently_offline = await get_recently_offline_users()
-        for profile in recently_offline:
-            await broadcast_offline_status_for_user(profile.user, self.channel_layer)
+        await refresh_presence(self.user, self.channel_layer)
 
     async def disconnect(self, close_code):
         if hasattr(self, 'user') and self.user.is_authenticated:
@@ -439,29 +504,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Handles heartbeat pings from the client to update the user's online status.
         """
         try:
-            data = json.loads(text_data)
+            data = self.decode_frame(text_data, bytes_data)
             if data.get('type') == 'heartbeat':
-                # Update last_seen timestamp
-                await update_user_last_seen(self.user)
-
-                # Broadcast current online status to conversation partners
-                await broadcast_presence(self.user, {
-                    'username': self.user.username,
-                    'is_online': True,
-                    'last_seen_iso': timezone.now().isoformat()
-                }, self.channel_layer)
-
-                # Check for recently offline users and broadcast their status
-                recently_offline = await get_recently_offline_users()
-                for profile in recently_offline:
-                    await broadcast_offline_status_for_user(profile.user, self.channel_layer)
+                await refresh_presence(self.user, self.channel_layer)
 
-        except (json.JSONDecodeError, Exception) as e:
+        except Exception as e:
             print(f"WebSocket receive error for {self.user.username}: {e}")
             pass
 
@@ -469,7 +521,218 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """
         Sends a notification from the channel layer to the client's WebSocket.
         """
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
+            'type': event['notification_type'],
+            'data': event['data']
+        })
+
+
+class MultiplexConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
+    """
+    One socket per tab for every realtime stream the page needs.
+
+    Instead of opening ws/notifications/ plus one ws/chat/<username>/ socket
+    per open conversation, the client opens ws/multiplex/ once and manages
+    streams with small JSON frames:
+
+        {"action": "subscribe", "stream": "notifications"}
+        {"action": "subscribe", "stream": "chat", "username": "bob"}
+        {"action": "unsubscribe", "stream": "chat", "username": "bob"}
+        {"stream": "chat", "username": "bob", "type": "mark_as_read", "message_id": 1}
+        {"stream": "notifications", "type": "heartbeat"}
+        {"type": "ping"}
+
+    Every outgoing frame carries the same payload the legacy consumers send,
+    tagged with "stream" (and "username" for chat) so the client can route it.
+    Frames are JSON unless the client negotiated MessagePack (see ws_framing).
+    Chat subscriptions go through the same authorization checks as ChatConsumer.
+    """
+
+    NOTIFICATIONS_STREAM = 'notifications'
+    CHAT_STREAM = 'chat'
+    # Upper bound on chat rooms a single socket may join, so one tab cannot
+    # add itself to an unbounded number of channel layer groups.
+    MAX_CHAT_SUBSCRIPTIONS = 20
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.notifications_group = None
+        # conversation id -> (username, group name) for every joined chat room
+        self.chat_subscriptions = {}
+        await self.accept_negotiated()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'chat_subscriptions'):
+            return
+
+        for _username, group_name in self.chat_subscriptions.values():
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+        self.chat_subscriptions = {}
+
+        if self.notifications_group:
+            # Update last_seen on disconnect, same as NotificationConsumer
+            await update_user_last_seen(self.user)
+            await self.channel_layer.group_discard(self.notifications_group, self.channel_name)
+            self.notifications_group = None
+
+    async def send_error(self, error, **extra):
+        await self.send_frame({'type': 'error', 'error': error, **extra})
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.decode_frame(text_data, bytes_data)
+        except ValueError:
+            await self.send_error('invalid_frame')
+            return
+
+        try:
+            action = data.get('action')
+            if action == 'subscribe':
+                await self.handle_subscribe(data)
+            elif action == 'unsubscribe':
+                await self.handle_unsubscribe(data)
+            elif data.get('type') == 'ping':
+                await self.send_frame({
+                    'type': 'pong',
+                    'timestamp': timezone.now().isoformat()
+                })
+            elif data.get('stream') == self.NOTIFICATIONS_STREAM:
+                await self.handle_notifications_event(data)
+            elif data.get('stream') == self.CHAT_STREAM:
+                await self.handle_chat_event(data)
+            else:
+                await self.send_error('unknown_frame')
+        except Exception:
+            logger.exception("MultiplexConsumer receive error for %s", self.user.username)
+
+    # --- Subscription management ---
+
+    async def handle_subscribe(self, data):
+        stream = data.get('stream')
+
+        if stream == self.NOTIFICATIONS_STREAM:
+            if not self.notifications_group:
+                self.notifications_group = f"notifications_{self.user.username}"
+                await self.channel_layer.group_add(self.notifications_group, self.channel_name)
+                await refresh_presence(self.user, self.channel_layer)
+            await self.send_frame({'type': 'subscribed', 'stream': stream})
+            return
+
+        if stream == self.CHAT_STREAM:
+            username = data.get('username')
+            if not username or not isinstance(username, str):
+                await self.send_error('username_required', stream=stream)
+                return
+
+            conversation = await get_authorized_conversation(self.user, username, self.scope)
+            if not conversation:
+                await self.send_error('forbidden', stream=stream, username=username)
+                return
+
+            if conversation.id not in self.chat_subscriptions:
+                if len(self.chat_subscriptions) >= self.MAX_CHAT_SUBSCRIPTIONS:
+                    await self.send_error('too_many_subscriptions', stream=stream, username=username)
+                    return
+                group_name = f'chat_{conversation.id}'
+                self.chat_subscriptions[conversation.id] = (username, group_name)
+                await self.channel_layer.group_add(group_name, self.channel_name)
+                await mark_conversation_read(conversation, self.user, self.channel_layer)
+
+            await self.send_frame({
+                'type': 'subscribed',
+                'stream': stream,
+                'username': username,
+                'conversation_id': conversation.id,
+            })
+            return
+
+        await self.send_error('unknown_stream', stream=stream)
+
+    async def handle_unsubscribe(self, data):
+        stream = data.get('stream')
+
+        if stream == self.NOTIFICATIONS_STREAM:
+            if self.notifications_group:
+                await update_user_last_seen(self.user)
+                await self.channel_layer.group_discard(self.notifications_group, self.channel_name)
+                self.notifications_group = None
+            await self.send_frame({'type': 'unsubscribed', 'stream': stream})
+            return
+
+        if stream == self.CHAT_STREAM:
+            username = data.get('username')
+            conversation_id = self.get_subscribed_conversation_id(username)
+            if conversation_id is not None:
+                _username, group_name = self.chat_subscriptions.pop(conversation_id)
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+            await self.send_frame({'type': 'unsubscribed', 'stream': stream, 'username': username})
+            return
+
+        await self.send_error('unknown_stream', stream=stream)
+
+    def get_subscribed_conversation_id(self, username):
+        for conversation_id, (subscribed_username, _group) in self.chat_subscriptions.items():
+            if subscribed_username == username:
+                return conversation_id
+        return None
+
+    # --- Client events on a subscribed stream ---
+
+    async def handle_notifications_event(self, data):
+        if not self.notifications_group:
+            await self.send_error('not_subscribed', stream=self.NOTIFICATIONS_STREAM)
+            return
+        if data.get('type') == 'heartbeat':
+            await refresh_presence(self.user, self.channel_layer)
+
+    async def handle_chat_event(self, data):
+        username = data.get('username')
+        conversation_id = self.get_subscribed_conversation_id(username)
+        if conversation_id is None:
+            await self.send_error('not_subscribed', stream=self.CHAT_STREAM, username=username)
+            return
+
+        event_type = data.get('type')
+        if event_type == 'mark_as_read':
+            message_id = data.get('message_id')
+            if message_id:
+                updated_message = await mark_message_as_read_in_db(message_id, self.user)
+                if updated_message:
+                    await notify_read_receipt(updated_message, self.user, self.channel_layer)
+
+        elif event_type == 'mark_conversation_as_read':
+            conversation = await get_conversation_by_id(conversation_id)
+            if conversation:
+                await mark_conversation_read(conversation, self.user, self.channel_layer)
+
+    # --- Channel layer handlers ---
+
+    async def chat_message(self, event):
+        """
+        Forwards a chat group event to the client, tagged with the room it
+        belongs to. Events from rooms this socket has left are dropped.
+        """
+        subscription = self.chat_subscriptions.get(event.get('conversation_id'))
+        if not subscription:
+            return
+        username, _group_name = subscription
+        await self.send_frame({
+            'stream': self.CHAT_STREAM,
+            'username': username,
+            'type': 'new_message',
+            'message_html': event.get('message_html'),
+            'message_id': event.get('message_id')
+        })
+
+    async def send_notification(self, event):
+        if not self.notifications_group:
+            return
+        await self.send_frame({
+            'stream': self.NOTIFICATIONS_STREAM,
             'type': event['notification_type'],
             'data': event['data']
-        }))
+        })
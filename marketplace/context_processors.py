@@ -1,16 +1,12 @@
 # marketplace/context_processors.py
-from .models import Order, Message, Conversation, Game
+from .models import Message, Conversation, Game, UserOrderCount
 from django.db.models import Q
 from django.conf import settings
-from django.core.cache import cache
+from . import caching
 
 def notifications(request):
     # Cache total games count for 30 minutes (rarely changes)
-    cache_key = 'total_games_count'
-    total_games_count = cache.get(cache_key)
-    if total_games_count is None:
-        total_games_count = Game.objects.count()
-        cache.set(cache_key, total_games_count, 1800)  # 30 minutes
+    total_games_count = caching.TOTAL_GAMES.get_or_set(compute=Game.objects.count)
 
     # This context is available on all pages for all users
     context = {
@@ -19,32 +15,27 @@ def notifications(request):
     }
 
     if request.user.is_authenticated:
-        # Cache user notification counts for 60 seconds (frequently changing)
-        user_cache_key = f'user_notifications_{request.user.id}'
-        cached_counts = cache.get(user_cache_key)
-        
-        if cached_counts is None:
-            # Get count of active purchases
-            active_purchases_count = Order.objects.filter(buyer=request.user, status='PROCESSING').count()
+        user = request.user
 
-            # Get count of active sales
-            active_sales_count = Order.objects.filter(seller=request.user, status='PROCESSING').count()
+        def load_counts():
+            # Active purchases and sales from the per-user order rollup
+            order_counts = UserOrderCount.objects.counts_for(user.id)
 
             # Get count of conversations with unread messages
-            user_conversations = Conversation.objects.filter(Q(participant1=request.user) | Q(participant2=request.user))
+            user_conversations = Conversation.objects.filter(Q(participant1=user) | Q(participant2=user))
             unread_conversations_count = Message.objects.filter(
                 conversation__in=user_conversations,
                 is_read=False
-            ).exclude(sender=request.user).values('conversation').distinct().count()
+            ).exclude(sender=user).values('conversation').distinct().count()
 
-            cached_counts = {
-                'active_purchases_count': active_purchases_count,
-                'active_sales_count': active_sales_count,
+            return {
+                'active_purchases_count': order_counts.get((UserOrderCount.ROLE_BUYER, 'PROCESSING'), 0),
+                'active_sales_count': order_counts.get((UserOrderCount.ROLE_SELLER, 'PROCESSING'), 0),
                 'unread_conversations_count': unread_conversations_count,
             }
-            
-            # Cache for 60 seconds - balance between freshness and performance
-            cache.set(user_cache_key, cached_counts, 60)
+
+        # Cache user notification counts for 60 seconds (frequently changing)
+        cached_counts = caching.USER_NOTIFICATIONS.get_or_set(user.id, compute=load_counts)
 
         # Add user-specific counts to the context
         context.update(cached_counts)
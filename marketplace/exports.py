@@ -0,0 +1,196 @@
+# marketplace/exports.py
+"""
+Streaming statement exports (wallet transactions, sales, purchases).
+
+Rows are read with iterator(chunk_size=...), which uses a server-side cursor
+on PostgreSQL, and written out as they arrive, so memory use does not grow
+with the size of the export. Running totals are computed while streaming.
+
+Under ASGI (daphne in production) the response must be given an async
+iterator, or Django collects a sync one into a list before sending it;
+stream_for() wraps the chunks accordingly.
+"""
+import csv
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Sum
+from django.utils import timezone
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('csv', 'json')
+# Orders in these states never moved money
+VOID_ORDER_STATUSES = ('CANCELLED', 'REFUNDED')
+# Spreadsheets evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def parse_date_range(start, end):
+    """
+    Turns optional YYYY-MM-DD strings into an aware [start, end) datetime
+    range; `end` is inclusive as a date. Raises ValueError on bad input.
+    """
+    tz = timezone.get_current_timezone()
+    start_at = end_at = None
+    if start:
+        start_at = timezone.make_aware(datetime.combine(datetime.strptime(start, '%Y-%m-%d').date(), time.min), tz)
+    if end:
+        end_day = datetime.strptime(end, '%Y-%m-%d').date() + timedelta(days=1)
+        end_at = timezone.make_aware(datetime.combine(end_day, time.min), tz)
+    if start_at and end_at and start_at >= end_at:
+        raise ValueError("The start date must not be after the end date.")
+    return start_at, end_at
+
+
+def _in_range(queryset, start_at, end_at):
+    if start_at:
+        queryset = queryset.filter(created_at__gte=start_at)
+    if end_at:
+        queryset = queryset.filter(created_at__lt=end_at)
+    return queryset
+
+
+def transaction_statement(user, start_at=None, end_at=None):
+    """
+    (header, rows) for a user's wallet statement, oldest first. The balance
+    column follows COMPLETED entries, starting from the balance at start_at.
+    """
+    from .models import Transaction
+
+    opening = Decimal('0.00')
+    if start_at:
+        opening = Transaction.objects.filter(
+            user=user, status='COMPLETED', created_at__lt=start_at
+        ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+    rows = _in_range(Transaction.objects.filter(user=user), start_at, end_at).order_by('created_at', 'id').values_list(
+        'created_at', 'id', 'transaction_type', 'status', 'description', 'order__order_id', 'amount'
+    )
+    header = ['date', 'transaction_id', 'type', 'status', 'description', 'order_id', 'amount', 'balance']
+
+    def generate():
+        balance = opening
+        for created_at, pk, tx_type, status, description, order_id, amount in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            if status == 'COMPLETED':
+                balance += amount
+            yield [created_at, pk, tx_type, status, description, order_id or '', amount, balance]
+
+    return header, generate()
+
+
+def order_statement(user, role, start_at=None, end_at=None):
+    """
+    (header, rows) for a user's sales (role='seller') or purchases
+    (role='buyer'), oldest first. Sales carry a running total of net
+    earnings and purchases a running total spent; void orders add nothing.
+    """
+    from .models import Order
+
+    counterparty = 'buyer' if role == 'seller' else 'seller'
+    rows = _in_range(Order.objects.filter(**{role: user}), start_at, end_at).order_by('created_at', 'id').values_list(
+        'created_at', 'order_id', f'{counterparty}__username', 'listing_title_snapshot', 'status',
+        'total_price', 'commission_paid',
+    )
+
+    if role == 'seller':
+        header = ['date', 'order_id', 'buyer', 'title', 'status', 'total_price', 'commission', 'net', 'running_net']
+    else:
+        header = ['date', 'order_id', 'seller', 'title', 'status', 'total_price', 'running_spent']
+
+    def generate():
+        running = Decimal('0.00')
+        for created_at, order_id, username, title, status, total_price, commission in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            if role == 'seller':
+                commission = commission or Decimal('0.00')
+                net = total_price - commission
+                if status not in VOID_ORDER_STATUSES:
+                    running += net
+                yield [created_at, order_id, username, title or '', status, total_price, commission, net, running]
+            else:
+                if status not in VOID_ORDER_STATUSES:
+                    running += total_price
+                yield [created_at, order_id, username, title or '', status, total_price, running]
+
+    return header, generate()
+
+
+def _batched(pieces, size=EXPORT_CHUNK_SIZE):
+    """Joins the per-row strings so each chunk written carries `size` rows."""
+    batch = []
+    for piece in pieces:
+        batch.append(piece)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def _csv_cell(value):
+    """
+    Dates as ISO strings; text that a spreadsheet would run as a formula
+    (titles, descriptions and usernames come from other users) is prefixed
+    with ' so it is shown as text. Numbers are left alone.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow([_csv_cell(value) for value in row])
+
+    return _batched(lines())
+
+
+def stream_json(header, rows):
+    """A JSON array of objects, written one object at a time."""
+    encoder = DjangoJSONEncoder()
+
+    def pieces():
+        yield '['
+        separator = '\n'
+        for row in rows:
+            yield separator + encoder.encode(dict(zip(header, row)))
+            separator = ',\n'
+        yield '\n]\n'
+
+    return _batched(pieces())
+
+
+async def _aiter_chunks(chunks):
+    """
+    Hands the chunks to an async server one at a time. Each next() runs
+    through sync_to_async on the request's sync thread, which owns the
+    database connection and its cursor.
+    """
+    pull = sync_to_async(next)
+    try:
+        while (chunk := await pull(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def stream_for(request, chunks):
+    """`chunks` as the server consumes them without buffering: async under ASGI, as-is under WSGI."""
+    if isinstance(request, ASGIRequest):
+        return _aiter_chunks(chunks)
+    return chunks
@@ -3,8 +3,9 @@ from django.db.models import Sum
 from django import forms
 from .models import (
     Product, Review, ReviewReply, WithdrawalRequest, DepositRequest, Order, SupportTicket, Profile, Category,
-    Filter, FilterOption, GameCategory, ProductImage
+    Filter, FilterOption, GameCategory, ProductImage, StockItem
 )
+from django.db import transaction
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from decimal import Decimal
@@ -17,6 +18,20 @@ class FilterOptionChoiceField(forms.ModelChoiceField):
         return obj.value
 
 class ProductForm(forms.ModelForm):
+    MAX_STOCK_FILE_SIZE = 5 * 1024 * 1024
+
+    stock_file = forms.FileField(
+        required=False,
+        label='Import codes from a file',
+        help_text='Plain text file, one code per line.',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.txt,.csv,text/plain'}),
+    )
+    replace_stock = forms.BooleanField(
+        required=False,
+        label='Replace all unsold codes instead of adding to them',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+
     class Meta:
         model = Product
         fields = [
@@ -67,6 +82,11 @@ class ProductForm(forms.ModelForm):
                 "Example:\nCODE-1234-ABCD\nCODE-5678-EFGH\nCODE-9012-IJKL"
             )
             stock_details_field.help_text = "Automatic delivery pulls one line per buyer (top to bottom)."
+            available = self.instance.available_stock_items if self.instance and self.instance.pk else 0
+            if available:
+                stock_details_field.help_text += (
+                    f"\n{available} unsold codes are in stock; lines entered here are added after them."
+                )
 
         # Hide automatic_delivery field if category doesn't allow it
         if game_category_link and not game_category_link.allows_automated_delivery:
@@ -78,16 +98,19 @@ class ProductForm(forms.ModelForm):
                 for option in self.instance.filter_options.all():
                     initial_filters[f'filter_{option.filter_id}'] = option
 
-            for f in game_category_link.filters.all().prefetch_related('options'):
+            for f in game_category_link.filter_tree():
                 field_name = f'filter_{f.id}'
-                self.fields[field_name] = FilterOptionChoiceField(
+                field = FilterOptionChoiceField(
                     label=f.name,
-                    queryset=f.options.all(),
+                    queryset=FilterOption.objects.filter(filter_id=f.id),
                     required=True,
                     widget=forms.Select(attrs={'class': 'form-select mb-3'}),
                     initial=initial_filters.get(field_name),
                     empty_label=f"Select {f.name}"
                 )
+                # Render from the cached options; the queryset is only hit to validate a POST
+                field.choices = [('', field.empty_label)] + [(option.pk, option.value) for option in f.options]
+                self.fields[field_name] = field
 
         if self.errors:
             for field_name in self.errors:
@@ -103,6 +126,42 @@ class ProductForm(forms.ModelForm):
             raise forms.ValidationError("Stock cannot be 0. Leave empty if stock is not applicable, or enter a positive number.")
         return stock
 
+    def clean_stock_file(self):
+        stock_file = self.cleaned_data.get('stock_file')
+        if not stock_file:
+            return stock_file
+        if stock_file.size > self.MAX_STOCK_FILE_SIZE:
+            raise forms.ValidationError("Code files must be 5MB or smaller.")
+        try:
+            self.imported_codes = stock_file.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise forms.ValidationError("Code files must be UTF-8 plain text.")
+        return stock_file
+
+    def clean(self):
+        cleaned_data = super().clean()
+        imported = getattr(self, 'imported_codes', '')
+        if imported.strip():
+            typed = (cleaned_data.get('stock_details') or '').strip()
+            cleaned_data['stock_details'] = f"{typed}\n{imported}" if typed else imported
+
+        if cleaned_data.get('replace_stock') and not (cleaned_data.get('stock_details') or '').strip():
+            self.add_error('stock_details', "Enter the new codes to replace the unsold ones with.")
+        return cleaned_data
+
+    def _post_clean(self):
+        # Replacing stock must not count the codes about to be deleted as in stock
+        if self.cleaned_data.get('replace_stock') and self.instance.pk:
+            self.instance.available_stock_items = 0
+        super()._post_clean()
+
+    def save(self, commit=True):
+        if not commit or not self.cleaned_data.get('replace_stock') or not self.instance.pk:
+            return super().save(commit)
+        with transaction.atomic():
+            StockItem.objects.clear_unsold(self.instance)
+            return super().save(commit)
+
     def clean_listing_title(self):
         return (self.cleaned_data.get('listing_title') or '').strip()
 
@@ -189,7 +248,7 @@ class WithdrawalRequestForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user', None)
-        self.balance = kwargs.pop('balance', 0)
+        self.balance = kwargs.pop('balance', None)
         super(WithdrawalRequestForm, self).__init__(*args, **kwargs)
 
         # Pre-fill identifier if editing an existing request
@@ -217,10 +276,12 @@ class WithdrawalRequestForm(forms.ModelForm):
 
     def clean_amount(self):
         amount = self.cleaned_data.get('amount')
-        if self.balance is None: self.balance = 0
-        
-        # Get available balance (this will auto-release eligible funds)
-        available_balance = self.user.profile.available_balance if self.user else 0
+
+        # Prefer the balance the view already read for this request
+        if self.balance is not None:
+            available_balance = self.balance
+        else:
+            available_balance = self.user.profile.available_balance if self.user else 0
         
         if amount > available_balance:
             if not self.user.profile.is_verified_seller:
@@ -5,6 +5,8 @@ from django.contrib.auth.signals import user_login_failed, user_logged_in
 from django.core.cache import cache
 from django.dispatch import receiver
 
+from . import rate_limit
+
 
 logger = logging.getLogger('marketplace.security')
 
@@ -38,8 +40,8 @@ def _client_ip(request):
     return request.META.get('REMOTE_ADDR')
 
 
-def _attempt_key(kind, identifier):
-    return f'login_attempts:{kind}:{identifier}'
+def _attempt_scope(kind):
+    return f'login_failures:{kind}'
 
 
 def _lock_key(kind, identifier):
@@ -47,12 +49,11 @@ def _lock_key(kind, identifier):
 
 
 def _register_failure(kind, identifier):
-    """Increment counters and lock when limit is reached."""
-    attempts_key = _attempt_key(kind, identifier)
-    attempts = cache.get(attempts_key, 0) + 1
-    cache.set(attempts_key, attempts, LOCKOUT_SECONDS)
+    """Record a failure in the sliding window and lock when it is full."""
+    window = rate_limit.hit(_attempt_scope(kind), identifier, ATTEMPT_LIMIT, LOCKOUT_SECONDS)
+    attempts = ATTEMPT_LIMIT - window.remaining
 
-    if attempts >= ATTEMPT_LIMIT:
+    if not window.remaining:
         cache.set(_lock_key(kind, identifier), True, LOCKOUT_SECONDS)
         return True, attempts
     return False, attempts
@@ -60,7 +61,7 @@ def _register_failure(kind, identifier):
 
 def _clear_records(kind, identifier):
     """Remove attempt and lock records after successful login."""
-    cache.delete(_attempt_key(kind, identifier))
+    rate_limit.reset(_attempt_scope(kind), identifier)
     cache.delete(_lock_key(kind, identifier))
 
 
@@ -0,0 +1,139 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from marketplace.models import Conversation, Message, Order
+
+# Order IDs appear as '#XXXX-XXXX-XXXX' in the text of order system notices
+ORDER_ID_RE = re.compile(r'#[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}')
+
+
+class Command(BaseCommand):
+    help = 'Links existing order system notices and automatic-delivery messages to their orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Messages updated per query')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be linked without saving')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        notices = self.link_system_messages()
+        deliveries = self.link_delivery_messages()
+
+        verb = 'Would link' if self.dry_run else 'Linked'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {notices} system messages and {deliveries} delivery messages to their orders.'
+        ))
+
+    def save(self, messages):
+        if messages and not self.dry_run:
+            with transaction.atomic():
+                Message.objects.bulk_update(messages, ['order'], batch_size=self.batch_size)
+        return len(messages)
+
+    def link_system_messages(self):
+        """Reads the order ID out of each unlinked order notice."""
+        linked = 0
+        pending = []
+        unlinked = Message.objects.filter(
+            is_system_message=True, order__isnull=True, content__contains='#'
+        ).only('id', 'content')
+
+        for message in unlinked.iterator(chunk_size=self.batch_size):
+            match = ORDER_ID_RE.search(message.content)
+            if match:
+                pending.append((message, match.group(0)))
+            if len(pending) >= self.batch_size:
+                linked += self.link_by_order_id(pending)
+                pending = []
+        return linked + self.link_by_order_id(pending)
+
+    def link_by_order_id(self, pending):
+        order_pks = dict(
+            Order.objects.filter(order_id__in={order_id for _, order_id in pending}).values_list('order_id', 'pk')
+        )
+        messages = []
+        for message, order_id in pending:
+            if order_id in order_pks:
+                message.order_id = order_pks[order_id]
+                messages.append(message)
+        return self.save(messages)
+
+    def link_delivery_messages(self):
+        """
+        Pairs automatic-delivery orders with the seller's auto replies the way
+        order_detail used to: the n-th order between a buyer and seller for a
+        product gets the n-th delivery message in their conversation.
+        """
+        linked = 0
+        groups = (
+            Order.objects.filter(product__automatic_delivery=True)
+            .exclude(chat_messages__is_system_message=False)
+            .values_list('buyer_id', 'seller_id', 'product_id')
+            .distinct()
+        )
+        for buyer_id, seller_id, product_id in groups.iterator():
+            orders = list(
+                Order.objects.filter(buyer_id=buyer_id, seller_id=seller_id, product_id=product_id)
+                .select_related('product').order_by('created_at')
+            )
+            conversation = self.conversation_for(buyer_id, seller_id)
+            if conversation is None:
+                continue
+            post_purchase_message = orders[0].product.post_purchase_message or ''
+            candidates = list(
+                conversation.messages.filter(sender_id=seller_id, is_auto_reply=True, is_system_message=False)
+                .exclude(content=post_purchase_message)
+                .order_by('timestamp')
+                .only('id', 'order_id')
+            )
+            delivered = set(
+                Message.objects.filter(order__in=orders, is_system_message=False).values_list('order_id', flat=True)
+            )
+            messages = []
+            for order, message in zip(orders, candidates):
+                if message.order_id is None and order.pk not in delivered:
+                    message.order_id = order.pk
+                    messages.append(message)
+            linked += self.save(messages)
+
+        return linked + self.link_deleted_product_deliveries()
+
+    def link_deleted_product_deliveries(self):
+        """Orders whose product is gone: take the auto reply sent right after the order."""
+        messages = []
+        used = set()
+        orders = Order.objects.filter(product__isnull=True).exclude(
+            chat_messages__is_system_message=False
+        ).only('id', 'buyer_id', 'seller_id', 'created_at')
+
+        for order in orders.iterator(chunk_size=self.batch_size):
+            conversation = self.conversation_for(order.buyer_id, order.seller_id)
+            if conversation is None:
+                continue
+            candidates = conversation.messages.filter(
+                sender_id=order.seller_id,
+                is_auto_reply=True,
+                is_system_message=False,
+                order__isnull=True,
+                timestamp__gte=order.created_at - timedelta(seconds=10),
+                timestamp__lte=order.created_at + timedelta(seconds=10),
+            ).exclude(
+                content__icontains='thank you'
+            ).exclude(
+                content__icontains='purchase'
+            ).order_by('timestamp').only('id', 'order_id')
+            message = next((candidate for candidate in candidates if candidate.pk not in used), None)
+            if message:
+                used.add(message.pk)
+                message.order_id = order.pk
+                messages.append(message)
+        return self.save(messages)
+
+    def conversation_for(self, buyer_id, seller_id):
+        p1, p2 = sorted((buyer_id, seller_id))
+        return Conversation.objects.filter(participant1_id=p1, participant2_id=p2).first()
@@ -0,0 +1,78 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from marketplace.models import Order, Transaction
+from marketplace.pagination import keyset_paginate
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET and keyset pagination for one user\'s purchases, sales and transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User whose lists are paged through')
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=20,
+            help='Number of pages to walk from the start of each list (default: 20)'
+        )
+        parser.add_argument(
+            '--per-page',
+            type=int,
+            default=25,
+            help='Rows per page (default: 25)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist")
+
+        lists = [
+            ('purchases', Order.objects.with_full_details().filter(buyer=user)),
+            ('sales', Order.objects.with_full_details().filter(seller=user)),
+            ('transactions', Transaction.objects.filter(user=user).select_related('order', 'withdrawal', 'deposit')),
+        ]
+
+        self.stdout.write(f"{'list':<14}{'mode':<10}{'pages':>8}{'queries':>10}{'total ms':>12}{'last page ms':>14}")
+        for name, queryset in lists:
+            for mode, walker in [('offset', self.walk_offset), ('keyset', self.walk_keyset)]:
+                pages, queries, total, last = walker(queryset, options['pages'], options['per_page'])
+                self.stdout.write(
+                    f'{name:<14}{mode:<10}{pages:>8}{queries:>10}{total * 1000:>12.1f}{last * 1000:>14.1f}'
+                )
+
+    def walk_offset(self, queryset, max_pages, per_page):
+        def fetch(page, _state):
+            # A fresh Paginator per page, as each request builds one (COUNT included)
+            page_obj = Paginator(queryset.order_by('-created_at', '-id'), per_page).get_page(page)
+            return list(page_obj), page_obj.has_next()
+        return self.walk(max_pages, fetch)
+
+    def walk_keyset(self, queryset, max_pages, per_page):
+        def fetch(_page, state):
+            page_obj = keyset_paginate(queryset, state.get('cursor'), per_page)
+            state['cursor'] = page_obj.next_cursor
+            return list(page_obj), page_obj.has_next()
+        return self.walk(max_pages, fetch)
+
+    def walk(self, max_pages, fetch):
+        state = {}
+        pages = 0
+        total = last = 0.0
+        with CaptureQueriesContext(connection) as captured:
+            for page in range(1, max_pages + 1):
+                started = time.perf_counter()
+                _rows, has_next = fetch(page, state)
+                last = time.perf_counter() - started
+                total += last
+                pages += 1
+                if not has_next:
+                    break
+        return pages, len(captured.captured_queries), total, last
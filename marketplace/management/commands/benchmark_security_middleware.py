@@ -0,0 +1,93 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from marketplace.security_middleware import SecurityMiddleware
+
+
+def sample_requests(factory, count):
+    """Storefront, admin and API traffic from a pool of benchmark-range addresses."""
+    admin_root = f"/{settings.ADMIN_URL.strip('/') or 'admin'}/"
+    paths = [
+        '/', '/game/12/', '/listings/12/3/?sort=price_asc&online_only=1', '/product/4051/',
+        '/api/notifications/', admin_root, '/profile/seller_pro/', '/accounts/login/',
+    ]
+    user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0'
+    requests = []
+    for i in range(count):
+        # 198.18.0.0/15 is reserved for benchmarking; 1024 addresses keep every tier under its limit
+        request = factory.get(
+            paths[i % len(paths)], REMOTE_ADDR=f'198.18.{(i // 256) % 4}.{i % 256}', HTTP_USER_AGENT=user_agent,
+        )
+        request.user = AnonymousUser()
+        requests.append(request)
+    return requests
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the per-request cost of SecurityMiddleware.process_request (counter round trip, '
+        'path and user agent checks) against the configured cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=5000,
+            help='Requests to run through the middleware (default: 5000)'
+        )
+        parser.add_argument(
+            '--max-p99-us',
+            type=float,
+            default=None,
+            help='Exit with an error if the p99 exceeds this many microseconds'
+        )
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        middleware = SecurityMiddleware(lambda request: HttpResponse())
+        requests = sample_requests(RequestFactory(), count)
+
+        # Admin and API hits write an access log line each; keep it out of the output
+        access_logger = logging.getLogger('marketplace.access')
+        level = access_logger.level
+        access_logger.setLevel(logging.WARNING)
+        try:
+            # Warm up the login path lookup, admin whitelist and the cache connection
+            for request in requests[:50]:
+                middleware.process_request(request)
+
+            timings = []
+            blocked = 0
+            for request in requests:
+                started = time.perf_counter()
+                response = middleware.process_request(request)
+                timings.append(time.perf_counter() - started)
+                blocked += response is not None
+        finally:
+            access_logger.setLevel(level)
+
+        timings.sort()
+
+        def percentile(fraction):
+            return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1_000_000
+
+        p99 = percentile(0.99)
+        self.stdout.write(self.style.SUCCESS(
+            f"process_request over {count} requests ({settings.CACHES['default']['BACKEND']})"
+        ))
+        self.stdout.write(f"{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'max us':>10}{'blocked':>10}")
+        self.stdout.write(
+            f'{percentile(0.5):>10.1f}{percentile(0.9):>10.1f}{p99:>10.1f}'
+            f'{timings[-1] * 1_000_000:>10.1f}{blocked:>10}'
+        )
+
+        budget = options['max_p99_us']
+        if budget is not None and p99 > budget:
+            raise CommandError(f'p99 of {p99:.1f}us exceeds the {budget:.1f}us budget')
@@ -0,0 +1,119 @@
+import json
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from marketplace.ws_framing import (
+    FORMAT_JSON,
+    FORMAT_MSGPACK,
+    decode_frame,
+    encode_frame,
+)
+
+# Representative output of marketplace/partials/message.html for a short chat message
+SAMPLE_MESSAGE_HTML = (
+    '<div class="mb-3 message-item" data-timestamp="2025-08-20T14:03:11.512344+00:00" data-sender="seller_pro">'
+    '<div class="message-header d-flex justify-content-between"><div>'
+    '<a href="/profile/seller_pro/" class="text-decoration-none text-dark"><strong>seller_pro</strong></a>'
+    '</div><small class="text-muted message-time">2:03 PM</small></div>'
+    '<div class="message-content"><div class="mb-0 text-break mt-1" style="overflow-wrap: break-word;">'
+    'Hi! The account details are in the order page, let me know if the login works for you.'
+    '</div></div></div>'
+)
+
+
+def sample_events():
+    """The three frame shapes that dominate realtime traffic."""
+    return [
+        {
+            'type': 'new_message',
+            'message_html': SAMPLE_MESSAGE_HTML,
+            'message_id': 184223,
+        },
+        {
+            'type': 'new_message',
+            'data': {
+                'unread_conversations_count': 3,
+                'conversation_id': 5120,
+                'last_message_content': 'Hi! The account details are in the order page',
+                'last_message_timestamp': '2025-08-20T14:03:11.512344+00:00',
+                'sender_username': 'seller_pro',
+            },
+        },
+        {
+            'type': 'presence_update',
+            'data': {
+                'username': 'seller_pro',
+                'is_online': True,
+                'last_seen_iso': '2025-08-20T14:03:11.512344+00:00',
+            },
+        },
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bytes and CPU per N WebSocket events for each frame format'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=10000,
+            help='Number of events to encode per format (default: 10000)'
+        )
+        parser.add_argument(
+            '--window-bits',
+            type=int,
+            default=12,
+            help='permessage-deflate window bits to simulate (default: 12)'
+        )
+
+    def handle(self, *args, **options):
+        count = options['events']
+        window_bits = options['window_bits']
+        events = sample_events()
+        stream = [events[i % len(events)] for i in range(count)]
+
+        formats = [
+            ('legacy json', lambda payload: {'text_data': json.dumps(payload)}),
+            ('compact json', lambda payload: encode_frame(payload, FORMAT_JSON)),
+            ('msgpack', lambda payload: encode_frame(payload, FORMAT_MSGPACK)),
+        ]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Encoding {count} events (chat / notification / presence mix)'
+        ))
+        self.stdout.write(
+            f"{'format':<14}{'bytes':>12}{'deflated':>12}{'encode ms':>12}{'decode ms':>12}{'deflate ms':>12}"
+        )
+
+        for name, encoder in formats:
+            started = time.process_time()
+            frames = [encoder(payload) for payload in stream]
+            encode_cpu = time.process_time() - started
+
+            raw = [frame.get('bytes_data') or frame['text_data'].encode('utf-8') for frame in frames]
+            total_bytes = sum(len(chunk) for chunk in raw)
+
+            started = time.process_time()
+            for frame in frames:
+                if name == 'msgpack':
+                    decode_frame(bytes_data=frame['bytes_data'], frame_format=FORMAT_MSGPACK)
+                else:
+                    decode_frame(text_data=frame['text_data'])
+            decode_cpu = time.process_time() - started
+
+            # permessage-deflate with context takeover: one compressor per
+            # connection, flushed per message with the 4-byte tail stripped.
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -window_bits, 5)
+            started = time.process_time()
+            deflated_bytes = 0
+            for chunk in raw:
+                deflated_bytes += len(compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+            deflate_cpu = time.process_time() - started
+
+            self.stdout.write(
+                f'{name:<14}{total_bytes:>12}{deflated_bytes:>12}'
+                f'{encode_cpu * 1000:>12.1f}{decode_cpu * 1000:>12.1f}{deflate_cpu * 1000:>12.1f}'
+            )
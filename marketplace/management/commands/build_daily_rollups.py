@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from marketplace.models import DailyMarketplaceStats
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the daily marketplace rollups read by the admin dashboard. Only days touched '
+        'since the last run are recomputed; run with --loop (or from cron) in production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and refresh the rollups every --interval seconds'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=300,
+            help='Seconds between refreshes in --loop mode (default: 300)'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute every day instead of only the days touched since the last run'
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.refresh(full=options['rebuild'])
+            return
+
+        interval = options['interval']
+        self.stdout.write(f'Starting daily rollup loop with {interval}s interval...')
+        full = options['rebuild']
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    # Long-running process: drop connections the DB may have timed out
+                    close_old_connections()
+                    self.refresh(full=full)
+                    full = False
+                except Exception as e:
+                    self.stderr.write(f'Error refreshing daily rollups: {e}')
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping daily rollup loop...')
+
+    def refresh(self, full=False):
+        days = DailyMarketplaceStats.objects.refresh(full=full)
+        if days is None:
+            self.stdout.write(self.style.SUCCESS('Rebuilt daily rollups for every day'))
+        elif days:
+            self.stdout.write(self.style.SUCCESS(f'Refreshed daily rollups for {len(days)} days'))
+        return days
@@ -0,0 +1,93 @@
+import pickle
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from django.db.models.functions import Lower
+
+from marketplace.snapshots import (
+    CategorySnapshot, FilterSnapshot, GameCategorySnapshot, GameSnapshot, ProductSnapshot, codec,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Reports cache memory by key prefix (Redis only), and the size of cached catalog and '
+        'product entries as pickled model instances versus snapshots.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help='Key prefixes to list (default: 15)')
+        parser.add_argument('--scan', type=int, default=20000, help='Maximum keys to inspect (default: 20000)')
+        parser.add_argument('--sample', type=int, default=50, help='Rows to encode per namespace (default: 50)')
+
+    def handle(self, *args, **options):
+        self.report_prefixes(options['top'], options['scan'])
+        self.report_encodings(options['sample'])
+
+    def report_prefixes(self, top, limit):
+        """MEMORY USAGE summed by the first two key segments (ns:product_detail, gen:product, ...)."""
+        try:
+            from django_redis import get_redis_connection
+            connection = get_redis_connection('default')
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'Key prefix report needs the Redis cache backend ({e}).'))
+            return
+
+        strip = len(cache.make_key(''))
+        sizes = defaultdict(lambda: [0, 0])
+        for scanned, raw_key in enumerate(connection.scan_iter(match=cache.make_key('*'), count=1000)):
+            if scanned >= limit:
+                break
+            key = raw_key.decode(errors='replace')[strip:]
+            prefix = ':'.join(key.split(':')[:2])
+            sizes[prefix][0] += 1
+            sizes[prefix][1] += connection.memory_usage(raw_key) or 0
+
+        self.stdout.write(self.style.SUCCESS('Cache memory by key prefix'))
+        self.stdout.write(f"{'prefix':<40} {'keys':>8} {'bytes':>12} {'avg':>8}")
+        for prefix, (count, total) in sorted(sizes.items(), key=lambda item: -item[1][1])[:top]:
+            self.stdout.write(f'{prefix:<40} {count:>8} {total:>12} {total // count:>8}')
+
+    def report_encodings(self, sample):
+        from marketplace.models import Category, Game, GameCategory, Product
+
+        products = list(Product.objects.with_full_details().with_buyer_price().order_by('-pk')[:sample])
+        games = list(
+            Game.objects.prefetch_related(
+                Prefetch('categories', queryset=Category.objects.order_by('gamecategory__id'),
+                         to_attr='ordered_categories')
+            ).order_by(Lower('title'))
+        )
+        links = list(
+            GameCategory.objects.select_related('game', 'category', 'primary_filter')
+            .prefetch_related('filters__options').order_by('-pk')[:sample]
+        )
+
+        rows = [
+            ('product_detail', [
+                ((product, product.seller), ProductSnapshot.from_product(product)) for product in products
+            ]),
+            ('home_games_list', [(games, tuple(GameSnapshot.from_game(g, g.ordered_categories) for g in games))]),
+            ('game_category', [
+                ((link.game, link.category, link),
+                 (GameSnapshot.from_game(link.game), CategorySnapshot.from_category(link.category),
+                  GameCategorySnapshot.from_link(link)))
+                for link in links
+            ]),
+            ('category_filters', [
+                (list(link.filters.all()), tuple(FilterSnapshot.from_filter(f) for f in link.filters.all()))
+                for link in links
+            ]),
+        ]
+
+        self.stdout.write(self.style.SUCCESS('\nEntry size: pickled models (before) vs snapshots (after)'))
+        self.stdout.write(f"{'namespace':<20} {'entries':>8} {'before':>10} {'after':>10} {'saved':>7}")
+        for name, pairs in rows:
+            if not pairs:
+                continue
+            before = sum(len(pickle.dumps(old, pickle.HIGHEST_PROTOCOL)) for old, _ in pairs)
+            after = sum(len(codec.dumps(new)) for _, new in pairs)
+            saved = f'{1 - after / before:.0%}' if before else '-'
+            self.stdout.write(f'{name:<20} {len(pairs):>8} {before:>10} {after:>10} {saved:>7}')
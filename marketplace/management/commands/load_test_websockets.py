@@ -0,0 +1,333 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import psutil
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace.ws_framing import FORMAT_JSON, FORMAT_MSGPACK, SUBPROTOCOL_MSGPACK, decode_frame, encode_frame
+
+
+class SyntheticSocket:
+    """
+    An in-process WebSocket client that talks ASGI directly to the consumers,
+    the same way daphne would, without the network or session middleware.
+    """
+
+    def __init__(self, application, path, user, frame_format, port):
+        self.application = application
+        self.user = user
+        self.frame_format = frame_format
+        self.scope = {
+            'type': 'websocket',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'headers': [],
+            'subprotocols': [SUBPROTOCOL_MSGPACK] if frame_format == FORMAT_MSGPACK else [],
+            'client': ('127.0.0.1', port),
+            'server': ('127.0.0.1', 8000),
+            'user': user,
+        }
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue()
+        self.task = None
+        self.reader = None
+
+    async def connect(self, timeout):
+        self.task = asyncio.ensure_future(
+            self.application(self.scope, self.inbound.get, self.outbound.put)
+        )
+        await self.inbound.put({'type': 'websocket.connect'})
+        try:
+            message = await asyncio.wait_for(self.outbound.get(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return message['type'] == 'websocket.accept'
+
+    async def send(self, payload):
+        frame = encode_frame(payload, self.frame_format)
+        if 'bytes_data' in frame:
+            await self.inbound.put({'type': 'websocket.receive', 'bytes': frame['bytes_data']})
+        else:
+            await self.inbound.put({'type': 'websocket.receive', 'text': frame['text_data']})
+
+    async def frames(self):
+        """Yields decoded frames sent by the consumer until it closes."""
+        while True:
+            message = await self.outbound.get()
+            if message['type'] != 'websocket.send':
+                return
+            yield decode_frame(message.get('text'), message.get('bytes'), self.frame_format)
+
+    async def close(self):
+        if self.task is None:
+            return
+        await self.inbound.put({'type': 'websocket.disconnect', 'code': 1000})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.task.cancel()
+        except Exception:
+            pass
+        if self.reader:
+            self.reader.cancel()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Open N synthetic chat and notification sockets in-process and measure delivery under load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Synthetic users to connect (default: 100)')
+        parser.add_argument('--duration', type=int, default=30, help='Seconds to drive traffic (default: 30)')
+        parser.add_argument(
+            '--message-rate', type=float, default=20,
+            help='Chat messages per second across all conversations (default: 20)'
+        )
+        parser.add_argument(
+            '--heartbeat-interval', type=float, default=30,
+            help='Seconds between heartbeats/pings per socket (default: 30)'
+        )
+        parser.add_argument(
+            '--connect-concurrency', type=int, default=50,
+            help='Connections opened in parallel (default: 50)'
+        )
+        parser.add_argument(
+            '--channel-layer', type=str, default='settings',
+            help='"settings" (configured layer), "memory", or a redis:// URL'
+        )
+        parser.add_argument('--msgpack', action='store_true', help='Negotiate MessagePack frames')
+        parser.add_argument('--no-notifications', action='store_true', help='Only open chat sockets')
+        parser.add_argument('--prefix', type=str, default='loadtest_', help='Username prefix for synthetic users')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic users afterwards')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2')
+
+        self.configure_channel_layer(options['channel_layer'])
+
+        users, conversations = self.create_fixtures(options['users'], options['prefix'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Prepared {len(users)} users and {len(conversations)} conversations'
+        ))
+
+        try:
+            report = asyncio.run(self.run_load(users, conversations, options))
+            self.output_report(report)
+        finally:
+            if options['cleanup']:
+                deleted = User.objects.filter(username__startswith=options['prefix']).delete()[0]
+                self.stdout.write(f'Cleaned up {deleted} synthetic rows')
+
+    def configure_channel_layer(self, choice):
+        if choice == 'settings':
+            return
+        if choice == 'memory':
+            from channels.layers import InMemoryChannelLayer
+            layer = InMemoryChannelLayer()
+        elif choice.startswith('redis://') or choice.startswith('rediss://'):
+            from channels_redis.core import RedisChannelLayer
+            layer = RedisChannelLayer(hosts=[choice])
+        else:
+            raise CommandError('--channel-layer must be "settings", "memory" or a redis:// URL')
+        channel_layers.set('default', layer)
+
+    def create_fixtures(self, count, prefix):
+        """Creates (or reuses) synthetic users paired into conversations."""
+        from marketplace.models import Conversation
+
+        users = []
+        for index in range(count):
+            user, created = User.objects.get_or_create(username=f'{prefix}{index}')
+            if created:
+                user.set_unusable_password()
+                user.save(update_fields=['password'])
+            users.append(user)
+
+        conversations = []
+        for first, second in zip(users[0::2], users[1::2]):
+            participant1, participant2 = (first, second) if first.id < second.id else (second, first)
+            conversation, _ = Conversation.objects.get_or_create(
+                participant1=participant1, participant2=participant2
+            )
+            conversations.append((conversation, first, second))
+        return users, conversations
+
+    async def run_load(self, users, conversations, options):
+        from marketplace.models import Message
+        from marketplace.routing import websocket_urlpatterns
+
+        application = URLRouter(websocket_urlpatterns)
+        frame_format = FORMAT_MSGPACK if options['msgpack'] else FORMAT_JSON
+        process = psutil.Process()
+        process.cpu_percent(None)
+        rss_before = process.memory_info().rss
+        port_counter = itertools.count(20000)
+
+        # Each paired user gets a chat socket to their partner plus a notification socket
+        plans = []
+        for _conversation, first, second in conversations:
+            plans.append((f'/ws/chat/{second.username}/', first))
+            plans.append((f'/ws/chat/{first.username}/', second))
+        if not options['no_notifications']:
+            plans.extend(('/ws/notifications/', user) for user in users)
+
+        sockets = []
+        failed_connects = 0
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+
+        async def open_socket(path, user):
+            nonlocal failed_connects
+            socket = SyntheticSocket(application, path, user, frame_format, next(port_counter))
+            async with semaphore:
+                if await socket.connect(timeout=10):
+                    sockets.append(socket)
+                else:
+                    failed_connects += 1
+                    await socket.close()
+
+        connect_started = time.perf_counter()
+        await asyncio.gather(*(open_socket(path, user) for path, user in plans))
+        connect_elapsed = time.perf_counter() - connect_started
+        rss_connected = process.memory_info().rss
+
+        # Delivery bookkeeping: message id -> send time, and every receive time per id
+        sent_at = {}
+        received_at = {}
+        counters = {'notifications': 0, 'presence': 0, 'pongs': 0, 'errors': 0}
+
+        async def read(socket):
+            try:
+                async for frame in socket.frames():
+                    frame_type = frame.get('type')
+                    if frame_type == 'new_message' and 'message_id' in frame:
+                        received_at.setdefault(frame['message_id'], []).append(time.perf_counter())
+                    elif frame_type == 'new_message':
+                        counters['notifications'] += 1
+                    elif frame_type == 'presence_update':
+                        counters['presence'] += 1
+                    elif frame_type == 'pong':
+                        counters['pongs'] += 1
+            except Exception:
+                counters['errors'] += 1
+
+        for socket in sockets:
+            socket.reader = asyncio.ensure_future(read(socket))
+
+        @database_sync_to_async
+        def create_message(conversation, sender, content):
+            return Message.objects.create(conversation=conversation, sender=sender, content=content).id
+
+        cpu_samples = []
+        peak_rss = rss_connected
+        deadline = time.perf_counter() + options['duration']
+
+        async def drive_messages():
+            interval = 1.0 / options['message_rate'] if options['message_rate'] > 0 else None
+            sequence = 0
+            while interval and time.perf_counter() < deadline:
+                conversation, first, second = random.choice(conversations)
+                sender = first if sequence % 2 else second
+                started = time.perf_counter()
+                message_id = await create_message(conversation, sender, f'load test message {sequence}')
+                sent_at[message_id] = started
+                sequence += 1
+                await asyncio.sleep(max(0, interval - (time.perf_counter() - started)))
+
+        async def drive_heartbeats():
+            interval = options['heartbeat_interval']
+            while time.perf_counter() < deadline:
+                # Spread each round over the interval instead of bursting
+                for socket in list(sockets):
+                    if time.perf_counter() >= deadline:
+                        return
+                    if socket.scope['path'].startswith('/ws/notifications/'):
+                        await socket.send({'type': 'heartbeat'})
+                    else:
+                        await socket.send({'type': 'ping'})
+                    await asyncio.sleep(interval / max(len(sockets), 1))
+
+        async def monitor():
+            nonlocal peak_rss
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(1)
+                cpu_samples.append(process.cpu_percent(None))
+                peak_rss = max(peak_rss, process.memory_info().rss)
+
+        await asyncio.gather(drive_messages(), drive_heartbeats(), monitor())
+        # Let in-flight events drain before counting drops
+        await asyncio.sleep(2)
+
+        for socket in sockets:
+            await socket.close()
+
+        # Both participants hold a chat socket in the room, so each message
+        # should reach two chat sockets (and two notification sockets).
+        expected_chat = len(sent_at) * 2
+        delivered_chat = sum(len(received_at.get(message_id, [])) for message_id in sent_at)
+        latencies = [
+            (receive_time - sent_at[message_id]) * 1000
+            for message_id, times in received_at.items() if message_id in sent_at
+            for receive_time in times
+        ]
+        expected_notifications = 0 if options['no_notifications'] else len(sent_at) * 2
+
+        return {
+            'sockets_requested': len(plans),
+            'sockets_connected': len(sockets),
+            'failed_connects': failed_connects,
+            'connect_seconds': connect_elapsed,
+            'connect_rate': len(sockets) / connect_elapsed if connect_elapsed else 0,
+            'messages_sent': len(sent_at),
+            'chat_expected': expected_chat,
+            'chat_delivered': delivered_chat,
+            'chat_dropped': max(0, expected_chat - delivered_chat),
+            'notifications_expected': expected_notifications,
+            'notifications_delivered': counters['notifications'],
+            'notifications_dropped': max(0, expected_notifications - counters['notifications']),
+            'presence_updates': counters['presence'],
+            'pongs': counters['pongs'],
+            'reader_errors': counters['errors'],
+            'latency_ms': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': max(latencies) if latencies else 0.0,
+            },
+            'cpu_percent': {
+                'avg': sum(cpu_samples) / len(cpu_samples) if cpu_samples else 0.0,
+                'max': max(cpu_samples) if cpu_samples else 0.0,
+            },
+            'rss_mb': {
+                'before': rss_before / (1024 ** 2),
+                'connected': rss_connected / (1024 ** 2),
+                'peak': peak_rss / (1024 ** 2),
+                'per_socket_kb': (rss_connected - rss_before) / 1024 / max(len(sockets), 1),
+            },
+        }
+
+    def output_report(self, report):
+        self.stdout.write(json.dumps(report, indent=2, default=str))
+
+        dropped = report['chat_dropped'] + report['notifications_dropped']
+        if report['failed_connects'] or dropped:
+            self.stdout.write(self.style.WARNING(
+                f"{report['failed_connects']} failed connects, {dropped} dropped events"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('All sockets connected and every event was delivered'))
@@ -59,6 +59,8 @@ class Command(BaseCommand):
                 'memory_available_gb': memory.available / (1024**3),
             },
             'application': app_stats,
+            'cache_tiers': self.get_cache_tier_stats(),
+            'cache_families': self.get_cache_family_stats(),
         }
 
     def get_app_stats(self):
@@ -79,6 +81,24 @@ class Command(BaseCommand):
         except Exception:
             return {'status': 'unavailable'}
 
+    def get_cache_tier_stats(self):
+        """Hit ratios per cache namespace and tier, summed over all workers"""
+        from marketplace import caching
+
+        try:
+            return caching.tier_stats()
+        except Exception:
+            return {}
+
+    def get_cache_family_stats(self):
+        """Hits, latency and value size per cache key family, from the instrumented backend"""
+        from marketplace import cache_metrics
+
+        try:
+            return cache_metrics.report()
+        except Exception:
+            return {}
+
     def output_metrics(self, metrics, output_format):
         """Output metrics in specified format"""
         
@@ -110,4 +130,25 @@ class Command(BaseCommand):
             self.stdout.write(f"   Active Products: {app['active_products']}")
             self.stdout.write(f"   Recent Orders (1h): {app['recent_orders']}")
             self.stdout.write(f"   Recent Messages (1h): {app['recent_messages']}")
-            self.stdout.write(f"   Total Users: {app['total_users']}")
\ No newline at end of file
+            self.stdout.write(f"   Total Users: {app['total_users']}")
+
+        # Cache tiers
+        self.stdout.write(f"\n🗄️  CACHE HIT RATIOS:")
+        for name, tiers in metrics['cache_tiers'].items():
+            parts = []
+            for tier, counts in tiers.items():
+                lookups = counts['hits'] + counts['misses']
+                ratio = f"{counts['ratio']:.0%}" if counts['ratio'] is not None else "-"
+                parts.append(f"{tier} {ratio} of {lookups}")
+            self.stdout.write(f"   {name}: {', '.join(parts)}")
+
+        # Cache key families
+        self.stdout.write(f"\n🔑 CACHE KEY FAMILIES:")
+        for name, family in list(metrics['cache_families'].items())[:15]:
+            ratio = f"{family['hit_ratio']:.0%}" if family['hit_ratio'] is not None else "-"
+            lookups = family['hits'] + family['misses']
+            size = f"{family['avg_size']}B" if family['avg_size'] is not None else "-"
+            self.stdout.write(
+                f"   {name}: {ratio} of {lookups}, read p95 {family['read']['p95_ms'] or '-'}ms, "
+                f"write p95 {family['write']['p95_ms'] or '-'}ms, avg size {size}"
+            )
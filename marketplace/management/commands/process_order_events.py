@@ -0,0 +1,75 @@
+# marketplace/management/commands/process_order_events.py
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from marketplace.order_events import pending_events, process_event
+
+
+class Command(BaseCommand):
+    help = (
+        'Process order side effects (chat messages, system notices, notifications) that the '
+        'post-commit workers did not finish. Run with --loop alongside the web process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and sweep pending events every --interval seconds'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=10,
+            help='Seconds between sweeps in --loop mode (default: 10)'
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=30,
+            help='Only pick up events older than this many seconds (default: 30)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Maximum events per sweep (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.sweep(options, report_idle=True)
+            return
+
+        interval = options['interval']
+        self.stdout.write(f'Starting order event sweeper with {interval}s interval...')
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    # Long-running process: drop connections the DB may have timed out
+                    close_old_connections()
+                    self.sweep(options)
+                except Exception as e:
+                    self.stderr.write(f'Error processing order events: {e}')
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping order event sweeper...')
+
+    def sweep(self, options, report_idle=False):
+        stale_after = timedelta(seconds=options['stale_after'])
+        event_ids = list(pending_events(stale_after).values_list('pk', flat=True)[:options['batch_size']])
+
+        processed = sum(1 for event_id in event_ids if process_event(event_id))
+        if event_ids:
+            failed = len(event_ids) - processed
+            self.stdout.write(
+                self.style.SUCCESS(f'Processed {processed} order events')
+                + (self.style.WARNING(f', {failed} failed or skipped') if failed else '')
+            )
+        elif report_idle:
+            self.stdout.write('No pending order events')
+        return processed
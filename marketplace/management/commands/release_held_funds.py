@@ -1,35 +1,61 @@
 # marketplace/management/commands/release_held_funds.py
+import time
+
 from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.db import close_old_connections
+
 from marketplace.models import HeldFund
 
+
 class Command(BaseCommand):
-    help = 'Release held funds that have passed the 72-hour delay period (Note: Funds are auto-released when users check their balance, so this command is optional)'
+    help = (
+        'Release held funds that have passed the 72-hour delay period. Balance reads no longer '
+        'release funds, so run this with --loop (or from cron every minute) in production.'
+    )
 
-    def handle(self, *args, **options):
-        # Get all unreleased funds that can be released
-        releasable_funds = HeldFund.objects.filter(
-            is_released=False,
-            release_at__lte=timezone.now()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and release due funds every --interval seconds'
         )
-        
-        released_count = 0
-        total_amount = 0
-        
-        for held_fund in releasable_funds:
-            if held_fund.release_fund():
-                released_count += 1
-                total_amount += held_fund.amount
-                self.stdout.write(
-                    f"Released Rs{held_fund.amount} for {held_fund.user.username} "
-                    f"from order {held_fund.order.order_id}"
-                )
-        
-        if released_count > 0:
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds between release runs in --loop mode (default: 60)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.release_due(report_idle=True)
+            return
+
+        interval = options['interval']
+        self.stdout.write(f'Starting held fund release loop with {interval}s interval...')
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    # Long-running process: drop connections the DB may have timed out
+                    close_old_connections()
+                    self.release_due()
+                except Exception as e:
+                    self.stderr.write(f'Error releasing held funds: {e}')
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping held fund release loop...')
+
+    def release_due(self, report_idle=False):
+        released = HeldFund.objects.release_due()
+
+        if released:
+            total_amount = sum(released.values())
             self.stdout.write(
                 self.style.SUCCESS(
-                    f"Successfully released {released_count} funds totaling Rs{total_amount}"
+                    f"Released Rs{total_amount} of held funds for {len(released)} users"
                 )
             )
-        else:
-            self.stdout.write("No funds eligible for release at this time")
\ No newline at end of file
+        elif report_idle:
+            self.stdout.write("No funds eligible for release at this time")
+        return released
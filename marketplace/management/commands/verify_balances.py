@@ -0,0 +1,74 @@
+# marketplace/management/commands/verify_balances.py
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from marketplace import caching
+from marketplace.models import UserBalance
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user balance from the ledger and report drift against the running balance rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Rewrite drifted or missing balance rows from the ledger'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Only check the given user id (can be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        fix = options['fix']
+        user_ids = options['user_ids']
+
+        ledger = UserBalance.objects.ledger_totals(user_ids)
+        rows = UserBalance.objects.all()
+        if user_ids:
+            rows = rows.filter(user_id__in=user_ids)
+        stored = {row.user_id: (row.balance, row.held) for row in rows}
+
+        zero = (Decimal('0.00'), Decimal('0.00'))
+        drifted = []
+        for user_id in sorted(set(ledger) | set(stored)):
+            expected = ledger.get(user_id, zero)
+            actual = stored.get(user_id)
+            if actual is None:
+                # Missing rows are seeded lazily; only report if the ledger is non-zero
+                if expected != zero:
+                    drifted.append((user_id, expected, None))
+            elif actual != expected:
+                drifted.append((user_id, expected, actual))
+
+        for user_id, expected, actual in drifted:
+            if actual is None:
+                self.stdout.write(self.style.WARNING(
+                    f"User {user_id}: no balance row, ledger balance Rs{expected[0]} held Rs{expected[1]}"
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"User {user_id}: balance Rs{actual[0]} (ledger Rs{expected[0]}, drift Rs{actual[0] - expected[0]}), "
+                    f"held Rs{actual[1]} (ledger Rs{expected[1]}, drift Rs{actual[1] - expected[1]})"
+                ))
+
+            if fix:
+                # rebuild() locks the row, so concurrent ledger writes queue behind it
+                UserBalance.objects.rebuild(user_id)
+                caching.bump('balance', user_id)
+                caching.bump('held_balance', user_id)
+
+        checked = len(set(ledger) | set(stored))
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked} users, no drift found"))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked} users, rebuilt {len(drifted)} balance rows"))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f"Checked {checked} users, {len(drifted)} drifted. Re-run with --fix to rebuild them."
+            ))
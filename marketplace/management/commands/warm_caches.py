@@ -0,0 +1,157 @@
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from marketplace import caching
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the catalog, product, review and flat page caches after a deploy or cache flush, '
+        'busiest pages first, so the first visitors do not pay for cold entries.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=50, help='Game pages to warm (default: 50)')
+        parser.add_argument('--categories', type=int, default=200, help='Game category pages to warm (default: 200)')
+        parser.add_argument('--products', type=int, default=500, help='Product pages to warm (default: 500)')
+        parser.add_argument('--sellers', type=int, default=100, help='Seller review stats to warm (default: 100)')
+        parser.add_argument('--days', type=int, default=30, help='Order history used to rank pages (default: 30)')
+        parser.add_argument('--workers', type=int, default=8, help='Entries built in parallel (default: 8)')
+        parser.add_argument(
+            '--force', action='store_true', help='Rebuild entries that are already cached and fresh'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        tasks = self.collect_tasks(options)
+        self.stdout.write(f"Warming {len(tasks)} cache entries with {options['workers']} workers...")
+
+        results = defaultdict(Counter)
+        build_time = Counter()
+        step = max(1, len(tasks) // 10)
+        for done, (namespace, args, outcome, elapsed) in enumerate(
+            self.run(tasks, options['workers'], options['force']), 1
+        ):
+            results[namespace.name][outcome] += 1
+            build_time[namespace.name] += elapsed
+            if done % step == 0 or done == len(tasks):
+                self.stdout.write(
+                    f'  {done}/{len(tasks)} ({done / len(tasks):.0%}) in {time.monotonic() - started:.1f}s'
+                )
+
+        self.stdout.write(f"\n{'namespace':<28} {'built':>7} {'skipped':>8} {'failed':>7} {'seconds':>8}")
+        for name, counts in results.items():
+            self.stdout.write(
+                f"{name:<28} {counts['built']:>7} {counts['skipped']:>8} {counts['failed']:>7} "
+                f'{build_time[name]:>8.2f}'
+            )
+        total = sum(results.values(), Counter())
+        style = self.style.WARNING if total['failed'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"\nWarmed {total['built']} entries ({total['skipped']} already warm, {total['failed']} failed) "
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+
+    def collect_tasks(self, options):
+        """(namespace, args, compute) for every entry to warm, busiest first within each namespace."""
+        from marketplace import views
+        from marketplace.models import FlatPage, Game, GameCategory
+
+        links = self.ranked_links(options['days'])
+        games = list(dict.fromkeys(game_id for _, game_id, _ in links))
+        # Games without a single category still have a page
+        games += [pk for pk in Game.objects.exclude(pk__in=games).order_by('pk').values_list('pk', flat=True)]
+
+        tasks = [
+            (caching.HOME_GAMES, (), views.load_home_games),
+            (caching.TOTAL_GAMES, (), Game.objects.count),
+        ]
+        for game_id in games[:options['games']]:
+            tasks.append((caching.GAME_DETAIL, (game_id,), lambda game_id=game_id: views.load_game_detail(game_id)))
+        for link_id, game_id, category_id in links[:options['categories']]:
+            tasks.append((
+                caching.GAME_CATEGORY, (game_id, category_id),
+                lambda game_id=game_id, category_id=category_id: views.load_game_category(game_id, category_id),
+            ))
+            tasks.append((caching.CATEGORY_FILTERS, (link_id,), GameCategory(pk=link_id).load_filter_tree))
+        for product_id in self.ranked_products(options['days'], options['products']):
+            tasks.append((
+                caching.PRODUCT_DETAIL, (product_id,), lambda product_id=product_id: views.load_product_detail(product_id)
+            ))
+        for seller_id in self.ranked_sellers(options['sellers']):
+            tasks.append((
+                caching.REVIEW_STATS, (seller_id,), lambda seller_id=seller_id: views.load_review_stats(seller_id)
+            ))
+        for slug in FlatPage.objects.order_by('pk').values_list('slug', flat=True):
+            tasks.append((caching.FLAT_PAGE, (slug,), lambda slug=slug: views.load_flat_page(slug)))
+        return tasks
+
+    def ranked_links(self, days):
+        """[(link_id, game_id, category_id)] by orders in the daily rollups, then in setup order."""
+        from marketplace.models import DailyMarketplaceStats, GameCategory
+
+        since = timezone.localdate() - timedelta(days=days)
+        volume = {
+            (row['game_id'], row['category_id']): row['total']
+            for row in DailyMarketplaceStats.objects.filter(
+                day__gte=since, game__isnull=False, category__isnull=False
+            ).values('game_id', 'category_id').annotate(total=Sum('orders'))
+        }
+        links = GameCategory.objects.order_by('pk').values_list('pk', 'game_id', 'category_id')
+        return sorted(links, key=lambda link: -volume.get((link[1], link[2]), 0))
+
+    def ranked_products(self, days, limit):
+        """Active listings with the most orders in the window."""
+        from marketplace.models import Order
+
+        since = timezone.now() - timedelta(days=days)
+        return list(
+            Order.objects.filter(created_at__gte=since, product__is_active=True)
+            .values('product_id').annotate(total=Count('id')).order_by('-total', 'product_id')
+            .values_list('product_id', flat=True)[:limit]
+        )
+
+    def ranked_sellers(self, limit):
+        """Sellers with the most completed sales, from the running order counters."""
+        from marketplace.models import UserOrderCount
+
+        return list(
+            UserOrderCount.objects.filter(role=UserOrderCount.ROLE_SELLER, status='COMPLETED', count__gt=0)
+            .order_by('-count', 'user_id').values_list('user_id', flat=True)[:limit]
+        )
+
+    def run(self, tasks, workers, force):
+        """Yields (namespace, args, outcome, seconds) as entries finish, at most `workers` at a time."""
+        if workers <= 1:
+            for task in tasks:
+                yield self.warm(*task, force)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='warm-caches') as executor:
+            futures = [executor.submit(self.warm_in_worker, *task, force) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def warm_in_worker(self, namespace, args, compute, force):
+        close_old_connections()
+        try:
+            return self.warm(namespace, args, compute, force)
+        finally:
+            close_old_connections()
+
+    def warm(self, namespace, args, compute, force):
+        started = time.perf_counter()
+        try:
+            outcome = 'built' if namespace.warm(*args, compute=compute, force=force) else 'skipped'
+        except Exception as e:
+            # A listing or page deleted since it was ranked; keep warming the rest
+            self.stderr.write(f'Could not warm {namespace.key(*args)}: {e!r}')
+            outcome = 'failed'
+        return namespace, args, outcome, time.perf_counter() - started
@@ -1,6 +1,8 @@
 from django.utils import timezone
 from django.core.cache import cache
 from .models import Profile
+from . import caching
+from .site_config import request_scope
 import datetime
 
 class UpdateLastSeenMiddleware:
@@ -40,4 +42,19 @@ class UpdateLastSeenMiddleware:
             except Profile.DoesNotExist:
                 # Create profile if it doesn't exist
                 Profile.objects.create(user=user, last_seen=now)
-                cache.set(cache_key, now, 300)
\ No newline at end of file
+                cache.set(cache_key, now, 300)
+
+class SiteConfigMiddleware:
+    """
+    Opens a per-request scope for the SiteConfiguration snapshot so the shared
+    version key is checked at most once per request, however many prices the
+    page renders. The catalog cache version (caching.catalog_version) is
+    scoped the same way.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_scope(), caching.request_scope():
+            return self.get_response(request)
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:20
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def seed_user_balances(apps, schema_editor):
+    """Seed one balance row per user that has ledger activity"""
+    Transaction = apps.get_model('marketplace', 'Transaction')
+    HeldFund = apps.get_model('marketplace', 'HeldFund')
+    UserBalance = apps.get_model('marketplace', 'UserBalance')
+
+    totals = {}
+    completed = Transaction.objects.filter(status='COMPLETED').order_by().values('user_id').annotate(total=Sum('amount'))
+    for row in completed:
+        totals.setdefault(row['user_id'], [Decimal('0.00'), Decimal('0.00')])[0] = row['total'] or Decimal('0.00')
+    held = HeldFund.objects.filter(is_released=False).order_by().values('user_id').annotate(total=Sum('amount'))
+    for row in held:
+        totals.setdefault(row['user_id'], [Decimal('0.00'), Decimal('0.00')])[1] = row['total'] or Decimal('0.00')
+
+    UserBalance.objects.bulk_create(
+        [UserBalance(user_id=user_id, balance=balance, held=held_total) for user_id, (balance, held_total) in totals.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('marketplace', '0038_order_seller_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('held', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_user_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def split_stock_blobs(apps, schema_editor):
+    """Move each automatic-delivery product's stock_details lines into StockItem rows"""
+    Product = apps.get_model('marketplace', 'Product')
+    StockItem = apps.get_model('marketplace', 'StockItem')
+
+    products = Product.objects.filter(automatic_delivery=True).exclude(stock_details='').only('id', 'stock_details')
+    for product in products.iterator(chunk_size=100):
+        codes = [line.strip() for line in product.stock_details.splitlines() if line.strip()]
+        StockItem.objects.bulk_create(
+            [StockItem(product_id=product.id, content=code) for code in codes],
+            batch_size=1000,
+        )
+        Product.objects.filter(pk=product.id).update(available_stock_items=len(codes), stock_details='')
+
+
+def join_stock_items(apps, schema_editor):
+    """Rebuild the stock_details blobs from unsold StockItem rows"""
+    Product = apps.get_model('marketplace', 'Product')
+    StockItem = apps.get_model('marketplace', 'StockItem')
+
+    product_ids = StockItem.objects.filter(is_claimed=False).values_list('product_id', flat=True).distinct()
+    for product_id in product_ids:
+        codes = StockItem.objects.filter(product_id=product_id, is_claimed=False).order_by('id').values_list('content', flat=True)
+        Product.objects.filter(pk=product_id).update(stock_details='\n'.join(codes))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0039_userbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_stock_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField()),
+                ('is_claimed', models.BooleanField(default=False)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivered_stock_items', to='marketplace.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_items', to='marketplace.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'is_claimed', 'id'], name='stockitem_claim_idx')],
+            },
+        ),
+        migrations.RunPython(split_stock_blobs, join_stock_items),
+    ]
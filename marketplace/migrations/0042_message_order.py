@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0041_orderevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chat_messages', to='marketplace.order'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-19 01:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def seed_order_counts(apps, schema_editor):
+    Order = apps.get_model('marketplace', 'Order')
+    UserOrderCount = apps.get_model('marketplace', 'UserOrderCount')
+
+    rows = []
+    for role in ('buyer', 'seller'):
+        field = f'{role}_id'
+        totals = Order.objects.order_by().values(field, 'status').annotate(total=Count('id'))
+        for row in totals.iterator():
+            rows.append(UserOrderCount(user_id=row[field], role=role, status=row['status'], count=row['total']))
+    UserOrderCount.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0042_message_order'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserOrderCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('buyer', 'Buyer'), ('seller', 'Seller')], max_length=10)),
+                ('status', models.CharField(choices=[('PENDING_PAYMENT', 'Pending Payment'), ('PROCESSING', 'Processing'), ('DELIVERED', 'Delivered'), ('COMPLETED', 'Completed'), ('DISPUTED', 'Disputed'), ('REFUNDED', 'Refunded'), ('CANCELLED', 'Cancelled')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['buyer', '-created_at', '-id'], name='order_buyer_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['seller', '-created_at', '-id'], name='order_seller_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='transaction_user_recent_idx'),
+        ),
+        migrations.AddField(
+            model_name='userordercount',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_counts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='userordercount',
+            constraint=models.UniqueConstraint(fields=('user', 'role', 'status'), name='unique_user_order_count'),
+        ),
+        migrations.RunPython(seed_order_counts, migrations.RunPython.noop),
+    ]
@@ -2,7 +2,9 @@
 
 from django.utils import timezone
 import datetime
-from django.db import models
+from django.db import IntegrityError, models, router
+from django.db import transaction as db_transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -14,6 +16,8 @@ import string
 import random
 # Import simple Google Cloud Storage
 from .simple_storage import google_cloud_chat_storage, google_cloud_profile_storage, google_cloud_product_storage
+from . import caching
+from .site_config import bump_site_config_version, get_site_config
 
 # Money helpers
 MONEY_QUANTIZER = Decimal('0.01')
@@ -42,6 +46,29 @@ class ProductQuerySet(models.QuerySet):
     def recent_first(self):
         return self.order_by('-created_at')
 
+    def with_buyer_price(self):
+        """
+        Annotates effective_commission_rate (seller override, then category,
+        then site default) and buyer_price_value, the unit price the buyer
+        pays, so listing cards need no per-row lookups and price sorting
+        follows the price buyers actually see.
+        """
+        from django.db.models import DecimalField, ExpressionWrapper, Value
+        from django.db.models.functions import Coalesce
+
+        rate = Coalesce(
+            'seller__profile__commission_rate',
+            'category__commission_rate',
+            Value(get_default_commission_rate()),
+            output_field=DecimalField(max_digits=5, decimal_places=2),
+        )
+        return self.annotate(effective_commission_rate=rate).annotate(
+            buyer_price_value=ExpressionWrapper(
+                F('price') + F('price') * F('effective_commission_rate') / Value(Decimal('100')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
 class OrderQuerySet(models.QuerySet):
     def with_full_details(self):
         return self.select_related(
@@ -53,7 +80,7 @@ class OrderQuerySet(models.QuerySet):
         return self.filter(status=status)
 
     def recent_first(self):
-        return self.order_by('-created_at')
+        return self.order_by('-created_at', '-id')
 
 class ReviewQuerySet(models.QuerySet):
     def with_full_details(self):
@@ -80,6 +107,140 @@ class MessageQuerySet(models.QuerySet):
     def by_timestamp(self):
         return self.order_by('timestamp')
 
+class TransactionQuerySet(models.QuerySet):
+    def update_with_balances(self, **changes):
+        """
+        queryset.update() for ledger rows that keeps UserBalance in step.
+        The affected rows are locked, updated, and each owner's running
+        balance moves by the change in their COMPLETED total, all in one
+        DB transaction. `amount` must be a plain value, not an expression.
+        """
+        with db_transaction.atomic(using=self.db):
+            rows = list(self.select_for_update().values_list('pk', 'user_id', 'amount', 'status'))
+            if not rows:
+                return 0
+            updated = self.model.objects.filter(pk__in=[row[0] for row in rows]).update(**changes)
+
+            deltas = {}
+            for _pk, user_id, amount, status in rows:
+                old_total = amount if status == 'COMPLETED' else Decimal('0.00')
+                new_amount = Decimal(changes.get('amount', amount))
+                new_total = new_amount if changes.get('status', status) == 'COMPLETED' else Decimal('0.00')
+                deltas[user_id] = deltas.get(user_id, Decimal('0.00')) + new_total - old_total
+
+            for user_id, delta in deltas.items():
+                UserBalance.objects.adjust(user_id, balance=delta)
+        invalidate_user_balance_cache(*deltas.keys())
+        return updated
+
+def _can_return_from_update(connection):
+    """UPDATE ... RETURNING: every PostgreSQL Django supports, and SQLite 3.35+."""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+class HeldFundQuerySet(models.QuerySet):
+    def release_due(self, now=None):
+        """
+        Releases every fund in this queryset whose hold has expired with a
+        single UPDATE ... RETURNING, then moves each owner's held total and
+        drops their cached held balance in one batch.
+        Returns {user_id: total released}.
+        """
+        from django.db import connections
+
+        connection = connections[self.db]
+        now = now or timezone.now()
+        due = self.filter(is_released=False, release_at__lte=now)
+        released = {}
+
+        with db_transaction.atomic(using=self.db):
+            for user_id, amount in self._release_rows(due, now, connection):
+                released[user_id] = released.get(user_id, Decimal('0.00')) + quantize_money(amount)
+            for user_id, total in released.items():
+                UserBalance.objects.adjust(user_id, held=-total)
+
+        invalidate_user_balance_cache(*released.keys(), held=True)
+        return released
+
+    def _release_rows(self, due, now, connection):
+        opts = self.model._meta
+        released_at = opts.get_field('released_at').get_db_prep_value(now, connection)
+
+        # PostgreSQL and SQLite 3.35+ can return the released rows from the UPDATE itself
+        if _can_return_from_update(connection):
+            qn = connection.ops.quote_name
+            subquery, params = due.order_by().values('pk').query.get_compiler(connection=connection).as_sql()
+            sql = (
+                f"UPDATE {qn(opts.db_table)} SET {qn(opts.get_field('is_released').column)} = %s, "
+                f"{qn(opts.get_field('released_at').column)} = %s "
+                f"WHERE {qn(opts.pk.column)} IN ({subquery}) AND {qn(opts.get_field('is_released').column)} = %s "
+                f"RETURNING {qn(opts.get_field('user').column)}, {qn(opts.get_field('amount').column)}"
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [True, released_at, *params, False])
+                return cursor.fetchall()
+
+        # Other backends: lock the due rows, then update them by primary key
+        rows = list(due.select_for_update().values_list('pk', 'user_id', 'amount'))
+        if rows:
+            self.model.objects.filter(pk__in=[row[0] for row in rows], is_released=False).update(
+                is_released=True, released_at=now
+            )
+        return [(user_id, amount) for _pk, user_id, amount in rows]
+
+    def release_schedule(self, now=None):
+        """
+        Buckets the unreleased funds in this queryset by release time with a
+        single conditional-aggregation query. Returns a dict with 'buckets'
+        (non-empty buckets only, in display order), 'total_amount' and 'count'.
+        """
+        from django.db.models import Count, Q, Sum
+
+        now = now or timezone.now()
+        ranges = [
+            ('available_now', now - datetime.timedelta(minutes=1), now),
+            ('next_24h', now, now + datetime.timedelta(hours=24)),
+            ('next_48h', now + datetime.timedelta(hours=24), now + datetime.timedelta(hours=48)),
+            ('later', now + datetime.timedelta(hours=48), now + datetime.timedelta(days=365)),
+        ]
+
+        aggregates = {'total_amount': Sum('amount'), 'count': Count('id')}
+        for label, start, end in ranges:
+            if label == 'available_now':
+                bucket = Q(release_at__lte=now)
+            else:
+                bucket = Q(release_at__gt=start, release_at__lte=end)
+            aggregates[f'{label}_amount'] = Sum('amount', filter=bucket)
+            aggregates[f'{label}_count'] = Count('id', filter=bucket)
+
+        stats = self.filter(is_released=False).aggregate(**aggregates)
+
+        buckets = []
+        for label, start, end in ranges:
+            if stats[f'{label}_count']:
+                buckets.append({
+                    'label': label,
+                    'count': stats[f'{label}_count'],
+                    'total_amount': stats[f'{label}_amount'] or 0,
+                    'start': start,
+                    'end': end,
+                })
+        return {
+            'buckets': buckets,
+            'total_amount': stats['total_amount'] or Decimal('0.00'),
+            'count': stats['count'],
+        }
+
+class StockItemQuerySet(models.QuerySet):
+    def available(self):
+        return self.filter(is_claimed=False)
+
+    def for_product(self, product):
+        return self.filter(product=product)
+
 # Custom Managers
 class ProductManager(models.Manager):
     def get_queryset(self):
@@ -91,6 +252,9 @@ class ProductManager(models.Manager):
     def with_full_details(self):
         return self.get_queryset().with_full_details()
 
+    def with_buyer_price(self):
+        return self.get_queryset().with_buyer_price()
+
 class OrderManager(models.Manager):
     def get_queryset(self):
         return OrderQuerySet(self.model, using=self._db)
@@ -112,15 +276,455 @@ class MessageManager(models.Manager):
     def with_sender_info(self):
         return self.get_queryset().with_sender_info()
 
+class TransactionManager(models.Manager):
+    def get_queryset(self):
+        return TransactionQuerySet(self.model, using=self._db)
+
+class HeldFundManager(models.Manager):
+    def get_queryset(self):
+        return HeldFundQuerySet(self.model, using=self._db)
+
+    def release_due(self, now=None):
+        return self.get_queryset().release_due(now)
+
+    def release_schedule(self, now=None):
+        return self.get_queryset().release_schedule(now)
+
+class StockItemManager(models.Manager):
+    def get_queryset(self):
+        return StockItemQuerySet(self.model, using=self._db)
+
+    def available(self):
+        return self.get_queryset().available()
+
+    def import_codes(self, product, codes, batch_size=1000):
+        """
+        Appends one unsold item per non-blank line in `codes` (any iterable of
+        strings, e.g. a textarea's lines or an uploaded file) and bumps the
+        product's available count. Returns the number of items added.
+        """
+        items = [self.model(product=product, content=code.strip()) for code in codes if code.strip()]
+        if not items:
+            return 0
+        with db_transaction.atomic(using=self.db):
+            self.bulk_create(items, batch_size=batch_size)
+            Product.objects.filter(pk=product.pk).update(
+                available_stock_items=F('available_stock_items') + len(items)
+            )
+            caching.bump('product', product.pk)
+        product.refresh_from_db(fields=['available_stock_items'])
+        return len(items)
+
+    def export_codes(self, product):
+        """Yields the product's unsold codes in delivery order without loading them all at once."""
+        queryset = self.available().for_product(product).order_by('id').values_list('content', flat=True)
+        yield from queryset.iterator(chunk_size=2000)
+
+    def clear_unsold(self, product):
+        """Deletes every unsold item for the product and zeroes its available count."""
+        with db_transaction.atomic(using=self.db):
+            deleted, _ = self.available().for_product(product).delete()
+            Product.objects.filter(pk=product.pk).update(available_stock_items=0)
+        product.available_stock_items = 0
+        return deleted
+
+    def claim(self, product, quantity):
+        """
+        Claims the oldest `quantity` unsold items for the product. Rows another
+        buyer has locked are skipped instead of waited on (SKIP LOCKED where the
+        backend supports it), so concurrent purchases of one listing never
+        queue behind each other. Returns the claimed items, or None when fewer
+        than `quantity` are free. Call inside the purchase transaction and
+        finish with deliver() once the order exists.
+        """
+        from django.db import connections
+
+        queryset = self.available().for_product(product).order_by('id')
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        else:
+            queryset = queryset.select_for_update()
+
+        items = list(queryset[:quantity])
+        if len(items) < quantity:
+            return None
+
+        now = timezone.now()
+        self.filter(pk__in=[item.pk for item in items]).update(is_claimed=True, claimed_at=now)
+        for item in items:
+            item.is_claimed = True
+            item.claimed_at = now
+        return items
+
+    def deliver(self, items, order):
+        """
+        Links claimed items to their order and moves the product's available
+        count. The counter UPDATE is the only statement that touches the
+        product row, so it is issued last to hold that row lock briefly.
+        """
+        from django.db.models import Case, Value, When
+
+        if not items:
+            return
+        self.filter(pk__in=[item.pk for item in items]).update(order=order)
+        count = len(items)
+        # A queryset update sends no signals, so invalidate the product page here
+        caching.bump('product', items[0].product_id)
+        Product.objects.filter(pk=items[0].product_id).update(
+            available_stock_items=F('available_stock_items') - count,
+            is_active=Case(
+                When(available_stock_items__lte=count, then=Value(False)),
+                default=F('is_active'),
+            ),
+        )
+
+class UserBalanceManager(models.Manager):
+    def ledger_totals(self, user_ids=None):
+        """
+        Recomputes {user_id: (balance, held)} from the ledger tables.
+        This is the slow path the balance rows exist to avoid; it is only
+        used to seed missing rows and by verify_balances.
+        """
+        from django.db.models import Sum
+
+        transactions = Transaction.objects.filter(status='COMPLETED')
+        held_funds = HeldFund.objects.filter(is_released=False)
+        if user_ids is not None:
+            transactions = transactions.filter(user_id__in=user_ids)
+            held_funds = held_funds.filter(user_id__in=user_ids)
+
+        totals = {}
+        for user_id, total in transactions.order_by().values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total'):
+            totals[user_id] = (total or Decimal('0.00'), Decimal('0.00'))
+        for user_id, total in held_funds.order_by().values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total'):
+            balance = totals.get(user_id, (Decimal('0.00'), None))[0]
+            totals[user_id] = (balance, total or Decimal('0.00'))
+        return totals
+
+    def seed(self, user_ids):
+        """
+        Inserts zero rows for users that have none and leaves existing rows
+        alone, so concurrent seeds never overwrite each other's totals.
+        """
+        self.bulk_create([self.model(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+
+    def lock(self, user_id):
+        """The user's row under SELECT FOR UPDATE, seeding it first if needed."""
+        self.seed([user_id])
+        return self.select_for_update().get(user_id=user_id)
+
+    def rebuild(self, user_id):
+        """
+        Overwrites a user's balance row from the ledger. The row is locked
+        before the ledger is summed, so ledger writes that commit later
+        apply their own F() update on top of the rebuilt totals.
+        """
+        with db_transaction.atomic(using=self.db):
+            row = self.lock(user_id)
+            row.balance, row.held = self.ledger_totals([user_id]).get(user_id, (Decimal('0.00'), Decimal('0.00')))
+            row.save(update_fields=['balance', 'held', 'updated_at'])
+        return row
+
+    def for_user(self, user):
+        """
+        Balance, held and available for a user in a single primary-key read.
+        Reads never write: a user without a row (none of their ledger writes
+        has run since the 0039 backfill) gets an unsaved row of ledger totals.
+        """
+        row = self.filter(user_id=user.id).first()
+        if row is None:
+            balance, held = self.ledger_totals([user.id]).get(user.id, (Decimal('0.00'), Decimal('0.00')))
+            row = self.model(user_id=user.id, balance=balance, held=held)
+        return row
+
+    def adjust(self, user_id, balance=Decimal('0.00'), held=Decimal('0.00'), create_missing=True):
+        """
+        Moves a user's running totals with an F() expression so concurrent
+        ledger writes never lose an update. Call inside the same DB
+        transaction as the ledger write. A missing row is seeded at zero and
+        then moved the same way: every earlier ledger write created or moved
+        the row, so a user without one has nothing else on the ledger.
+        """
+        if not balance and not held:
+            return
+        changes = {
+            'balance': F('balance') + balance,
+            'held': F('held') + held,
+            'updated_at': timezone.now(),
+        }
+        if not self.filter(user_id=user_id).update(**changes) and create_missing:
+            self.seed([user_id])
+            self.filter(user_id=user_id).update(**changes)
+
+class UserOrderCountManager(models.Manager):
+    def order_totals(self, user_ids):
+        """Recomputes {(user_id, role, status): count} from the orders table."""
+        from django.db.models import Count
+
+        totals = {}
+        for role in (UserOrderCount.ROLE_BUYER, UserOrderCount.ROLE_SELLER):
+            field = f'{role}_id'
+            rows = (
+                Order.objects.filter(**{f'{field}__in': user_ids}).order_by()
+                .values(field, 'status').annotate(total=Count('id')).values_list(field, 'status', 'total')
+            )
+            for user_id, status, total in rows:
+                totals[(user_id, role, status)] = total
+        return totals
+
+    def rebuild(self, user_ids):
+        """
+        Overwrites the users' rows from the orders table. A repair tool:
+        order writes that commit while it runs are not counted.
+        """
+        user_ids = list(user_ids)
+        totals = self.order_totals(user_ids)
+        with db_transaction.atomic(using=self.db):
+            self.filter(user_id__in=user_ids).update(count=0)
+            for (user_id, role, status), total in totals.items():
+                self.update_or_create(user_id=user_id, role=role, status=status, defaults={'count': total})
+
+    def adjust(self, user_id, role, changes, create_missing=True):
+        """
+        Applies {status: delta} to one user's counters with F() expressions.
+        Call inside the order write's transaction. Rows are created lazily
+        per status, so a missing row is inserted at zero (ignoring a
+        concurrent insert of the same row) and then moved the same way;
+        the 0043 backfill means a missing row has no earlier orders to count.
+        """
+        for status, delta in changes.items():
+            if not delta:
+                continue
+            row = self.filter(user_id=user_id, role=role, status=status)
+            if not row.update(count=F('count') + delta) and create_missing:
+                self.bulk_create(
+                    [self.model(user_id=user_id, role=role, status=status)], ignore_conflicts=True
+                )
+                row.update(count=F('count') + delta)
+
+    def count_order(self, order, changes, create_missing=True):
+        """Applies {status: delta} to the order's buyer and seller counters."""
+        self.adjust(order.buyer_id, UserOrderCount.ROLE_BUYER, changes, create_missing)
+        self.adjust(order.seller_id, UserOrderCount.ROLE_SELLER, changes, create_missing)
+
+    def counts_for(self, user_id):
+        """{(role, status): count} for one user in a single indexed read."""
+        return {
+            (role, status): count
+            for role, status, count in self.filter(user_id=user_id).values_list('role', 'status', 'count')
+        }
+
+class DailyMarketplaceStatsManager(models.Manager):
+    WATERMARK = 'daily_marketplace_stats'
+    # Orders saved this long before the last run are scanned again, so a
+    # transaction that committed after the run started is never missed.
+    REFRESH_OVERLAP = datetime.timedelta(minutes=10)
+
+    @staticmethod
+    def _day_filter(field, days):
+        """Q matching `field` on any of the local calendar days, one range per run of consecutive days."""
+        from django.db.models import Q
+
+        tz = timezone.get_current_timezone()
+        condition = Q()
+        days = sorted(days)
+        start = previous = days[0]
+        for day in days[1:] + [None]:
+            if day is not None and day == previous + datetime.timedelta(days=1):
+                previous = day
+                continue
+            condition |= Q(**{
+                f'{field}__gte': timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz),
+                f'{field}__lt': timezone.make_aware(
+                    datetime.datetime.combine(previous + datetime.timedelta(days=1), datetime.time.min), tz
+                ),
+            })
+            start = previous = day
+        return condition
+
+    def compute(self, days=None):
+        """
+        Recomputes the rows for `days` (every day if None) from the orders,
+        products and users tables with one GROUP BY query each. Orders count
+        on the day they were placed; commission follows the dashboard rule of
+        commission_paid, then total - seller_amount, then the effective rate.
+        """
+        from django.db.models import Count, DecimalField, Q, Sum, Case, When, Value
+        from django.db.models.functions import Coalesce, TruncDate
+
+        orders = Order.objects.order_by()
+        products = Product.objects.order_by()
+        users = User.objects.order_by()
+        if days is not None:
+            if not days:
+                return []
+            orders = orders.filter(self._day_filter('created_at', days))
+            products = products.filter(self._day_filter('created_at', days))
+            users = users.filter(self._day_filter('date_joined', days))
+
+        money = DecimalField(max_digits=14, decimal_places=2)
+        rate = Coalesce(
+            'seller__profile__commission_rate',
+            'category_snapshot__commission_rate',
+            'product__category__commission_rate',
+            Value(get_default_commission_rate()),
+            output_field=money,
+        )
+        commission = Coalesce(
+            'commission_paid',
+            Case(When(seller_amount__gt=0, then=F('total_price') - F('seller_amount'))),
+            F('total_price') * rate / Value(Decimal('100')),
+            output_field=money,
+        )
+        completed = Q(status='COMPLETED')
+        refunded = Q(status='REFUNDED')
+
+        rows = {}
+
+        def row(day, game_id=None, category_id=None):
+            key = (day, game_id, category_id)
+            if key not in rows:
+                rows[key] = self.model(day=day, game_id=game_id, category_id=category_id)
+            return rows[key]
+
+        order_groups = (
+            orders.annotate(day=TruncDate('created_at'))
+            .values('day', 'game_snapshot_id', 'category_snapshot_id')
+            .annotate(
+                orders=Count('id'),
+                completed_orders=Count('id', filter=completed),
+                gmv=Sum('total_price', filter=completed),
+                commission=Sum(commission, filter=completed),
+                refunded_orders=Count('id', filter=refunded),
+                refunds=Sum('total_price', filter=refunded),
+            )
+        )
+        for group in order_groups:
+            stats = row(group['day'], group['game_snapshot_id'], group['category_snapshot_id'])
+            stats.orders = group['orders']
+            stats.completed_orders = group['completed_orders']
+            stats.gmv = group['gmv'] or Decimal('0.00')
+            stats.commission = quantize_money(group['commission'] or Decimal('0.00'))
+            stats.refunded_orders = group['refunded_orders']
+            stats.refunds = group['refunds'] or Decimal('0.00')
+
+        listing_groups = (
+            products.annotate(day=TruncDate('created_at'))
+            .values('day', 'game_id', 'category_id').annotate(total=Count('id'))
+        )
+        for group in listing_groups:
+            row(group['day'], group['game_id'], group['category_id']).new_listings = group['total']
+
+        # Sign-ups belong to no game, so they live on the site-wide row
+        user_groups = users.annotate(day=TruncDate('date_joined')).values('day').annotate(total=Count('id'))
+        for group in user_groups:
+            row(group['day']).new_users = group['total']
+
+        return list(rows.values())
+
+    def rebuild_days(self, days=None):
+        """Replaces the stored rows for `days` (every day if None) with freshly computed ones."""
+        stats = self.compute(days)
+        with db_transaction.atomic(using=self.db):
+            existing = self.all() if days is None else self.filter(day__in=list(days))
+            existing.delete()
+            self.bulk_create(stats, batch_size=1000)
+        return stats
+
+    def touched_days(self, since):
+        """Local days whose orders changed, or that gained listings or users, at or after `since`."""
+        from django.db.models.functions import TruncDate
+
+        days = set()
+        for queryset, changed, created in (
+            (Order.objects, 'updated_at', 'created_at'),
+            (Product.objects, 'created_at', 'created_at'),
+            (User.objects, 'date_joined', 'date_joined'),
+        ):
+            days.update(
+                queryset.filter(**{f'{changed}__gte': since}).order_by()
+                .annotate(day=TruncDate(created)).values_list('day', flat=True).distinct()
+            )
+        return days
+
+    def refresh(self, now=None, full=False):
+        """
+        Brings the rollups up to date from the watermark left by the last
+        run and moves it forward. Without a watermark (or with full=True)
+        every day is rebuilt. Returns the days rewritten, or None for a
+        full rebuild.
+        """
+        now = now or timezone.now()
+        mark = RollupWatermark.objects.filter(name=self.WATERMARK).first()
+        if mark is None or full:
+            days = None
+            self.rebuild_days()
+        else:
+            days = self.touched_days(mark.value - self.REFRESH_OVERLAP)
+            if days:
+                self.rebuild_days(days)
+        RollupWatermark.objects.update_or_create(name=self.WATERMARK, defaults={'value': now})
+        return days
+
+    def last_refreshed(self):
+        return RollupWatermark.objects.filter(name=self.WATERMARK).values_list('value', flat=True).first()
+
+    def totals(self, since=None):
+        """All-time sums, plus the same sums for days on or after `since` under *_recent keys."""
+        from django.db.models import Q, Sum
+
+        fields = self.model.SUM_FIELDS
+        # Aliases may not shadow field names, hence the sum_ prefix
+        aggregates = {f'sum_{field}': Sum(field) for field in fields}
+        if since is not None:
+            aggregates.update({f'sum_{field}_recent': Sum(field, filter=Q(day__gte=since)) for field in fields})
+        return {key[4:]: value or 0 for key, value in self.aggregate(**aggregates).items()}
+
+    def series(self, start, end, **filters):
+        """
+        One dict per day from `start` to `end` inclusive, summed over games and
+        categories (narrow with e.g. game_id=...). Days without rows are zero.
+        """
+        from django.db.models import Sum
+
+        fields = self.model.SUM_FIELDS
+        found = {
+            group['day']: group
+            for group in self.filter(day__gte=start, day__lte=end, **filters).order_by('day')
+            .values('day').annotate(**{f'sum_{field}': Sum(field) for field in fields})
+        }
+        days = []
+        day = start
+        while day <= end:
+            group = found.get(day, {})
+            days.append({'day': day, **{field: group.get(f'sum_{field}') or 0 for field in fields}})
+            day += datetime.timedelta(days=1)
+        return days
+
 class SiteConfiguration(models.Model):
     default_commission_rate = models.DecimalField(max_digits=5, decimal_places=2, default=10.00)
     def __str__(self): return "Site Configuration"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_site_config_version()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_site_config_version()
+        return result
+
+
+def get_default_commission_rate():
+    """Site-wide default commission rate from this process's config snapshot"""
+    return get_site_config().default_commission_rate
+
 
 def get_effective_commission_rate_for_listing(seller, category=None):
     """
     Determine the commission rate for a seller/category combination.
     Priority: seller-specific override, category override, then site default.
+    ProductQuerySet.with_buyer_price() applies the same priority in SQL.
     """
     profile = getattr(seller, 'profile', None)
     if profile and profile.commission_rate is not None:
@@ -129,11 +733,7 @@ def get_effective_commission_rate_for_listing(seller, category=None):
     if category and category.commission_rate is not None:
         return Decimal(category.commission_rate)
 
-    config = SiteConfiguration.objects.first()
-    if config and config.default_commission_rate is not None:
-        return Decimal(config.default_commission_rate)
-
-    return Decimal('10.00')
+    return get_default_commission_rate()
 
 
 class FlatPage(models.Model):
@@ -201,15 +801,14 @@ class GameCategory(models.Model):
 
         return self.approved_sellers.filter(pk=user.pk).exists()
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        from django.core.cache import cache
-        cache.delete(f'game_category_{self.game_id}_{self.category_id}')
+    def filter_tree(self):
+        """This link's filters in display order with their options, as cached FilterSnapshots."""
+        return caching.CATEGORY_FILTERS.get_or_set(self.pk, compute=self.load_filter_tree)
 
-    def delete(self, *args, **kwargs):
-        from django.core.cache import cache
-        cache.delete(f'game_category_{self.game_id}_{self.category_id}')
-        super().delete(*args, **kwargs)
+    def load_filter_tree(self):
+        from .snapshots import FilterSnapshot
+
+        return tuple(FilterSnapshot.from_filter(f) for f in self.filters.prefetch_related('options'))
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -244,30 +843,22 @@ class Profile(models.Model):
         """Check if user can moderate conversations (admin or moderator)"""
         return self.user.is_staff or self.user.is_superuser or self.is_moderator
 
+    @property
+    def wallet(self):
+        """The user's running balance row (balance, held and available in one read)."""
+        return UserBalance.objects.for_user(self.user)
+
     @property
     def balance(self):
-        """Calculate user's current balance from completed transactions with caching"""
-        from django.db.models import Sum
-        from django.core.cache import cache
-        
-        cache_key = f'user_balance_{self.user.id}'
-        cached_balance = cache.get(cache_key)
-        
-        if cached_balance is not None:
-            return Decimal(str(cached_balance))
-            
-        balance_data = Transaction.objects.filter(user=self.user, status='COMPLETED').aggregate(balance=Sum('amount'))
-        balance = balance_data.get('balance') or Decimal('0.00')
-        
-        # Cache for 5 minutes - balance changes are not ultra-frequent
-        cache.set(cache_key, str(balance), 300)
-        return balance
+        """User's current balance from completed transactions, with caching"""
+        return Decimal(caching.USER_BALANCE.get_or_set(self.user_id, compute=lambda: str(self.wallet.balance)))
 
     @property
     def available_balance(self):
-        """Calculate user's available balance (total balance minus held funds)"""
-        # Auto-release eligible funds first
-        self._auto_release_funds()
+        """
+        User's available balance (total balance minus held funds). Expired
+        holds are released by the release_held_funds scheduler, never here.
+        """
         return self.balance - self._get_held_balance()
 
     @property
@@ -276,36 +867,8 @@ class Profile(models.Model):
         return self._get_held_balance()
     
     def _get_held_balance(self):
-        """Get held balance without auto-release to avoid circular calls with caching"""
-        from django.db.models import Sum
-        from django.core.cache import cache
-        
-        cache_key = f'user_held_balance_{self.user.id}'
-        cached_held_balance = cache.get(cache_key)
-        
-        if cached_held_balance is not None:
-            return Decimal(str(cached_held_balance))
-            
-        held_data = HeldFund.objects.filter(
-            user=self.user, 
-            is_released=False
-        ).aggregate(total_held=Sum('amount'))
-        held_balance = held_data.get('total_held') or Decimal('0.00')
-        
-        # Cache for 2 minutes - held funds change less frequently
-        cache.set(cache_key, str(held_balance), 120)
-        return held_balance
-    
-    def _auto_release_funds(self):
-        """Automatically release funds that have passed the 72-hour period"""
-        eligible_funds = HeldFund.objects.filter(
-            user=self.user,
-            is_released=False,
-            release_at__lte=timezone.now()
-        )
-        
-        for held_fund in eligible_funds:
-            held_fund.release_fund()
+        """Get held balance with caching"""
+        return Decimal(caching.USER_HELD_BALANCE.get_or_set(self.user_id, compute=lambda: str(self.wallet.held)))
     
     def get_held_funds_details(self):
         """Get detailed breakdown of held funds with individual release times"""
@@ -315,51 +878,8 @@ class Profile(models.Model):
         ).select_related('order').order_by('release_at')
     
     def get_held_funds_summary(self):
-        """Get summary of held funds grouped by release timeframe"""
-        from django.db.models import Sum, Count
-        from django.utils import timezone
-        import datetime
-        
-        now = timezone.now()
-        
-        # Define time ranges
-        ranges = [
-            ('available_now', now - datetime.timedelta(minutes=1), now),
-            ('next_24h', now, now + datetime.timedelta(hours=24)),
-            ('next_48h', now + datetime.timedelta(hours=24), now + datetime.timedelta(hours=48)),
-            ('later', now + datetime.timedelta(hours=48), now + datetime.timedelta(days=365))
-        ]
-        
-        summary = []
-        for label, start, end in ranges:
-            if label == 'available_now':
-                funds = HeldFund.objects.filter(
-                    user=self.user,
-                    is_released=False,
-                    release_at__lte=now
-                )
-            else:
-                funds = HeldFund.objects.filter(
-                    user=self.user,
-                    is_released=False,
-                    release_at__gt=start,
-                    release_at__lte=end
-                )
-            
-            if funds.exists():
-                stats = funds.aggregate(
-                    total_amount=Sum('amount'),
-                    count=Count('id')
-                )
-                summary.append({
-                    'label': label,
-                    'count': stats['count'],
-                    'total_amount': stats['total_amount'] or 0,
-                    'start': start,
-                    'end': end
-                })
-        
-        return summary
+        """Get summary of held funds grouped by release timeframe (one query)"""
+        return HeldFund.objects.filter(user=self.user).release_schedule()['buckets']
 
     def __str__(self): return f'{self.user.username} Profile'
 
@@ -377,7 +897,9 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     automatic_delivery = models.BooleanField(default=False, verbose_name="Automatic delivery", db_index=True)
     stock = models.PositiveIntegerField(null=True, blank=True, verbose_name="In Stock")
+    # Import buffer only: lines saved here are moved into StockItem rows on save
     stock_details = models.TextField(blank=True)
+    available_stock_items = models.PositiveIntegerField(default=0, editable=False)
     post_purchase_message = models.TextField(blank=True, verbose_name="Message to the buyer after payment")
     is_virtual = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -387,18 +909,11 @@ class Product(models.Model):
     # Custom manager
     objects = ProductManager()
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._stock_count = None
-
     @property
     def stock_count(self):
-        if self._stock_count is None:
-            if self.automatic_delivery:
-                self._stock_count = len([line for line in self.stock_details.splitlines() if line.strip()])
-            else:
-                self._stock_count = self.stock
-        return self._stock_count
+        if self.automatic_delivery:
+            return self.available_stock_items
+        return self.stock
 
     def clean(self):
         """
@@ -425,7 +940,7 @@ class Product(models.Model):
                 non_field_errors.append(
                     "For automatic delivery, 'In Stock' must be empty. Use 'Products for Automatic Delivery' instead."
                 )
-            if not (self.stock_details or '').strip():
+            if not (self.stock_details or '').strip() and not (self.pk and self.available_stock_items):
                 non_field_errors.append(
                     "For automatic delivery, 'Products for Automatic Delivery' cannot be empty."
                 )
@@ -447,13 +962,32 @@ class Product(models.Model):
             raise ValidationError(errors)
 
     def save(self, *args, **kwargs):
-        # Clear stock_count cache when saving
-        self._stock_count = None
-        super().save(*args, **kwargs)
+        # Codes typed into stock_details become StockItem rows; the blob is never kept
+        pending_codes = ''
+        update_fields = kwargs.get('update_fields')
+        if self.automatic_delivery and (update_fields is None or 'stock_details' in update_fields):
+            pending_codes, self.stock_details = self.stock_details or '', ''
+
+        # available_stock_items only moves through StockItem's F() updates;
+        # a full save from a stale instance must not overwrite it.
+        if update_fields is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'available_stock_items'
+            ]
+
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
+            if pending_codes.strip():
+                StockItem.objects.import_codes(self, pending_codes.splitlines())
 
     def __str__(self): return f'{self.game.title} - {self.listing_title}'
 
     def get_commission_rate(self):
+        # Rows loaded through with_buyer_price() already resolved the rate in SQL
+        annotated_rate = getattr(self, 'effective_commission_rate', None)
+        if annotated_rate is not None:
+            return Decimal(annotated_rate)
         return get_effective_commission_rate_for_listing(self.seller, self.category)
 
     def get_net_total(self, quantity=1):
@@ -498,17 +1032,56 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"Image for {self.product.listing_title}"
 
+class StockItem(models.Model):
+    """One automatic-delivery code. Unsold rows are claimed oldest first."""
+    product = models.ForeignKey(Product, related_name='stock_items', on_delete=models.CASCADE)
+    content = models.TextField()
+    is_claimed = models.BooleanField(default=False)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    order = models.ForeignKey(
+        'Order', related_name='delivered_stock_items', on_delete=models.SET_NULL, null=True, blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockItemManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'is_claimed', 'id'], name='stockitem_claim_idx'),
+        ]
+
+    def __str__(self):
+        state = 'claimed' if self.is_claimed else 'available'
+        return f"Stock item #{self.pk} for product {self.product_id} ({state})"
+
+# Crockford base32: uppercase, no I/L/O/U, and in ASCII order so IDs sort by time
+ORDER_ID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ORDER_ID_EPOCH_MS = 1704067200000  # 2024-01-01 UTC, 40 bits of ms last until 2058
+ORDER_ID_ATTEMPTS = 5
+
+
 def generate_unique_order_id():
-    """Generate a unique order ID using UUID for enhanced security against enumeration attacks"""
-    import uuid
-    while True:
-        # Generate a UUID and use first 12 characters (much more secure than sequential/predictable IDs)
-        unique_part = str(uuid.uuid4()).replace('-', '').upper()[:12]
-        order_id = f"#{unique_part[:4]}-{unique_part[4:8]}-{unique_part[8:12]}"
-        
-        # Check if this ID already exists (extremely unlikely with UUID)
-        if not Order.objects.filter(order_id=order_id).exists():
-            return order_id
+    """
+    Time-ordered order ID in the '#XXXX-XXXX-XXXX' display format.
+
+    The first 8 characters are milliseconds since ORDER_ID_EPOCH_MS and the
+    last 4 are 20 random bits, so IDs sort by creation time but cannot be
+    guessed from a neighbouring order. No existence query is needed: the
+    unique index on order_id catches the rare clash within one millisecond
+    and Order.save() retries with a new ID. New rows also land at the right
+    edge of the order_id index.
+    """
+    import secrets
+    import time
+
+    value = ((int(time.time() * 1000) - ORDER_ID_EPOCH_MS) << 20) | secrets.randbits(20)
+
+    chars = []
+    for _ in range(12):
+        value, index = divmod(value, 32)
+        chars.append(ORDER_ID_ALPHABET[index])
+    unique_part = ''.join(reversed(chars))
+    return f"#{unique_part[:4]}-{unique_part[4:8]}-{unique_part[8:12]}"
 
 class Order(models.Model):
     STATUS_CHOICES = [('PENDING_PAYMENT', 'Pending Payment'), ('PROCESSING', 'Processing'), ('DELIVERED', 'Delivered'), ('COMPLETED', 'Completed'), ('DISPUTED', 'Disputed'), ('REFUNDED', 'Refunded'), ('CANCELLED', 'Cancelled')]
@@ -539,10 +1112,38 @@ class Order(models.Model):
     # Custom manager
     objects = OrderManager()
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's purchases and sales
+            models.Index(fields=['buyer', '-created_at', '-id'], name='order_buyer_recent_idx'),
+            models.Index(fields=['seller', '-created_at', '-id'], name='order_seller_recent_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        if not self.order_id:
+        if self.order_id:
+            return super().save(*args, **kwargs)
+
+        using = kwargs.get('using') or router.db_for_write(Order, instance=self)
+        for attempt in range(ORDER_ID_ATTEMPTS):
             self.order_id = generate_unique_order_id()
-        super().save(*args, **kwargs)
+            try:
+                if db_transaction.get_connection(using).in_atomic_block:
+                    # A failed INSERT would break the caller's transaction without a savepoint
+                    with db_transaction.atomic(using=using):
+                        return super().save(*args, **kwargs)
+                return super().save(*args, **kwargs)
+            except IntegrityError:
+                # Only a clash on the INSERT itself is worth another ID; errors
+                # raised after the row was written (signals) propagate as-is.
+                clashed = (
+                    self._state.adding
+                    and attempt < ORDER_ID_ATTEMPTS - 1
+                    and Order.objects.using(using).filter(order_id=self.order_id).exists()
+                )
+                if not clashed:
+                    if self._state.adding:
+                        self.order_id = ''
+                    raise
 
     def __str__(self):
         title = self.listing_title_snapshot or (self.product.listing_title if self.product else 'a deleted product')
@@ -564,6 +1165,37 @@ class Order(models.Model):
         )
         return quantize_money((Decimal(self.total_price) * Decimal(rate)) / Decimal('100'))
 
+class OrderEvent(models.Model):
+    """
+    Outbox row for an order's side effects (chat messages, system notices,
+    notifications). Written in the order's transaction and processed after
+    commit by marketplace.order_events.
+    """
+    EVENT_CREATED = 'created'
+    EVENT_STATUS_CHANGED = 'status_changed'
+    EVENT_TYPES = [
+        (EVENT_CREATED, 'Order created'),
+        (EVENT_STATUS_CHANGED, 'Status changed'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='events', on_delete=models.CASCADE)
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    previous_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'created_at'], name='orderevent_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} ({self.status}) for order {self.order_id}"
+
 class Review(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE)
     buyer = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -575,19 +1207,6 @@ class Review(models.Model):
     # Custom manager
     objects = ReviewManager()
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Invalidate review stats cache when new review is created/updated
-        from django.core.cache import cache
-        cache.delete(f'review_stats_{self.seller.id}')
-
-    def delete(self, *args, **kwargs):
-        seller_id = self.seller.id
-        super().delete(*args, **kwargs)
-        # Invalidate review stats cache when review is deleted
-        from django.core.cache import cache
-        cache.delete(f'review_stats_{seller_id}')
-
     def __str__(self): return f"Review by {self.buyer.username} for Order {self.order.order_id}"
 
 class ReviewReply(models.Model):
@@ -639,16 +1258,12 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False, db_index=True)
     is_system_message = models.BooleanField(default=False)
     is_auto_reply = models.BooleanField(default=False)
+    # Set on order system notices and automatic-delivery messages
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='chat_messages')
 
     # Custom manager
     objects = MessageManager()
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Invalidate message count cache when new message is created
-        from django.core.cache import cache
-        cache.delete(f'conversation_message_count_{self.conversation.id}')
-
     def __str__(self): return f"Message from {self.sender.username} at {self.timestamp}"
 
 class WithdrawalRequest(models.Model):
@@ -812,15 +1427,43 @@ class Transaction(models.Model):
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
     withdrawal = models.ForeignKey(WithdrawalRequest, on_delete=models.SET_NULL, null=True, blank=True)
     deposit = models.OneToOneField('DepositRequest', on_delete=models.SET_NULL, null=True, blank=True, related_name='transaction')
+
+    objects = TransactionManager()
     
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        # The ledger row and the owner's running balance commit together
+        with db_transaction.atomic():
+            previous_user, previous_total = self._stored_balance_contribution()
+            super().save(*args, **kwargs)
+            new_total = Decimal(self.amount) if self.status == 'COMPLETED' else Decimal('0.00')
+            if previous_user is None or previous_user == self.user_id:
+                UserBalance.objects.adjust(self.user_id, balance=new_total - previous_total)
+            else:
+                UserBalance.objects.adjust(previous_user, balance=-previous_total)
+                UserBalance.objects.adjust(self.user_id, balance=new_total)
         # Invalidate balance cache when transaction changes
-        from django.core.cache import cache
-        cache.delete(f'user_balance_{self.user.id}')
+        invalidate_user_balance_cache(self.user_id, previous_user)
+
+    def _stored_balance_contribution(self):
+        """
+        (user_id, amount) the stored row currently contributes to a running
+        balance. Read under a row lock rather than from the instance, which
+        may be stale after a queryset update.
+        """
+        if self._state.adding or self.pk is None:
+            return None, Decimal('0.00')
+        stored = Transaction.objects.select_for_update().filter(pk=self.pk).values_list('user_id', 'amount', 'status').first()
+        if stored is None:
+            return None, Decimal('0.00')
+        user_id, amount, status = stored
+        return user_id, amount if status == 'COMPLETED' else Decimal('0.00')
     
     def __str__(self): return f"{self.get_transaction_type_display()} of {self.amount} for {self.user.username}"
-    class Meta: ordering = ['-created_at']
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='transaction_user_recent_idx'),
+        ]
 
 class Filter(models.Model):
     FILTER_TYPE_CHOICES = [
@@ -881,7 +1524,9 @@ class HeldFund(models.Model):
     release_at = models.DateTimeField()
     is_released = models.BooleanField(default=False)
     released_at = models.DateTimeField(null=True, blank=True)
-    
+
+    objects = HeldFundManager()
+
     class Meta:
         ordering = ['-held_at']
     
@@ -889,10 +1534,27 @@ class HeldFund(models.Model):
         if not self.release_at:
             # Set release time to 72 hours from now
             self.release_at = timezone.now() + datetime.timedelta(hours=72)
-        super().save(*args, **kwargs)
+        with db_transaction.atomic():
+            previous_user, previous_held = self._stored_held_contribution()
+            super().save(*args, **kwargs)
+            new_held = Decimal('0.00') if self.is_released else Decimal(self.amount)
+            if previous_user is None or previous_user == self.user_id:
+                UserBalance.objects.adjust(self.user_id, held=new_held - previous_held)
+            else:
+                UserBalance.objects.adjust(previous_user, held=-previous_held)
+                UserBalance.objects.adjust(self.user_id, held=new_held)
         # Invalidate held balance cache when new held fund is created or updated
-        from django.core.cache import cache
-        cache.delete(f'user_held_balance_{self.user.id}')
+        caching.bump('held_balance', self.user_id, previous_user)
+
+    def _stored_held_contribution(self):
+        """(user_id, amount) the stored row currently contributes to a held total."""
+        if self._state.adding or self.pk is None:
+            return None, Decimal('0.00')
+        stored = HeldFund.objects.select_for_update().filter(pk=self.pk).values_list('user_id', 'amount', 'is_released').first()
+        if stored is None:
+            return None, Decimal('0.00')
+        user_id, amount, is_released = stored
+        return user_id, Decimal('0.00') if is_released else amount
     
     def can_be_released(self):
         """Check if the 72-hour hold period has passed"""
@@ -904,9 +1566,6 @@ class HeldFund(models.Model):
             self.is_released = True
             self.released_at = timezone.now()
             self.save()
-            # Invalidate held balance cache when fund is released
-            from django.core.cache import cache
-            cache.delete(f'user_held_balance_{self.user.id}')
             return True
         return False
     
@@ -914,6 +1573,105 @@ class HeldFund(models.Model):
         status = "Released" if self.is_released else f"Held until {self.release_at}"
         return f"HeldFund: {self.user.username} - Rs{self.amount} ({status})"
 
+class UserBalance(models.Model):
+    """
+    Running ledger totals per user. `balance` mirrors the sum of COMPLETED
+    transactions and `held` the sum of unreleased held funds; both are moved
+    by F() updates in the same DB transaction as the ledger write, so reads
+    never have to aggregate the ledger. `verify_balances` reports drift.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='ledger_balance')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    held = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserBalanceManager()
+
+    @property
+    def available(self):
+        return self.balance - self.held
+
+    def __str__(self):
+        return f"Balance for {self.user_id}: Rs{self.balance} (held Rs{self.held})"
+
+
+class UserOrderCount(models.Model):
+    """
+    Per-user order counts by role and status, moved in the same DB
+    transaction as the order write. Navbar counters and the purchases/sales
+    pages read these instead of running COUNT(*) over the orders table.
+    """
+    ROLE_BUYER = 'buyer'
+    ROLE_SELLER = 'seller'
+    ROLE_CHOICES = [(ROLE_BUYER, 'Buyer'), (ROLE_SELLER, 'Seller')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_counts')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    objects = UserOrderCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'role', 'status'], name='unique_user_order_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.count} {self.status} orders as {self.role} for {self.user_id}"
+
+
+class DailyMarketplaceStats(models.Model):
+    """
+    One row per local day and (game, category): orders placed, completed
+    GMV and commission, refunds and new listings. Sign-ups go on the
+    site-wide row where game and category are both empty. Kept up to date
+    by `build_daily_rollups`, so the admin dashboard sums a few hundred
+    rows instead of scanning orders.
+    """
+    SUM_FIELDS = (
+        'orders', 'completed_orders', 'gmv', 'commission',
+        'refunded_orders', 'refunds', 'new_listings', 'new_users',
+    )
+
+    day = models.DateField()
+    game = models.ForeignKey(Game, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    completed_orders = models.PositiveIntegerField(default=0)
+    gmv = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    commission = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    refunded_orders = models.PositiveIntegerField(default=0)
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    new_listings = models.PositiveIntegerField(default=0)
+    new_users = models.PositiveIntegerField(default=0)
+
+    objects = DailyMarketplaceStatsManager()
+
+    class Meta:
+        verbose_name_plural = 'Daily marketplace stats'
+        indexes = [
+            models.Index(fields=['day', 'game', 'category'], name='dailystats_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stats for {self.day} (game {self.game_id}, category {self.category_id})"
+
+
+class RollupWatermark(models.Model):
+    """How far a periodic rollup job has read; the next run starts from here."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+def invalidate_user_balance_cache(*user_ids, held=False):
+    """Drops cached balances now and again once the surrounding transaction commits."""
+    caching.bump('held_balance' if held else 'balance', *user_ids)
+
+
 class ProcessedPaymentCallback(models.Model):
     """Model to track processed payment callbacks to prevent replay attacks"""
     transaction_ref = models.CharField(max_length=255, unique=True, db_index=True)
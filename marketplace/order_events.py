@@ -0,0 +1,223 @@
+# marketplace/order_events.py
+"""
+Post-commit pipeline for order side effects.
+
+Checkout and status changes only commit the order row, its ledger entries and
+an OrderEvent outbox row. Everything a user sees afterwards (the delivered
+codes and post-purchase message in chat, the system notice, navbar
+notifications) is produced here once the transaction has committed, so none
+of it runs while the purchase transaction holds its locks. Nothing the
+buyer needs straight away may depend on it: the order page shows delivered
+codes from the StockItem rows, which commit with the order.
+
+After commit each event is handed to a small in-process thread pool. Events
+that never finish (worker crash, deploy mid-flight) are picked up by the
+`process_order_events --loop` sweeper. ORDER_EVENT_WORKERS sizes the pool;
+ORDER_EVENTS_ASYNC = False runs events inline in the on_commit callback
+instead, which tests use.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# A claimed event whose worker has not finished within this window is retried
+CLAIM_LEASE = timedelta(minutes=2)
+MAX_ATTEMPTS = 5
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def record_order_event(order, event_type, previous_status=''):
+    """Writes the outbox row in the caller's transaction and dispatches it after commit."""
+    from .models import OrderEvent
+
+    event = OrderEvent.objects.create(
+        order=order,
+        event_type=event_type,
+        status=order.status,
+        previous_status=previous_status or '',
+    )
+    transaction.on_commit(lambda: dispatch(event.pk))
+    return event
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ORDER_EVENT_WORKERS,
+                    thread_name_prefix='order-events',
+                )
+    return _executor
+
+
+def dispatch(event_id):
+    if settings.ORDER_EVENTS_ASYNC:
+        _get_executor().submit(_run_in_worker, event_id)
+    else:
+        process_event(event_id)
+
+
+def _run_in_worker(event_id):
+    close_old_connections()
+    try:
+        process_event(event_id)
+    finally:
+        close_old_connections()
+
+
+def claim_event(event_id):
+    """Atomically claims an unprocessed event. Returns False if someone else holds it."""
+    from .models import OrderEvent
+
+    now = timezone.now()
+    return bool(
+        OrderEvent.objects.filter(pk=event_id, processed_at__isnull=True, attempts__lt=MAX_ATTEMPTS)
+        .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_LEASE))
+        .update(claimed_at=now)
+    )
+
+
+def process_event(event_id):
+    """Runs one event's side effects. Returns True when it was processed here."""
+    from django.db.models import F
+    from .models import OrderEvent
+
+    if not claim_event(event_id):
+        return False
+
+    event = OrderEvent.objects.select_related('order__buyer', 'order__seller', 'order__product').get(pk=event_id)
+    try:
+        with transaction.atomic():
+            HANDLERS[event.event_type](event)
+    except Exception as e:
+        logger.exception("Order event %s failed", event_id)
+        OrderEvent.objects.filter(pk=event_id).update(
+            claimed_at=None, attempts=F('attempts') + 1, last_error=str(e)[:1000]
+        )
+        return False
+
+    OrderEvent.objects.filter(pk=event_id).update(processed_at=timezone.now(), attempts=F('attempts') + 1)
+    return True
+
+
+def pending_events(stale_after=timedelta(seconds=30)):
+    """Events the post-commit dispatch should have finished by now."""
+    from .models import OrderEvent
+
+    now = timezone.now()
+    return OrderEvent.objects.filter(
+        processed_at__isnull=True,
+        attempts__lt=MAX_ATTEMPTS,
+        created_at__lte=now - stale_after,
+    ).filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_LEASE)).order_by('created_at')
+
+
+# --- Handlers ---
+
+def _conversation_for(order):
+    from .models import Conversation
+
+    p1, p2 = sorted((order.buyer_id, order.seller_id))
+    conversation, _ = Conversation.objects.get_or_create(participant1_id=p1, participant2_id=p2)
+    return conversation
+
+
+def handle_order_created(event):
+    from .models import Message
+    from .signals import send_system_message
+
+    order = event.order
+    conversation = _conversation_for(order)
+
+    if event.status in ['PROCESSING', 'DELIVERED']:
+        send_system_message(conversation, 'order_paid', order, order.buyer)
+
+    codes = list(order.delivered_stock_items.order_by('id').values_list('content', flat=True))
+    if codes:
+        Message.objects.create(
+            conversation=conversation,
+            sender=order.seller,
+            content="\n".join(codes),
+            is_system_message=False,
+            is_auto_reply=True,
+            order=order
+        )
+
+    if order.product and order.product.post_purchase_message:
+        Message.objects.create(
+            conversation=conversation,
+            sender=order.seller,
+            content=order.product.post_purchase_message,
+            is_system_message=False,
+            is_auto_reply=True
+        )
+
+    transaction.on_commit(lambda: notify_order_participants(order, created=True))
+
+
+def handle_status_changed(event):
+    from .signals import send_system_message
+
+    order = event.order
+    notices = {
+        'COMPLETED': ('order_confirmed', order.buyer),
+        'REFUNDED': ('order_refunded', order.seller),
+    }
+    if event.status in notices:
+        message_type, actor = notices[event.status]
+        send_system_message(_conversation_for(order), message_type, order, actor)
+
+    transaction.on_commit(lambda: notify_order_participants(order, created=False, status=event.status))
+
+
+def notify_order_participants(order, created, status=None):
+    """
+    Pushes an order_update notification to buyer and seller. Handlers run it
+    after their messages commit, so a channel layer outage cannot roll back
+    the chat messages or make a retry send them twice.
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from . import caching
+    from .signals import get_user_context
+
+    channel_layer = get_channel_layer()
+    buyer, seller = order.buyer, order.seller
+    status_display = dict(order.STATUS_CHOICES).get(status or order.status, status or order.status)
+    seller_message = (
+        f"New order {order.order_id} from {buyer.username}." if created
+        else f"Order {order.order_id} status updated to {status_display}."
+    )
+
+    for user, message in [(buyer, f"Your order {order.order_id} status: {status_display}"), (seller, seller_message)]:
+        # Invalidate cached navbar counters for these users
+        caching.bump('notifications', user.id)
+        try:
+            async_to_sync(channel_layer.group_send)(
+                f'notifications_{user.username}',
+                {
+                    "type": "send_notification",
+                    "notification_type": "order_update",
+                    "data": {"message": message, **get_user_context(user)}
+                }
+            )
+        except Exception:
+            logger.exception("Could not notify user %s of order %s", user.id, order.order_id)
+
+
+HANDLERS = {
+    'created': handle_order_created,
+    'status_changed': handle_status_changed,
+}
@@ -0,0 +1,194 @@
+# marketplace/profiling.py
+"""
+Opt-in per-request profiling: query count, repeated queries, and time spent
+in the database, the cache and templates.
+
+QueryProfilerMiddleware is listed in MIDDLEWARE but removes itself unless
+QUERY_PROFILER_ENABLED is set. When enabled it:
+
+- adds a Server-Timing header (db, cache, tpl, total) to responses for
+  staff, which browser dev tools show under the request's Timing tab;
+- logs requests slower than QUERY_PROFILER_SLOW_MS, over
+  QUERY_PROFILER_MAX_QUERIES, or running one query shape at least
+  QUERY_PROFILER_REPEAT_THRESHOLD times (the N+1 signature), with the
+  offending fingerprints.
+
+Cache time comes from the instrumented backends in cache_metrics.
+A fingerprint is the SQL with literals and parameter lists collapsed, so
+`WHERE id = 5` and `WHERE id = 6` count as the same query.
+
+QueryBudgetMixin gives TestCases assertQueryBudget(), which fails with the
+repeated fingerprints when a block runs more queries than its budget.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_active = ContextVar('request_profile', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """The query's shape: literals become ?, IN lists (...), whitespace collapsed."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _PARAM_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def repeated(fingerprints, threshold):
+    """[(fingerprint, count)] for shapes run at least `threshold` times, most repeated first."""
+    return [(sql, count) for sql, count in fingerprints.most_common() if count >= threshold]
+
+
+class RequestProfile:
+    __slots__ = ('started', 'queries', 'db_time', 'cache_time', 'template_time', 'rendering')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.cache_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries[fingerprint(sql)] += 1
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.query_count} queries"',
+            f'cache;dur={self.cache_time * 1000:.1f}',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def record_cache_time(seconds):
+    """Called by the instrumented cache backends for every outermost call."""
+    profile = _active.get()
+    if profile is not None:
+        profile.cache_time += seconds
+
+
+_template_render = None
+
+
+def _install_template_timer():
+    """Times Template.render for the active profile; {% include %}s count within their parent."""
+    global _template_render
+    from django.template.base import Template
+
+    if _template_render is not None:
+        return
+    _template_render = Template.render
+
+    def render(self, context):
+        profile = _active.get()
+        if profile is None or profile.rendering:
+            return _template_render(self, context)
+        profile.rendering = True
+        started = time.perf_counter()
+        try:
+            return _template_render(self, context)
+        finally:
+            profile.template_time += time.perf_counter() - started
+            profile.rendering = False
+
+    Template.render = render
+
+
+@contextmanager
+def profile():
+    """Collects a RequestProfile for the enclosed block, on every database connection."""
+    current = RequestProfile()
+    token = _active.set(current)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(current))
+            yield current
+    finally:
+        _active.reset(token)
+
+
+class QueryProfilerMiddleware:
+    """See the module docstring; removed from the stack unless QUERY_PROFILER_ENABLED."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        _install_template_timer()
+
+    def __call__(self, request):
+        with profile() as current:
+            response = self.get_response(request)
+        total = time.perf_counter() - current.started
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = current.server_timing(total)
+
+        repeats = repeated(current.queries, getattr(settings, 'QUERY_PROFILER_REPEAT_THRESHOLD', 5))
+        slow = total * 1000 >= getattr(settings, 'QUERY_PROFILER_SLOW_MS', 500)
+        chatty = current.query_count > getattr(settings, 'QUERY_PROFILER_MAX_QUERIES', 30)
+        if slow or chatty or repeats:
+            logger.warning(json.dumps({
+                'event_type': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 1),
+                'db_ms': round(current.db_time * 1000, 1),
+                'cache_ms': round(current.cache_time * 1000, 1),
+                'template_ms': round(current.template_time * 1000, 1),
+                'queries': current.query_count,
+                'repeated': [{'sql': sql[:300], 'count': count} for sql, count in repeats[:5]],
+            }))
+        return response
+
+
+class QueryBudgetMixin:
+    """TestCase mixin: `with self.assertQueryBudget(8): self.client.get(url)`."""
+
+    @contextmanager
+    def assertQueryBudget(self, budget, using='default'):
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connections[using]) as captured:
+            yield captured
+        if len(captured) <= budget:
+            return
+        shapes = Counter(fingerprint(query['sql']) for query in captured.captured_queries)
+        lines = [f'{count}x {sql}' for sql, count in shapes.most_common(10)]
+        self.fail(
+            f'{len(captured)} queries run, budget is {budget}. Most repeated:\n' + '\n'.join(lines)
+        )
@@ -0,0 +1,221 @@
+# marketplace/rate_limit.py
+"""
+Sliding-window rate limits.
+
+Each hit() is one atomic check-and-record: with the Redis cache backends a
+Lua script trims the key's sorted set of hit times to the window, counts it
+and records the hit only if it fits, in a single round trip. The window
+slides with the clock, so `limit` hits are allowed in any `period` seconds,
+and a rejected hit does not extend it.
+
+incr_counters() serves fixed-window counters (the per-IP request budgets in
+SecurityMiddleware): every counter a request touches is incremented, and
+given its TTL when new, by one script call.
+
+Other backends (tests, development) keep the same state under a process
+lock in the default cache, which is exact within one process. If a Redis
+call fails, the default cache is that same Redis, so both fall back to a
+per-process in-memory store instead: limits are then counted per worker
+rather than failing the request.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'rate_limit'
+
+# KEYS[1]: the window; ARGV: limit, period in ms, unique member for this hit.
+# Returns {allowed, hits in window, ms until the oldest hit leaves it}.
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - period)
+local count = redis.call('ZCARD', key)
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', key, now, ARGV[3])
+    redis.call('PEXPIRE', key, period)
+    count = count + 1
+    allowed = 1
+end
+
+local reset = 0
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + period - now
+end
+return {allowed, count, reset}
+"""
+
+# KEYS: counters; ARGV: window in seconds, then one amount per key.
+# Returns the counters' new values.
+COUNTERS_LUA = """
+local window = tonumber(ARGV[1])
+local values = {}
+for i, key in ipairs(KEYS) do
+    values[i] = redis.call('INCRBY', key, tonumber(ARGV[i + 1]))
+    if redis.call('TTL', key) == -1 then
+        redis.call('EXPIRE', key, window)
+    end
+end
+return values
+"""
+
+_scripts = {}
+_local_lock = threading.Lock()
+# Used only while Redis is failing; bounded and private to this process
+_fallback_cache = LocMemCache('rate-limit-fallback', {'OPTIONS': {'MAX_ENTRIES': 10000}})
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Outcome of one hit. Truthy when the action is allowed."""
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the oldest counted hit leaves the window and frees a slot
+    reset_after: float
+
+    def __bool__(self):
+        return self.allowed
+
+    @property
+    def retry_after(self):
+        """Whole seconds to wait before retrying; 0 when allowed."""
+        return 0 if self.allowed else max(1, math.ceil(self.reset_after))
+
+    def add_headers(self, response):
+        response['X-RateLimit-Limit'] = str(self.limit)
+        response['X-RateLimit-Remaining'] = str(self.remaining)
+        response['X-RateLimit-Reset'] = str(int(time.time() + math.ceil(self.reset_after)))
+        if not self.allowed:
+            response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+def _key(scope, identifier):
+    return f'{KEY_PREFIX}:{scope}:{identifier}'
+
+
+def _redis_connection(raw_key):
+    """The Redis connection holding `raw_key`, or None when the cache is not django_redis."""
+    client = getattr(cache, 'client', None)
+    if client is None:
+        return None
+    if hasattr(client, 'get_server'):
+        # ShardClient: the window lives on the shard its key maps to
+        return client.get_server(raw_key)
+    if hasattr(client, 'get_client'):
+        return client.get_client(write=True)
+    return None
+
+
+def _run_script(connection, source, keys, args):
+    """EVALSHA, loading the script on first use per connection."""
+    script = _scripts.get((id(connection), source))
+    if script is None:
+        script = _scripts[(id(connection), source)] = connection.register_script(source)
+    return script(keys=keys, args=args)
+
+
+def _hit_redis(connection, raw_key, limit, period):
+    allowed, count, reset_ms = _run_script(
+        connection, SLIDING_WINDOW_LUA, [raw_key], [limit, int(period * 1000), uuid.uuid4().hex]
+    )
+    return RateLimit(bool(allowed), limit, max(0, limit - int(count)), int(reset_ms) / 1000)
+
+
+def _hit_local(store, key, limit, period):
+    with _local_lock:
+        now = time.time()
+        hits = [stamp for stamp in store.get(key, ()) if stamp > now - period]
+        allowed = len(hits) < limit
+        if allowed:
+            hits.append(now)
+            store.set(key, hits, math.ceil(period))
+        reset_after = hits[0] + period - now if hits else 0
+        return RateLimit(allowed, limit, limit - len(hits), reset_after)
+
+
+def hit(scope, identifier, limit, period):
+    """Records one `scope` action by `identifier` unless `limit` were already made in the last `period` seconds."""
+    key = _key(scope, identifier)
+    raw_key = cache.make_key(key)
+    connection = _redis_connection(raw_key)
+    if connection is None:
+        return _hit_local(cache, key, limit, period)
+    try:
+        return _hit_redis(connection, raw_key, limit, period)
+    except Exception:
+        logger.exception("Rate limit check for %s failed in Redis, using this process's window", key)
+        return _hit_local(_fallback_cache, key, limit, period)
+
+
+def _incr_local(store, amounts, window):
+    values = {}
+    with _local_lock:
+        for key, amount in amounts.items():
+            try:
+                values[key] = store.incr(key, amount)
+            except ValueError:
+                # New, or expired since: start a fresh window
+                store.set(key, amount, window)
+                values[key] = amount
+    return values
+
+
+def incr_counters(amounts, window):
+    """
+    Adds {key: amount} to fixed-window counters that expire `window` seconds
+    after their first increment, and returns {key: new value}. On a sharded
+    cache the keys must share a {hash tag} so they live on one shard.
+    """
+    keys = list(amounts)
+    raw_keys = [cache.make_key(key) for key in keys]
+    connection = _redis_connection(raw_keys[0])
+    if connection is None:
+        return _incr_local(cache, amounts, window)
+    try:
+        values = _run_script(connection, COUNTERS_LUA, raw_keys, [window, *amounts.values()])
+        return dict(zip(keys, (int(value) for value in values)))
+    except Exception:
+        logger.exception("Counter update for %s failed in Redis, using this process's counters", keys[0])
+        return _incr_local(_fallback_cache, amounts, window)
+
+
+def reset(scope, identifier):
+    """Forgets every recorded hit, e.g. after a successful login."""
+    key = _key(scope, identifier)
+    _fallback_cache.delete(key)
+    try:
+        cache.delete(key)
+    except Exception:
+        logger.exception("Could not reset rate limit %s", key)
+
+
+def client_ip(request):
+    """The originating address: first X-Forwarded-For hop, else REMOTE_ADDR."""
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip()
+    return forwarded or request.META.get('REMOTE_ADDR', '')
+
+
+def check(request, action, limit=10, period=300):
+    """
+    Rate limits `action` per client: per user and address when logged in,
+    per address otherwise.
+    """
+    ip = client_ip(request)
+    identifier = f'{request.user.id}:{ip}' if request.user.is_authenticated else ip
+    return hit(action, identifier, limit, period)
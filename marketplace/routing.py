@@ -7,4 +7,6 @@ websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<username>[\w.@+-]+)/$', consumers.ChatConsumer.as_asgi()),
     # This is the new route for our notification consumer
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
+    # Single socket per tab that multiplexes chat rooms and notifications
+    re_path(r'ws/multiplex/$', consumers.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 import logging
 import json
+import re
 from datetime import datetime
 from django.http import HttpResponseBadRequest, HttpResponse, JsonResponse
 from django.shortcuts import render
@@ -9,7 +10,6 @@ from django.template import TemplateDoesNotExist
 from django.urls import NoReverseMatch, reverse
 from django.utils.deprecation import MiddlewareMixin
 from django.conf import settings
-from django.core.cache import cache
 from django.contrib.auth.models import AnonymousUser
 from marketplace.login_security import (
     LOCK_MESSAGE,
@@ -18,10 +18,23 @@ from marketplace.login_security import (
     is_user_locked,
     normalize_identifier,
 )
+from marketplace.rate_limit import incr_counters
 
 logger = logging.getLogger('marketplace.security')
 access_logger = logging.getLogger('marketplace.access')
 
+# Matched against the lowercased path and query string, one pass for all patterns
+SUSPICIOUS_PATTERN = re.compile('|'.join(re.escape(pattern) for pattern in (
+    '../', '..\\', 'etc/passwd', 'cmd.exe', '<script',
+    'javascript:', 'vbscript:', 'onload=', 'onerror=',
+    'eval(', 'document.cookie', 'window.location', 'union select',
+    'drop table', 'insert into', 'delete from', 'update set',
+)))
+# Matched against the lowercased user agent
+SCANNER_PATTERN = re.compile('|'.join(re.escape(agent) for agent in (
+    'sqlmap', 'nikto', 'nmap', 'masscan', 'nuclei', 'gobuster', 'dirb', 'wpscan', 'burp',
+)))
+
 class SecurityMiddleware(MiddlewareMixin):
     """Enhanced security middleware for production"""
     RATE_LIMIT_WINDOW = 3600  # seconds
@@ -100,18 +113,6 @@ class SecurityMiddleware(MiddlewareMixin):
         response['Retry-After'] = str(LOCKOUT_SECONDS)
         return response
 
-    def _increment_counter(self, key, amount=1, timeout=None):
-        """Increment a cache counter without overwriting existing TTL."""
-        timeout = timeout or self.RATE_LIMIT_WINDOW
-        try:
-            return cache.incr(key, amount)
-        except ValueError:
-            # Key does not exist yet; create it with the requested amount.
-            if cache.add(key, amount, timeout=timeout):
-                return amount
-            # If another process created it concurrently, increment again.
-            return cache.incr(key, amount)
-    
     def process_request(self, request):
         """Process incoming requests for security checks with enhanced logging"""
         
@@ -145,20 +146,30 @@ class SecurityMiddleware(MiddlewareMixin):
                 'event_type': 'sensitive_access'
             }))
         
-        # Enhanced rate limiting with multiple tiers
-        cache_key = f'requests_{client_ip}'
-        admin_cache_key = f'admin_requests_{client_ip}'
-        api_cache_key = f'api_requests_{client_ip}'
+        # Enhanced rate limiting with multiple tiers. Every counter this
+        # request touches is read and incremented in one round trip; the
+        # {ip} hash tag keeps them on one shard.
+        is_admin = request.path.startswith(admin_root) and not admin_whitelisted
+        is_api = '/api/' in request.path
+        full_path = request.get_full_path()
+        suspicious = SUSPICIOUS_PATTERN.search(full_path.lower())
+        scanner = SCANNER_PATTERN.search(user_agent.lower())
+        # Penalty for suspicious requests, heavier for security scanners
+        cost = 20 if scanner else 10 if suspicious else 1
 
-        counters = cache.get_many([cache_key, admin_cache_key, api_cache_key])
-        request_count = counters.get(cache_key, 0)
-        admin_count = counters.get(admin_cache_key, 0)
-        api_count = counters.get(api_cache_key, 0)
+        cache_key = f'requests:{{{client_ip}}}'
+        admin_cache_key = f'admin_requests:{{{client_ip}}}'
+        api_cache_key = f'api_requests:{{{client_ip}}}'
+        amounts = {cache_key: cost}
+        if is_admin:
+            amounts[admin_cache_key] = 1
+        if is_api:
+            amounts[api_cache_key] = 1
+        counters = incr_counters(amounts, self.RATE_LIMIT_WINDOW)
 
-        now_ts = int(datetime.now().timestamp())
-        
         # Stricter rate limiting for admin endpoints
-        if request.path.startswith(admin_root) and not admin_whitelisted:
+        if is_admin:
+            admin_count = counters[admin_cache_key] - 1
             if admin_count >= 200:  # 200 admin requests per hour (3+ per minute)
                 logger.critical(json.dumps({
                     'timestamp': datetime.now().isoformat(),
@@ -168,16 +179,11 @@ class SecurityMiddleware(MiddlewareMixin):
                     'event_type': 'admin_rate_limit_exceeded',
                     'request_count': admin_count
                 }))
-                response = HttpResponse("Admin rate limit exceeded", status=429)
-                response['Retry-After'] = str(self.RATE_LIMIT_WINDOW)
-                response['X-RateLimit-Limit'] = '200'
-                response['X-RateLimit-Remaining'] = '0'
-                response['X-RateLimit-Reset'] = str(now_ts + self.RATE_LIMIT_WINDOW)
-                return response
-            self._increment_counter(admin_cache_key, timeout=self.RATE_LIMIT_WINDOW)
+                return self.rate_limited_response("Admin rate limit exceeded", 200)
         
         # API rate limiting
-        if '/api/' in request.path:
+        if is_api:
+            api_count = counters[api_cache_key] - 1
             if api_count >= 1000:  # 1000 API requests per hour
                 logger.critical(json.dumps({
                     'timestamp': datetime.now().isoformat(),
@@ -187,15 +193,10 @@ class SecurityMiddleware(MiddlewareMixin):
                     'event_type': 'api_rate_limit_exceeded',
                     'request_count': api_count
                 }))
-                response = HttpResponse("API rate limit exceeded", status=429)
-                response['Retry-After'] = str(self.RATE_LIMIT_WINDOW)
-                response['X-RateLimit-Limit'] = '1000'
-                response['X-RateLimit-Remaining'] = '0'
-                response['X-RateLimit-Reset'] = str(now_ts + self.RATE_LIMIT_WINDOW)
-                return response
-            self._increment_counter(api_cache_key, timeout=self.RATE_LIMIT_WINDOW)
+                return self.rate_limited_response("API rate limit exceeded", 1000)
         
         # General rate limiting
+        request_count = counters[cache_key] - cost
         if request_count >= 5000:  # Reduced from 8000 to 5000 for better security
             logger.critical(json.dumps({
                 'timestamp': datetime.now().isoformat(),
@@ -205,57 +206,42 @@ class SecurityMiddleware(MiddlewareMixin):
                 'event_type': 'rate_limit_exceeded',
                 'request_count': request_count
             }))
-            response = HttpResponse("Rate limit exceeded", status=429)
-            response['Retry-After'] = str(self.RATE_LIMIT_WINDOW)
-            response['X-RateLimit-Limit'] = '5000'
-            response['X-RateLimit-Remaining'] = '0'
-            response['X-RateLimit-Reset'] = str(now_ts + self.RATE_LIMIT_WINDOW)
-            return response
-        
-        # Block requests with suspicious patterns
-        suspicious_patterns = [
-            '../', '..\\', 'etc/passwd', 'cmd.exe', '<script',
-            'javascript:', 'vbscript:', 'onload=', 'onerror=',
-            'eval(', 'document.cookie', 'window.location', 'union select',
-            'drop table', 'insert into', 'delete from', 'update set'
-        ]
+            return self.rate_limited_response("Rate limit exceeded", 5000)
         
-        # Check path and query parameters
-        full_path = request.get_full_path().lower()
-        for pattern in suspicious_patterns:
-            if pattern in full_path:
-                logger.critical(json.dumps({
-                    'timestamp': datetime.now().isoformat(),
-                    'ip': client_ip,
-                    'path': request.get_full_path(),
-                    'user_agent': user_agent[:200],
-                    'event_type': 'suspicious_pattern_detected',
-                    'pattern': pattern,
-                    'user': request.user.username if hasattr(request, 'user') and request.user.is_authenticated else 'anonymous'
-                }))
-                # Increment suspicious request counter
-                self._increment_counter(cache_key, amount=10, timeout=self.RATE_LIMIT_WINDOW)  # Penalty for suspicious requests
-                return HttpResponseBadRequest("Invalid request")
+        # Block requests with suspicious patterns in the path and query parameters
+        if suspicious:
+            logger.critical(json.dumps({
+                'timestamp': datetime.now().isoformat(),
+                'ip': client_ip,
+                'path': full_path,
+                'user_agent': user_agent[:200],
+                'event_type': 'suspicious_pattern_detected',
+                'pattern': suspicious.group(0),
+                'user': request.user.username if hasattr(request, 'user') and request.user.is_authenticated else 'anonymous'
+            }))
+            return HttpResponseBadRequest("Invalid request")
         
         # Check user agent for security scanners
-        user_agent_lower = user_agent.lower()
-        blocked_agents = ['sqlmap', 'nikto', 'nmap', 'masscan', 'nuclei', 'gobuster', 'dirb', 'wpscan', 'burp']
-        if any(agent in user_agent_lower for agent in blocked_agents):
+        if scanner:
             logger.critical(json.dumps({
                 'timestamp': datetime.now().isoformat(),
                 'ip': client_ip,
                 'path': request.path,
                 'user_agent': user_agent[:200],
-                    'event_type': 'security_scanner_blocked',
-                    'user': request.user.username if hasattr(request, 'user') and request.user.is_authenticated else 'anonymous'
-                }))
-            self._increment_counter(cache_key, amount=20, timeout=self.RATE_LIMIT_WINDOW)  # Heavy penalty for security scanners
+                'event_type': 'security_scanner_blocked',
+                'user': request.user.username if hasattr(request, 'user') and request.user.is_authenticated else 'anonymous'
+            }))
             return HttpResponseBadRequest("Access denied")
         
-        # Increment request counter for rate limiting
-        self._increment_counter(cache_key, timeout=self.RATE_LIMIT_WINDOW)
-        
         return None
+
+    def rate_limited_response(self, message, limit):
+        response = HttpResponse(message, status=429)
+        response['Retry-After'] = str(self.RATE_LIMIT_WINDOW)
+        response['X-RateLimit-Limit'] = str(limit)
+        response['X-RateLimit-Remaining'] = '0'
+        response['X-RateLimit-Reset'] = str(int(datetime.now().timestamp()) + self.RATE_LIMIT_WINDOW)
+        return response
     
     def process_response(self, request, response):
         """Add security headers to responses"""
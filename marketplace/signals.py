@@ -1,20 +1,27 @@
 # marketplace/signals.py
-from django.db.models.signals import post_save
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.db.models import Q
-from .models import Order, Review, ReviewReply, Conversation, Message, Transaction, WithdrawalRequest, HeldFund
-from django.core.cache import cache
+from .models import Order, OrderEvent, Review, ReviewReply, Conversation, Message, Transaction, WithdrawalRequest, HeldFund, UserBalance, UserOrderCount
+from . import caching
+from .order_events import record_order_event
 from django.template.loader import render_to_string
 from django.urls import reverse
 
+logger = logging.getLogger(__name__)
+
 # --- Helper functions ---
 
 def get_user_context(user):
     """Gets all the counts needed for notifications for a specific user."""
-    active_purchases = Order.objects.filter(buyer=user, status='PROCESSING').count()
-    active_sales = Order.objects.filter(seller=user, status='PROCESSING').count()
+    order_counts = UserOrderCount.objects.counts_for(user.id)
+    active_purchases = order_counts.get((UserOrderCount.ROLE_BUYER, 'PROCESSING'), 0)
+    active_sales = order_counts.get((UserOrderCount.ROLE_SELLER, 'PROCESSING'), 0)
     
     user_conversations = Conversation.objects.filter(Q(participant1=user) | Q(participant2=user))
     unread_conversations = Message.objects.filter(
@@ -71,50 +78,97 @@ def send_system_message(conversation, message_type, order, user):
             conversation=conversation,
             sender=user,
             content=content,
-            is_system_message=True
+            is_system_message=True,
+            order=order
         )
 
 
 def invalidate_balance_caches(*users):
     """Clear cached balance values for the supplied users."""
-    for user in users:
-        if not user:
-            continue
-        cache.delete(f'user_balance_{user.id}')
-        cache.delete(f'user_held_balance_{user.id}')
+    user_ids = [user.id for user in users if user]
+    caching.bump('balance', *user_ids)
+    caching.bump('held_balance', *user_ids)
 
 # --- Signal Handlers ---
 
+@receiver(post_save)
+@receiver(post_delete)
+def cache_generation_handler(sender, instance, **kwargs):
+    """Model writes invalidate the cached objects built from them (see caching.MODEL_TAGS)."""
+    caching.bump_tags(caching.tags_for_instance(instance))
+
+@receiver(m2m_changed)
+def cache_generation_m2m_handler(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        caching.bump_tags(caching.tags_for_instance(instance))
+
+@receiver(pre_delete, sender=Transaction)
+def transaction_deleted_handler(sender, instance, **kwargs):
+    """Takes a deleted COMPLETED ledger entry back out of the running balance."""
+    # Read the stored row: the instance being deleted may be stale
+    stored = sender.objects.filter(pk=instance.pk).values_list('user_id', 'amount', 'status').first()
+    if stored and stored[2] == 'COMPLETED':
+        # No seeding here: during a user cascade the balance row may already be gone
+        UserBalance.objects.adjust(stored[0], balance=-stored[1], create_missing=False)
+        caching.bump('balance', stored[0])
+
+@receiver(pre_delete, sender=HeldFund)
+def held_fund_deleted_handler(sender, instance, **kwargs):
+    stored = sender.objects.filter(pk=instance.pk).values_list('user_id', 'amount', 'is_released').first()
+    if stored and not stored[2]:
+        UserBalance.objects.adjust(stored[0], held=-stored[1], create_missing=False)
+        caching.bump('held_balance', stored[0])
+
+@receiver(pre_delete, sender=Order)
+def order_deleted_handler(sender, instance, **kwargs):
+    stored = sender.objects.filter(pk=instance.pk).values_list('buyer_id', 'seller_id', 'status').first()
+    if stored:
+        # No seeding: during a user cascade the counter rows may already be gone
+        buyer_id, seller_id, status = stored
+        UserOrderCount.objects.adjust(buyer_id, UserOrderCount.ROLE_BUYER, {status: -1}, create_missing=False)
+        UserOrderCount.objects.adjust(seller_id, UserOrderCount.ROLE_SELLER, {status: -1}, create_missing=False)
+
 @receiver(post_save, sender=Message)
 def new_message_handler(sender, instance, created, **kwargs):
     if created:
-        channel_layer = get_channel_layer()
-        conversation = instance.conversation
-        conversation.save() # Updates the `updated_at` field
+        instance.conversation.save() # Updates the `updated_at` field
+        # Push only once the message has committed: a rolled-back message must
+        # not reach the chat, and a retried write must not be announced twice
+        transaction.on_commit(lambda: push_new_message(instance))
 
-        message_html = render_to_string(
-            'marketplace/partials/message.html', 
-            {'message': instance}
-        )
+def push_new_message(message):
+    """Sends a committed message to its chat room and both participants' notification streams."""
+    channel_layer = get_channel_layer()
+    conversation = message.conversation
+
+    message_html = render_to_string(
+        'marketplace/partials/message.html', 
+        {'message': message}
+    )
 
-        room_group_name = f'chat_{conversation.id}'
+    room_group_name = f'chat_{conversation.id}'
 
+    try:
         async_to_sync(channel_layer.group_send)(
             room_group_name,
             {
                 'type': 'chat_message',
                 'message_html': message_html,
-                'message_id': instance.id
+                'message_id': message.id,
+                'conversation_id': conversation.id,
             }
         )
+    except Exception:
+        logger.exception("Could not push message %s to conversation %s", message.id, conversation.id)
 
-        for user in [conversation.participant1, conversation.participant2]:
-            if user:
-                user_context = get_user_context(user)
-                notification_group_name = f'notifications_{user.username}'
-                # Invalidate cached navbar counters for this user so a quick refresh shows correct values
-                cache.delete(f'user_notifications_{user.id}')
-                
+    for user in [conversation.participant1, conversation.participant2]:
+        if user:
+            user_context = get_user_context(user)
+            notification_group_name = f'notifications_{user.username}'
+            # Invalidate cached navbar counters for this user so a quick refresh shows correct values
+            caching.bump('notifications', user.id)
+
+            try:
                 async_to_sync(channel_layer.group_send)(
                     notification_group_name,
                     {
@@ -123,78 +177,61 @@ def new_message_handler(sender, instance, created, **kwargs):
                         "data": {
                             'unread_conversations_count': user_context['unread_conversations_count'],
                             'conversation_id': conversation.id,
-                            'last_message_content': instance.content if instance.content else "[Image]",
-                            'last_message_timestamp': str(instance.timestamp.isoformat()),
-                            'sender_username': instance.sender.username,
+                            'last_message_content': message.content if message.content else "[Image]",
+                            'last_message_timestamp': str(message.timestamp.isoformat()),
+                            'sender_username': message.sender.username,
                         },
                     }
                 )
+            except Exception:
+                logger.exception("Could not notify user %s of message %s", user.id, message.id)
 
 @receiver(post_save, sender=Order)
 def order_status_change_handler(sender, instance, created, **kwargs):
-    channel_layer = get_channel_layer()
+    status_changed = not created and instance.tracker.has_changed('status')
+    if not (created or status_changed):
+        return
+
     buyer = instance.buyer
     seller = instance.seller
+    status = instance.status
 
-    conversation = Conversation.objects.filter(
-        (Q(participant1=buyer) & Q(participant2=seller)) |
-        (Q(participant1=seller) & Q(participant2=buyer))
-    ).first()
-
-    if conversation:
-        if created and instance.status in ['PROCESSING', 'DELIVERED']:
-            send_system_message(conversation, 'order_paid', instance, buyer)
-        elif not created and instance.tracker.has_changed('status') and instance.status == 'COMPLETED':
-            send_system_message(conversation, 'order_confirmed', instance, buyer)
-        elif not created and instance.tracker.has_changed('status') and instance.status == 'REFUNDED':
-            send_system_message(conversation, 'order_refunded', instance, seller)
-
-    if created or instance.tracker.has_changed('status'):
-        status = instance.status
-        if status == 'PROCESSING':
-            if instance.amount_paid_from_balance > 0:
-                Transaction.objects.update_or_create(
-                    order=instance, user=buyer, transaction_type='ORDER_PURCHASE',
-                    defaults={'amount': -instance.amount_paid_from_balance, 'status': 'COMPLETED', 'description': f"Balance payment for order {instance.order_id}"}
-                )
+    if created:
+        UserOrderCount.objects.count_order(instance, {status: 1})
+    else:
+        UserOrderCount.objects.count_order(instance, {instance.tracker.previous('status'): -1, status: 1})
+
+    # Ledger entries commit with the order; chat messages, system notices and
+    # notifications are produced after commit by the order event pipeline.
+    if status == 'PROCESSING':
+        if instance.amount_paid_from_balance > 0:
             Transaction.objects.update_or_create(
-                order=instance, user=seller, transaction_type='ORDER_SALE',
-                defaults={'amount': instance.total_price, 'status': 'PROCESSING', 'description': f"Sale of '{instance.listing_title_snapshot}'"}
+                order=instance, user=buyer, transaction_type='ORDER_PURCHASE',
+                defaults={'amount': -instance.amount_paid_from_balance, 'status': 'COMPLETED', 'description': f"Balance payment for order {instance.order_id}"}
             )
-        elif status == 'COMPLETED':
-            Transaction.objects.filter(order=instance, user=buyer).update(status='COMPLETED')
-            net_earning = instance.total_price - (instance.commission_paid or 0)
-            Transaction.objects.filter(order=instance, user=seller).update(status='COMPLETED', amount=net_earning)
-            invalidate_balance_caches(buyer, seller)
-            if not seller.profile.is_verified_seller:
-                HeldFund.objects.get_or_create(
-                    user=seller,
-                    order=instance,
-                    defaults={'amount': net_earning}
-                )
-        elif status in ['CANCELLED', 'REFUNDED']:
-            Transaction.objects.filter(order=instance).update(status=status)
-            invalidate_balance_caches(buyer, seller)
-
-    if instance.tracker.has_changed('status') or created:
-        buyer_context = get_user_context(buyer)
-        seller_context = get_user_context(seller)
-        
-        message_for_ui = f"New order {instance.order_id} from {buyer.username}." if created else f"Order {instance.order_id} status updated to {instance.get_status_display()}."
-
-        for user, context, message in [(buyer, buyer_context, f"Your order {instance.order_id} status: {instance.get_status_display()}"), 
-                                       (seller, seller_context, message_for_ui)]:
-            if user:
-                # Invalidate cached navbar counters for these users
-                cache.delete(f'user_notifications_{user.id}')
-                async_to_sync(channel_layer.group_send)(
-                    f'notifications_{user.username}',
-                    {
-                        "type": "send_notification",
-                        "notification_type": "order_update",
-                        "data": {"message": message, **context}
-                    }
-                )
+        Transaction.objects.update_or_create(
+            order=instance, user=seller, transaction_type='ORDER_SALE',
+            defaults={'amount': instance.total_price, 'status': 'PROCESSING', 'description': f"Sale of '{instance.listing_title_snapshot}'"}
+        )
+    elif status == 'COMPLETED':
+        Transaction.objects.filter(order=instance, user=buyer).update_with_balances(status='COMPLETED')
+        net_earning = instance.total_price - (instance.commission_paid or 0)
+        Transaction.objects.filter(order=instance, user=seller).update_with_balances(status='COMPLETED', amount=net_earning)
+        invalidate_balance_caches(buyer, seller)
+        if not seller.profile.is_verified_seller:
+            HeldFund.objects.get_or_create(
+                user=seller,
+                order=instance,
+                defaults={'amount': net_earning}
+            )
+    elif status in ['CANCELLED', 'REFUNDED']:
+        Transaction.objects.filter(order=instance).update_with_balances(status=status)
+        invalidate_balance_caches(buyer, seller)
+
+    if created:
+        record_order_event(instance, OrderEvent.EVENT_CREATED)
+    else:
+        record_order_event(instance, OrderEvent.EVENT_STATUS_CHANGED, instance.tracker.previous('status'))
 
 @receiver(post_save, sender=Review)
 def review_creation_handler(sender, instance, created, **kwargs):
@@ -237,27 +274,25 @@ def withdrawal_transaction_handler(sender, instance, created, **kwargs):
             
             if available_balance >= instance.amount:
                 # Update the transaction to show the actual withdrawal amount
-                Transaction.objects.filter(withdrawal=instance).update(
+                Transaction.objects.filter(withdrawal=instance).update_with_balances(
                     status='COMPLETED', 
                     amount=-instance.amount,
                     description=f'Withdrawal - {instance.get_payment_method_display()} - {instance.account_title}'
                 )
                 
                 # Clear the user's balance cache so it recalculates
-                from django.core.cache import cache
-                cache.delete(f'user_balance_{instance.user.id}')
-                cache.delete(f'user_held_balance_{instance.user.id}')
+                invalidate_balance_caches(instance.user)
             else:
                 # If insufficient balance, reject the withdrawal
                 instance.status = 'REJECTED'
                 instance.admin_notes = f'Insufficient available balance at the time of approval. Available: Rs{available_balance:.2f}, Requested: Rs{instance.amount:.2f}'
                 instance.save(update_fields=['status', 'admin_notes'])  # Prevent signal recursion
-                Transaction.objects.filter(withdrawal=instance).update(
+                Transaction.objects.filter(withdrawal=instance).update_with_balances(
                     status='CANCELLED',
                     description='Withdrawal Cancelled - Insufficient Balance'
                 )
         elif instance.status == 'REJECTED':
-            Transaction.objects.filter(withdrawal=instance).update(
+            Transaction.objects.filter(withdrawal=instance).update_with_balances(
                 status='CANCELLED',
                 description='Withdrawal Request Rejected'
             )
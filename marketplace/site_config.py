@@ -0,0 +1,108 @@
+# marketplace/site_config.py
+"""
+Process-local SiteConfiguration snapshot.
+
+Commission lookups used to run SiteConfiguration.objects.first() every time.
+Each worker now keeps an immutable snapshot in memory, tagged with the version
+it was loaded at. A shared version key in the cache (Redis in production) is
+bumped whenever the configuration changes. Inside a request the key is checked
+at most once (SiteConfigMiddleware opens the request scope), and the database
+is only read again when the version has moved.
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+SITE_CONFIG_VERSION_KEY = 'site_config_version'
+FALLBACK_COMMISSION_RATE = Decimal('10.00')
+
+
+@dataclass(frozen=True)
+class SiteConfigSnapshot:
+    default_commission_rate: Decimal
+    version: str = None
+
+
+_snapshot = None
+_load_lock = threading.Lock()
+# Per-request scratch space; None outside a request, so commands always check
+_request_state = ContextVar('site_config_request_state', default=None)
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def bump_site_config_version():
+    """
+    Marks every worker's snapshot stale. Bumped immediately and again on
+    commit, so no worker can pin the pre-commit row under the new version.
+    """
+    cache.set(SITE_CONFIG_VERSION_KEY, _new_version(), None)
+    transaction.on_commit(lambda: cache.set(SITE_CONFIG_VERSION_KEY, _new_version(), None))
+
+
+def _current_version():
+    version = cache.get(SITE_CONFIG_VERSION_KEY)
+    if version is None:
+        # Evicted or never published: publish one so all workers agree on it
+        cache.add(SITE_CONFIG_VERSION_KEY, _new_version(), None)
+        version = cache.get(SITE_CONFIG_VERSION_KEY)
+    return version
+
+
+def _load_snapshot(version):
+    from .models import SiteConfiguration
+
+    config = SiteConfiguration.objects.first()
+    if config and config.default_commission_rate is not None:
+        rate = Decimal(config.default_commission_rate)
+    else:
+        rate = FALLBACK_COMMISSION_RATE
+    return SiteConfigSnapshot(default_commission_rate=rate, version=version)
+
+
+def get_site_config():
+    """Returns the current SiteConfigSnapshot, reloading it only when the version moved."""
+    global _snapshot
+
+    state = _request_state.get()
+    snapshot = _snapshot
+    if snapshot is not None and state is not None and state.get('checked'):
+        return snapshot
+
+    version = _current_version()
+    if snapshot is None or version is None or snapshot.version != version:
+        with _load_lock:
+            snapshot = _snapshot
+            if snapshot is None or version is None or snapshot.version != version:
+                # The version is read before the row, so a concurrent bump
+                # can only make this snapshot reload early, never stick stale.
+                snapshot = _load_snapshot(version)
+                _snapshot = snapshot
+
+    if state is not None:
+        state['checked'] = True
+    return snapshot
+
+
+def clear_site_config():
+    """Drops this process's snapshot (tests and shell use)."""
+    global _snapshot
+    _snapshot = None
+
+
+@contextmanager
+def request_scope():
+    """Limits version checks to one for the code run inside (one request)."""
+    token = _request_state.set({})
+    try:
+        yield
+    finally:
+        _request_state.reset(token)
@@ -0,0 +1,266 @@
+# marketplace/snapshots.py
+"""
+Read-only snapshots of catalog and product data for the cache.
+
+Cached pages used to store pickled model instances, which drag their _state,
+every loaded relation and prefetch caches into Redis and are slow to
+unpickle. The namespaces in caching.py that opt in (codec=codec) store these
+slotted, frozen dataclasses instead, packed with msgpack: each class is an
+extension type whose fields are written positionally, and Decimal and aware
+datetimes have their own encodings. Templates read them like the models they
+replace, and building a page from a snapshot never touches the ORM.
+
+Adding, removing or renaming a field changes codec.layout_version, which is
+part of every codec namespace key, so entries written under the old layout
+are never read again and simply expire. Changing a field's type is not
+detected; reusing or renumbering a type code is never safe.
+"""
+import datetime
+import zlib
+from dataclasses import dataclass, fields
+from decimal import Decimal
+from functools import cached_property
+
+import msgpack
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+_DECIMAL = 1
+_TYPES = {}
+_LAYOUTS = {}
+
+
+def codec_type(code):
+    """Registers a snapshot class under a msgpack extension type code."""
+    def register(cls):
+        if code in _TYPES or code == _DECIMAL:
+            raise ValueError(f"Snapshot type code {code} is already in use")
+        _TYPES[code] = cls
+        _LAYOUTS[cls] = (code, tuple(field.name for field in fields(cls)))
+        return cls
+    return register
+
+
+class MsgpackCodec:
+    """dumps()/loads() for values built from snapshots, tuples, dicts and scalars."""
+
+    @cached_property
+    def layout_version(self):
+        """Checksum of every registered type code and its field names."""
+        return zlib.crc32(repr(sorted(_LAYOUTS.values())).encode())
+
+    def _encode(self, obj):
+        if isinstance(obj, Decimal):
+            return msgpack.ExtType(_DECIMAL, str(obj).encode())
+        layout = _LAYOUTS.get(type(obj))
+        if layout is None:
+            raise TypeError(f"Cannot cache {type(obj).__name__} values with the snapshot codec")
+        code, names = layout
+        return msgpack.ExtType(code, self.dumps([getattr(obj, name) for name in names]))
+
+    def _decode(self, code, data):
+        if code == _DECIMAL:
+            return Decimal(data.decode())
+        return _TYPES[code](*self.loads(data))
+
+    def dumps(self, value):
+        return msgpack.packb(value, default=self._encode, use_bin_type=True, datetime=True)
+
+    def loads(self, data):
+        # Sequences come back as tuples, so snapshots stay immutable
+        return msgpack.unpackb(
+            data, ext_hook=self._decode, use_list=False, timestamp=3, strict_map_key=False, raw=False,
+        )
+
+
+codec = MsgpackCodec()
+
+
+class _Identified:
+    """Templates and views use both .pk and .id, as on models."""
+    __slots__ = ()
+
+    @property
+    def id(self):
+        return self.pk
+
+
+@codec_type(10)
+@dataclass(frozen=True, slots=True)
+class CategorySnapshot(_Identified):
+    pk: int
+    name: str
+
+    @classmethod
+    def from_category(cls, category):
+        return cls(category.pk, category.name)
+
+
+@codec_type(11)
+@dataclass(frozen=True, slots=True)
+class GameSnapshot(_Identified):
+    pk: int
+    title: str
+    ordered_categories: tuple = ()
+
+    @classmethod
+    def from_game(cls, game, categories=()):
+        return cls(game.pk, game.title, tuple(CategorySnapshot.from_category(c) for c in categories))
+
+
+@codec_type(12)
+@dataclass(frozen=True, slots=True)
+class FilterOptionSnapshot(_Identified):
+    pk: int
+    value: str
+    filter_id: int
+
+
+@codec_type(13)
+@dataclass(frozen=True, slots=True)
+class FilterSnapshot(_Identified):
+    pk: int
+    name: str
+    filter_type: str
+    order: int
+    options: tuple = ()
+
+    @classmethod
+    def from_filter(cls, filter_obj, with_options=True):
+        options = ()
+        if with_options:
+            options = tuple(
+                FilterOptionSnapshot(option.pk, option.value, option.filter_id) for option in filter_obj.options.all()
+            )
+        return cls(filter_obj.pk, filter_obj.name, filter_obj.filter_type, filter_obj.order, options)
+
+
+@codec_type(14)
+@dataclass(frozen=True, slots=True)
+class GameCategorySnapshot(_Identified):
+    pk: int
+    game_id: int
+    category_id: int
+    allows_automated_delivery: bool
+    requires_special_approval: bool
+    primary_filter: FilterSnapshot = None
+
+    @classmethod
+    def from_link(cls, link):
+        primary_filter = link.primary_filter
+        return cls(
+            link.pk, link.game_id, link.category_id, link.allows_automated_delivery,
+            link.requires_special_approval,
+            FilterSnapshot.from_filter(primary_filter, with_options=False) if primary_filter else None,
+        )
+
+    def _link(self):
+        from .models import GameCategory
+
+        return GameCategory(pk=self.pk, requires_special_approval=self.requires_special_approval)
+
+    def seller_can_list(self, user):
+        """GameCategory.seller_can_list, without loading the link."""
+        return self._link().seller_can_list(user)
+
+    def filter_tree(self):
+        """GameCategory.filter_tree, without loading the link."""
+        return self._link().filter_tree()
+
+
+@codec_type(15)
+@dataclass(frozen=True, slots=True)
+class SellerProfileSnapshot:
+    image_url: str
+    last_seen: datetime.datetime
+    can_moderate: bool
+
+    @property
+    def is_online(self):
+        # Same grace period as Profile.is_online
+        return bool(self.last_seen) and timezone.now() < self.last_seen + datetime.timedelta(minutes=5)
+
+
+@codec_type(16)
+@dataclass(frozen=True, slots=True, eq=False)
+class SellerSnapshot(_Identified):
+    """A user as shown next to their listing. Compares equal to that User, so {% if user != seller %} works."""
+    pk: int
+    username: str
+    profile: SellerProfileSnapshot
+
+    @classmethod
+    def from_user(cls, user):
+        profile = user.profile
+        return cls(
+            user.pk, user.username,
+            SellerProfileSnapshot(profile.image_url, profile.last_seen, profile.can_moderate),
+        )
+
+    def __eq__(self, other):
+        if isinstance(other, (SellerSnapshot, User)):
+            return other.pk == self.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+@codec_type(17)
+@dataclass(frozen=True, slots=True)
+class ProductImageSnapshot:
+    image_url: str
+
+
+@codec_type(18)
+@dataclass(frozen=True, slots=True)
+class SelectedOptionSnapshot(_Identified):
+    pk: int
+    value: str
+    filter_id: int
+    filter_name: str
+
+
+@codec_type(19)
+@dataclass(frozen=True, slots=True)
+class ProductSnapshot(_Identified):
+    pk: int
+    listing_title: str
+    description: str
+    automatic_delivery: bool
+    buyer_price: Decimal
+    stock_count: int
+    game: GameSnapshot
+    category: CategorySnapshot
+    seller: SellerSnapshot
+    images: tuple
+    filter_options: tuple
+
+    @classmethod
+    def from_product(cls, product):
+        """Expects Product.objects.with_full_details().with_buyer_price()."""
+        options = sorted(product.filter_options.all(), key=lambda option: option.filter.order)
+        return cls(
+            product.pk, product.listing_title, product.description, product.automatic_delivery,
+            product.buyer_price, product.stock_count,
+            GameSnapshot.from_game(product.game), CategorySnapshot.from_category(product.category),
+            SellerSnapshot.from_user(product.seller),
+            tuple(ProductImageSnapshot(image.image_url) for image in product.images.all()),
+            tuple(
+                SelectedOptionSnapshot(option.pk, option.value, option.filter_id, option.filter.name)
+                for option in options
+            ),
+        )
+
+
+@codec_type(20)
+@dataclass(frozen=True, slots=True)
+class FlatPageSnapshot(_Identified):
+    pk: int
+    slug: str
+    title: str
+    content: str
+
+    @classmethod
+    def from_page(cls, page):
+        return cls(page.pk, page.slug, page.title, page.content)
@@ -4,16 +4,16 @@ from decimal import Decimal
 
 from django import template
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db.models import Count, Sum
 from django.utils import timezone
 
 from marketplace.models import (
     Conversation,
-    HeldFund,
-    Order,
+    DailyMarketplaceStats,
     Product,
     SupportTicket,
-    Transaction,
+    UserBalance,
+    UserOrderCount,
     WithdrawalRequest,
 )
 
@@ -47,44 +47,58 @@ def build_metric(label, value, fmt, hint=None):
     return metric
 
 
+DEFAULT_CHART_DAYS = 30
+MAX_CHART_DAYS = 365
+
+
+def chart_days(request):
+    """Days shown in the dashboard chart, from ?stats_days= (clamped to 7..365)."""
+    try:
+        days = int(request.GET.get("stats_days", DEFAULT_CHART_DAYS)) if request else DEFAULT_CHART_DAYS
+    except (TypeError, ValueError):
+        days = DEFAULT_CHART_DAYS
+    return min(max(days, 7), MAX_CHART_DAYS)
+
+
+def build_chart(series, field, fmt):
+    """Bars scaled to the largest day, for the CSS chart in the overview partial."""
+    peak = max((day[field] for day in series), default=0) or 1
+    return [
+        {
+            "day": day["day"],
+            "value": day[field],
+            "display": currency_display(day[field]) if fmt == "currency" else number_display(day[field]),
+            "height": round(day[field] * 100 / peak, 1),
+        }
+        for day in series
+    ]
+
+
 @register.inclusion_tag("admin/partials/marketplace_overview.html", takes_context=True)
 def marketplace_overview(context):
     """
     Provide aggregated marketplace metrics for the custom admin dashboard.
+    Order, revenue and sign-up history comes from the daily rollups; only
+    current-state counts (open orders, queues, balances) are read live.
     """
+    today = timezone.localdate()
+    week_start = today - timedelta(days=6)
+    totals = DailyMarketplaceStats.objects.totals(since=week_start)
+
     # Financial metrics
-    total_user_balance = (
-        Transaction.objects.filter(status="COMPLETED").aggregate(total=Sum("amount"))["total"]
-        or ZERO_DECIMAL
+    balances = UserBalance.objects.aggregate(balance=Sum("balance"), held=Sum("held"))
+    held_balance = balances["held"] or ZERO_DECIMAL
+    available_balance = (balances["balance"] or ZERO_DECIMAL) - held_balance
+
+    # Order health: every order has exactly one seller row in the per-user counters
+    status_counts = dict(
+        UserOrderCount.objects.filter(role=UserOrderCount.ROLE_SELLER)
+        .values("status").annotate(total=Sum("count")).values_list("status", "total")
     )
-    held_balance = (
-        HeldFund.objects.filter(is_released=False).aggregate(total=Sum("amount"))["total"]
-        or ZERO_DECIMAL
+    open_orders = sum(
+        status_counts.get(status, 0) for status in ("PENDING_PAYMENT", "PROCESSING", "DELIVERED", "DISPUTED")
     )
-    available_balance = total_user_balance - held_balance
-
-    completed_orders_qs = Order.objects.filter(status="COMPLETED")
-    completed_orders = list(completed_orders_qs)
-
-    total_revenue = sum((order.total_price or ZERO_DECIMAL) for order in completed_orders) or ZERO_DECIMAL
-
-    total_profit = ZERO_DECIMAL
-    for order in completed_orders:
-        if order.commission_paid is not None:
-            commission = order.commission_paid
-        elif order.seller_amount:
-            commission = order.total_price - order.seller_amount
-        else:
-            commission = order.calculate_commission()
-        total_profit += commission or ZERO_DECIMAL
-
-    # Order health
-    open_orders = Order.objects.filter(
-        status__in=["PENDING_PAYMENT", "PROCESSING", "DELIVERED", "DISPUTED"]
-    ).count()
-    closed_orders = Order.objects.filter(status__in=["COMPLETED", "CANCELLED"]).count()
-    refunded_orders = Order.objects.filter(status="REFUNDED").count()
-    open_disputes = Order.objects.filter(status="DISPUTED").count()
+    closed_orders = status_counts.get("COMPLETED", 0) + status_counts.get("CANCELLED", 0)
     dispute_conversations = Conversation.objects.filter(is_disputed=True).count()
 
     # Liquidity & support operations
@@ -92,9 +106,8 @@ def marketplace_overview(context):
     active_support_tickets = SupportTicket.objects.filter(status__in=["OPEN", "IN_PROGRESS"]).count()
 
     # Marketplace activity
-    active_listings = Product.objects.filter(is_active=True).count()
-    total_games = (
-        Product.objects.filter(is_active=True).values("game_id").distinct().count()
+    listings = Product.objects.filter(is_active=True).aggregate(
+        total=Count("id"), games=Count("game_id", distinct=True)
     )
     verified_sellers = (
         Product.objects.filter(seller__profile__is_verified_seller=True)
@@ -102,34 +115,20 @@ def marketplace_overview(context):
         .distinct()
         .count()
     )
-
-    User = get_user_model()
-    total_users = User.objects.filter(is_active=True).count()
-    new_users_7_days = User.objects.filter(
-        is_active=True, date_joined__gte=timezone.now() - timedelta(days=7)
-    ).count()
-
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    orders_last_7_days = Order.objects.filter(created_at__gte=seven_days_ago).count()
-    revenue_last_7_days = (
-        completed_orders_qs.filter(created_at__gte=seven_days_ago).aggregate(total=Sum("total_price"))[
-            "total"
-        ]
-        or ZERO_DECIMAL
-    )
+    total_users = get_user_model().objects.filter(is_active=True).count()
 
     metrics = OrderedDict(
         financial=[
             build_metric("Total available balance", available_balance, "currency"),
             build_metric("Held funds", held_balance, "currency"),
-            build_metric("Total revenue", total_revenue, "currency"),
-            build_metric("Total profit", total_profit, "currency"),
+            build_metric("Total revenue", totals["gmv"], "currency"),
+            build_metric("Total profit", totals["commission"], "currency"),
         ],
         orders=[
             build_metric("Open orders", open_orders, "number"),
             build_metric("Closed orders", closed_orders, "number"),
-            build_metric("Refunded orders", refunded_orders, "number"),
-            build_metric("Open disputes", open_disputes, "number"),
+            build_metric("Refunded orders", status_counts.get("REFUNDED", 0), "number"),
+            build_metric("Open disputes", status_counts.get("DISPUTED", 0), "number"),
             build_metric(
                 "Dispute conversations",
                 dispute_conversations,
@@ -142,14 +141,26 @@ def marketplace_overview(context):
             build_metric("Active support tickets", active_support_tickets, "number"),
         ],
         marketplace=[
-            build_metric("Active listings", active_listings, "number"),
-            build_metric("Games with listings", total_games, "number"),
+            build_metric("Active listings", listings["total"], "number"),
+            build_metric("Games with listings", listings["games"], "number"),
             build_metric("Verified sellers", verified_sellers, "number"),
             build_metric("Active users", total_users, "number"),
-            build_metric("New users (7d)", new_users_7_days, "number"),
-            build_metric("Orders (7d)", orders_last_7_days, "number"),
-            build_metric("Revenue (7d)", revenue_last_7_days, "currency"),
+            build_metric("New users (7d)", totals["new_users_recent"], "number"),
+            build_metric("Orders (7d)", totals["orders_recent"], "number"),
+            build_metric("Revenue (7d)", totals["gmv_recent"], "currency"),
         ],
     )
 
-    return {"metric_groups": metrics}
+    days = chart_days(context.get("request"))
+    series = DailyMarketplaceStats.objects.series(today - timedelta(days=days - 1), today)
+
+    return {
+        "metric_groups": metrics,
+        "charts": [
+            {"title": "Revenue per day", "prefix": "PKR", "bars": build_chart(series, "gmv", "currency")},
+            {"title": "Orders per day", "bars": build_chart(series, "orders", "number")},
+        ],
+        "chart_days": days,
+        "chart_day_options": (7, 30, 90, 365),
+        "stats_refreshed_at": DailyMarketplaceStats.objects.last_refreshed(),
+    }
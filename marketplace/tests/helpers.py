@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from marketplace.models import Category, Game, Order, Product
+
+
+class OrderFixtures:
+    """
+    TestCase mixin: a buyer, a seller with one listing, and create_order()
+    with the snapshot fields checkout fills in. Subclasses adjust the
+    category, listing and order defaults through the class attributes.
+    """
+    category_fields = {}
+    product_fields = {}
+    order_fields = {}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.buyer = User.objects.create_user(
+            username="orderbuyer", email="orderbuyer@example.com", password="testpass"
+        )
+        self.seller = User.objects.create_user(
+            username="orderseller", email="orderseller@example.com", password="testpass"
+        )
+        self.game = Game.objects.create(title="Order Game")
+        self.category = Category.objects.create(name="Order Keys", **self.category_fields)
+        self.product = Product.objects.create(
+            seller=self.seller,
+            game=self.game,
+            category=self.category,
+            **{
+                "listing_title": "Order fixture listing title",
+                "description": "Order fixture listing description",
+                "price": Decimal("100.00"),
+                "stock": 10,
+                **self.product_fields,
+            },
+        )
+
+    def create_order(self, **fields):
+        """An order for self.product; keyword arguments override the defaults."""
+        return Order.objects.create(**{
+            "buyer": self.buyer,
+            "seller": self.seller,
+            "product": self.product,
+            "total_price": Decimal("110.00"),
+            "status": "PROCESSING",
+            "listing_title_snapshot": self.product.listing_title,
+            "game_snapshot": self.game,
+            "category_snapshot": self.category,
+            **self.order_fields,
+            **fields,
+        })
@@ -0,0 +1,117 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from marketplace import bulk_actions
+from marketplace.models import (
+    DepositRequest, HeldFund, Order, Transaction, UserBalance, UserOrderCount, WithdrawalRequest,
+)
+from marketplace.tests.helpers import OrderFixtures
+
+
+@override_settings(ORDER_EVENTS_ASYNC=False)
+class BulkActionTests(OrderFixtures, TestCase):
+    """Admin bulk transitions write ledger changes set-based and notify each user once"""
+
+    product_fields = {"stock": 50}
+    order_fields = {"total_price": Decimal("100.00"), "commission_paid": Decimal("10.00")}
+
+    def deposit(self, user, amount):
+        Transaction.objects.create(
+            user=user, amount=Decimal(amount), transaction_type="DEPOSIT",
+            status="COMPLETED", description="Test deposit",
+        )
+
+    def assert_balances_match_ledger(self, *users):
+        for user in users:
+            row = UserBalance.objects.get(user=user)
+            self.assertEqual((row.balance, row.held), UserBalance.objects.ledger_totals([user.id])[user.id])
+
+    def test_complete_orders_pays_sellers_and_holds_funds(self):
+        """Paid orders complete with net ledger rows and holds; others are skipped"""
+        orders = [self.create_order() for _ in range(3)]
+        cancelled = self.create_order(status="CANCELLED")
+
+        with patch("marketplace.bulk_actions.notify_users") as notify, self.captureOnCommitCallbacks(execute=True):
+            result = bulk_actions.complete_orders(Order.objects.filter(pk__in=[o.pk for o in orders + [cancelled]]))
+
+        self.assertEqual((result.processed, result.skipped), (3, 1))
+        self.assertEqual(Order.objects.filter(status="COMPLETED").count(), 3)
+        self.assertEqual(
+            sorted(Transaction.objects.filter(user=self.seller, status="COMPLETED").values_list("amount", flat=True)),
+            [Decimal("90.00")] * 3,
+        )
+        self.assertEqual(HeldFund.objects.filter(user=self.seller, is_released=False).count(), 3)
+        self.assert_balances_match_ledger(self.seller)
+        self.assertEqual(UserBalance.objects.get(user=self.seller).available, Decimal("0.00"))
+
+        counts = UserOrderCount.objects.counts_for(self.seller.id)
+        self.assertEqual(counts[(UserOrderCount.ROLE_SELLER, "COMPLETED")], 3)
+        self.assertEqual(counts[(UserOrderCount.ROLE_SELLER, "PROCESSING")], 0)
+
+        notify.assert_called_once()
+        notices = notify.call_args.args[0]
+        self.assertEqual(notices[self.seller.id], {"{} sale(s) marked completed": 3})
+        self.assertEqual(notices[self.buyer.id], {"{} purchase(s) marked completed": 3})
+
+    def test_withdrawals_approved_while_balance_lasts(self):
+        """Approvals draw down the available balance; the overflow is rejected"""
+        self.deposit(self.seller, "100.00")
+        requests = [
+            WithdrawalRequest.objects.create(user=self.seller, amount=Decimal(amount), account_title="Bulk")
+            for amount in ("60.00", "60.00", "40.00")
+        ]
+
+        result = bulk_actions.approve_withdrawals(WithdrawalRequest.objects.filter(pk__in=[r.pk for r in requests]))
+        self.assertEqual((result.processed, result.rejected), (2, 1))
+        statuses = [WithdrawalRequest.objects.get(pk=r.pk).status for r in requests]
+        self.assertEqual(statuses, ["APPROVED", "REJECTED", "APPROVED"])
+        self.assertIn("Insufficient available balance", WithdrawalRequest.objects.get(pk=requests[1].pk).admin_notes)
+        self.assertEqual(UserBalance.objects.get(user=self.seller).balance, Decimal("0.00"))
+        self.assert_balances_match_ledger(self.seller)
+
+    def test_withdrawal_queries_do_not_grow_with_selection(self):
+        """Approving many withdrawals costs about the same queries as approving a few"""
+        self.deposit(self.seller, "1000.00")
+
+        def approve(count):
+            pks = [
+                WithdrawalRequest.objects.create(user=self.seller, amount=Decimal("1.00"), account_title="Bulk").pk
+                for _ in range(count)
+            ]
+            with CaptureQueriesContext(connection) as captured:
+                bulk_actions.approve_withdrawals(WithdrawalRequest.objects.filter(pk__in=pks))
+            return len(captured.captured_queries)
+
+        self.assertEqual(approve(3), approve(40))
+        self.assert_balances_match_ledger(self.seller)
+
+    def test_admin_deposit_action_credits_balances(self):
+        """The deposit admin action approves and credits in one pass"""
+        deposits = []
+        for _ in range(2):
+            deposit = DepositRequest.objects.create(user=self.buyer, amount=Decimal("25.00"), receipt="deposit_receipts/r.png")
+            Transaction.objects.create(
+                user=self.buyer, amount=Decimal("25.00"), transaction_type="DEPOSIT",
+                status="PENDING", description="Pending deposit", deposit=deposit,
+            )
+            deposits.append(deposit)
+        admin_user = User.objects.create_superuser(username="bulkadmin", password="testpass")
+        self.client.force_login(admin_user)
+
+        response = self.client.post(
+            reverse("admin:marketplace_depositrequest_changelist"),
+            {"action": "mark_approved", "_selected_action": [d.pk for d in deposits]},
+            follow=True,
+        )
+        self.assertContains(response, "2 deposit requests approved.")
+        self.assertEqual(UserBalance.objects.get(user=self.buyer).balance, Decimal("50.00"))
+        self.assertEqual(
+            Transaction.objects.get(deposit=deposits[0]).description, f"Manual deposit #{deposits[0].pk} approved"
+        )
+        self.assert_balances_match_ledger(self.buyer)
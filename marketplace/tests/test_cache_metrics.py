@@ -0,0 +1,90 @@
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.test import TestCase
+from django.urls import reverse
+
+from marketplace import cache_metrics
+from marketplace.cache_metrics import key_family, recorder
+
+
+class CacheMetricsTests(TestCase):
+    """The cache backend records hits, misses, writes, latency and sizes per key family"""
+
+    def setUp(self):
+        cache.clear()
+        recorder.drain()
+
+    def test_key_families(self):
+        """Keys group by their stable prefix, without ids, IPs or tokens"""
+        self.assertEqual(key_family("ns:product_detail:12"), "ns:product_detail")
+        self.assertEqual(key_family("gen:balance:7"), "gen:balance")
+        self.assertEqual(key_family("lock:ns:search:abc123"), "lock:ns:search")
+        self.assertEqual(key_family("rate_limit_login_5_10.0.0.1"), "rate_limit_login")
+        self.assertEqual(key_family("user_last_seen_42"), "user_last_seen")
+        self.assertEqual(key_family("site_config"), "site_config")
+
+    def test_operations_are_counted_once(self):
+        """Bulk calls count every key once, even when the backend loops over get()"""
+        for _ in range(cache_metrics.SIZE_SAMPLE_EVERY):
+            cache.set("user_last_seen_1", "now")
+        cache.get("user_last_seen_1")
+        cache.get("user_last_seen_2")
+        cache.get_many(["user_last_seen_1", "user_last_seen_3"])
+        cache.delete("user_last_seen_1")
+        counts = recorder.drain()["user_last_seen"]
+
+        self.assertEqual((counts["hits"], counts["misses"]), (2, 2))
+        self.assertEqual((counts["sets"], counts["deletes"]), (cache_metrics.SIZE_SAMPLE_EVERY, 1))
+        self.assertEqual(sum(v for k, v in counts.items() if k.startswith("read_le_")), 3)
+        self.assertEqual(counts["size_samples"], 1)
+
+    def test_flushed_metrics_are_reported(self):
+        """Flushed counts accumulate in the shared cache and are summarized per family"""
+        for _ in range(3):
+            cache.get("ns:search:missing")
+        cache.flush_metrics()
+        cache.set("ns:search:found", "value")
+        cache.get("ns:search:found")
+
+        summary = cache_metrics.report()["ns:search"]
+        self.assertEqual((summary["hits"], summary["misses"]), (1, 3))
+        self.assertEqual(summary["hit_ratio"], 0.25)
+        self.assertEqual(summary["read"]["ops"], 4)
+        self.assertIsNotNone(summary["read"]["p95_ms"])
+        self.assertNotIn("cache_metrics", cache_metrics.report())
+
+        cache.reset_metrics()
+        self.assertEqual(cache.read_metrics(), {})
+
+    def test_due_flush_runs_off_the_request_thread(self):
+        """The call that finds a flush due only hands it over, and failures are logged"""
+        threads = []
+
+        def publish(pending):
+            threads.append(threading.current_thread().name)
+            raise ConnectionError("metrics store is down")
+
+        with patch.object(cache_metrics.recorder, "due", return_value=True), \
+                patch.object(type(caches["default"]), "_publish_metrics", side_effect=publish), \
+                self.assertLogs("marketplace.cache_metrics", "ERROR"):
+            cache.get("ns:search:due")
+            cache.flush_metrics()
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith("cache-metrics") for name in threads))
+
+    def test_admin_page_lists_families(self):
+        """Staff see the per-family table; the page needs a staff login"""
+        cache.get("ns:flat_page:rules")
+        url = reverse("admin_chat:cache_metrics")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        admin = User.objects.create_user(username="metricsadmin", password="testpass", is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get(url)
+        self.assertContains(response, "ns:flat_page")
+
+        self.assertRedirects(self.client.post(url), url, fetch_redirect_response=False)
+        self.assertEqual(cache.read_metrics(), {})
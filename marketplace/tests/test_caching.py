@@ -0,0 +1,291 @@
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import caching
+from marketplace.forms import ProductForm
+from marketplace.snapshots import CategorySnapshot, FlatPageSnapshot, GameSnapshot, ProductSnapshot
+from marketplace.models import (
+    Category, Filter, FilterOption, FlatPage, Game, GameCategory, Order, Product, StockItem,
+)
+
+
+class CacheNamespaceTests(TestCase):
+    """Cached objects are invalidated through generations, not hand-built keys"""
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username="cacheseller", password="testpass")
+        self.game = Game.objects.create(title="Cache Game")
+        self.category = Category.objects.create(name="Cache Keys")
+        self.product = Product.objects.create(
+            seller=self.seller, game=self.game, category=self.category,
+            listing_title="Cache listing title", description="Cache listing description",
+            price=Decimal("10.00"), stock=5,
+        )
+
+    def cache_product(self):
+        product = Product.objects.with_full_details().with_buyer_price().get(pk=self.product.pk)
+        return caching.PRODUCT_DETAIL.set(ProductSnapshot.from_product(product), self.product.pk)
+
+    def test_product_page_depends_on_product_seller_and_game(self):
+        """Saving any dependency makes the cached page a miss"""
+        for touch in (self.product.save, self.seller.profile.save, self.game.save):
+            self.cache_product()
+            self.assertIsNotNone(caching.PRODUCT_DETAIL.get(self.product.pk))
+            touch()
+            self.assertIsNone(caching.PRODUCT_DETAIL.get(self.product.pk))
+
+        # Unrelated writes leave it alone
+        self.cache_product()
+        Game.objects.create(title="Another Cache Game")
+        self.assertIsNotNone(caching.PRODUCT_DETAIL.get(self.product.pk))
+
+    def test_queryset_updates_and_deletes_invalidate(self):
+        """Stock depletion and deleting a listing both drop the product page"""
+        self.cache_product()
+        StockItem.objects.import_codes(self.product, ["CODE-1"])
+        self.assertIsNone(caching.PRODUCT_DETAIL.get(self.product.pk))
+
+        self.cache_product()
+        items = StockItem.objects.claim(self.product, 1)
+        StockItem.objects.deliver(items, order=None)
+        self.assertIsNone(caching.PRODUCT_DETAIL.get(self.product.pk))
+
+        self.cache_product()
+        self.product.delete()
+        self.assertIsNone(caching.PRODUCT_DETAIL.get(self.product.pk))
+
+    def test_evicted_generation_is_a_miss(self):
+        """Losing a generation token can never resurrect an old entry"""
+        caching.REVIEW_STATS.set({"average_rating": 5, "review_count": 1}, self.seller.id)
+        cache.delete(f"gen:reviews:{self.seller.id}")
+        self.assertIsNone(caching.REVIEW_STATS.get(self.seller.id))
+
+    def test_collection_caches_follow_any_game(self):
+        """The home page list is rebuilt when a game or its categories change"""
+        self.assertContains(self.client.get(reverse("home")), "Cache Game")
+        Game.objects.create(title="Fresh Cache Game")
+        self.assertContains(self.client.get(reverse("home")), "Fresh Cache Game")
+
+        GameCategory.objects.create(game=self.game, category=self.category)
+        response = self.client.get(reverse("game_detail", args=[self.game.pk]))
+        self.assertEqual([category.pk for category in response.context["categories"]], [self.category.pk])
+
+    def test_registry_documents_every_namespace(self):
+        """Namespaces are declared once, each with a description"""
+        self.assertIn("product_detail", caching.NAMESPACES)
+        self.assertTrue(all(namespace.description for namespace in caching.NAMESPACES.values()))
+        with self.assertRaises(ValueError):
+            caching.register("product_detail", 60, lambda value: [], "Duplicate")
+
+
+class LocalTierTests(TestCase):
+    """Catalog namespaces are served from a per-process LRU kept coherent by the catalog version"""
+
+    def setUp(self):
+        caching.flush_tier_stats()
+        caching.local_tier.clear()
+        cache.clear()
+        self.game = Game.objects.create(title="Local Game")
+        self.category = Category.objects.create(name="Local Accounts")
+        self.link = GameCategory.objects.create(game=self.game, category=self.category)
+        self.platform = Filter.objects.create(internal_name="Local Platform", name="Platform")
+        FilterOption.objects.create(filter=self.platform, value="PC")
+        self.link.filters.add(self.platform)
+
+    def test_repeat_reads_skip_the_shared_cache(self):
+        """Within a request scope a local hit costs no shared-cache round trip"""
+        game = GameSnapshot.from_game(self.game)
+        caching.GAME_DETAIL.set({"game": game, "categories": (CategorySnapshot.from_category(self.category),)}, self.game.pk)
+        with caching.request_scope():
+            caching.GAME_DETAIL.get(self.game.pk)
+            with patch.object(caching.cache, "get", side_effect=AssertionError("shared read")):
+                self.assertEqual(caching.GAME_DETAIL.get(self.game.pk)["game"], game)
+
+        stats = caching.tier_stats()["game_detail"]
+        self.assertEqual(stats["local"]["hits"], 2)
+        self.assertEqual(stats["local"]["ratio"], 1.0)
+        self.assertNotIn("local", caching.tier_stats()["product_detail"])
+
+    def test_catalog_writes_drop_local_entries_everywhere(self):
+        """Any catalog bump moves the shared version, so stale local objects are never served"""
+        self.assertEqual(len(self.link.filter_tree()), 1)
+        FilterOption.objects.create(filter=self.platform, value="Console")
+        self.assertEqual(sorted(o.value for o in self.link.filter_tree()[0].options), ["Console", "PC"])
+
+        # A bump made by another worker only reaches this one through the version key
+        page = FlatPage.objects.create(title="Rules", slug="rules", content="Old")
+        caching.FLAT_PAGE.set(FlatPageSnapshot.from_page(page), "rules")
+        FlatPage.objects.filter(slug="rules").update(content="New")
+        cache.set(caching.CATALOG_VERSION_KEY, "moved", None)
+        cache.delete(caching.FLAT_PAGE.key("rules"))
+        self.assertIsNone(caching.FLAT_PAGE.get("rules"))
+        self.assertContains(self.client.get(reverse("flat_page", args=["rules"])), "New")
+
+    def test_lru_is_bounded_and_entries_expire(self):
+        """The local tier evicts least recently used entries and honours its TTL"""
+        tier = caching.LocalTier(max_entries=2)
+        tier.set("a", 1, "v1", 60)
+        tier.set("b", 2, "v1", 60)
+        tier.get("a", "v1")
+        tier.set("c", 3, "v1", 60)
+        self.assertEqual(len(tier), 2)
+        self.assertIs(tier.get("b", "v1"), caching._MISSING)
+        self.assertEqual(tier.get("a", "v1"), 1)
+        self.assertIs(tier.get("a", "v2"), caching._MISSING)
+
+        with patch("marketplace.caching.time.monotonic", return_value=10 ** 9):
+            self.assertIs(tier.get("c", "v1"), caching._MISSING)
+
+    def test_product_form_renders_filters_from_cache(self):
+        """Filter choices come from the cached tree; only a submitted value is checked in the database"""
+        self.link.filter_tree()
+        with self.assertNumQueries(0):
+            form = ProductForm(game_category_link=self.link)
+            html = str(form[f"filter_{self.platform.pk}"])
+        self.assertIn(">PC<", html)
+
+    def test_local_namespaces_only_accept_catalog_tags(self):
+        """Values that depend on per-user entities cannot be kept in the local tier"""
+        namespace = caching.Namespace("local_probe", 60, lambda value: [("user", 1)], "Probe", local_timeout=30)
+        with self.assertRaises(ValueError):
+            namespace.set("value")
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class StampedeProtectionTests(TestCase):
+    """get_or_set rebuilds each entry once at a time and can serve the old value meanwhile"""
+
+    def setUp(self):
+        cache.clear()
+        self.namespace = caching.Namespace(
+            "stampede_probe", 60, lambda seller_id, value: [("reviews", seller_id)], "Probe", stale_ttl=60,
+        )
+        self.builds = []
+
+    def compute(self, value):
+        def build():
+            self.builds.append(value)
+            return value
+        return build
+
+    def test_expired_entry_is_served_while_it_refreshes(self):
+        """Past its TTL the old value is returned once more and rebuilt behind it"""
+        self.namespace.set("old", 1)
+        later = caching.time.time() + 90
+        with patch("marketplace.caching.time.time", return_value=later):
+            self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("new")), "old")
+            self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("newer")), "new")
+        self.assertEqual(self.builds, ["new"])
+
+    def test_hot_entries_refresh_early(self):
+        """Slow-to-build entries near expiry are occasionally rebuilt before they expire"""
+        self.namespace.set("old", 1, delta=5.0)
+        with patch("marketplace.caching.random.random", return_value=0.0):
+            self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("new")), "old")
+        self.assertEqual(self.builds, [])
+        with patch("marketplace.caching.random.random", return_value=0.999999):
+            self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("new")), "old")
+        self.assertEqual(self.builds, ["new"])
+
+    def test_invalidated_entry_is_rebuilt_once(self):
+        """While one worker rebuilds an invalidated entry the others get the previous value"""
+        self.namespace.set("old", 1)
+        caching.bump("reviews", 1)
+        self.assertTrue(caching._acquire(self.namespace.key(1)))
+        self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("new")), "old")
+        self.assertEqual(self.builds, [])
+
+        caching._release(self.namespace.key(1))
+        self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("new")), "new")
+        self.assertEqual(self.builds, ["new"])
+        self.assertIsNone(cache.get(caching._lock_key(self.namespace.key(1))))
+
+    def test_missing_entry_waits_for_the_lock_holder(self):
+        """A reader that loses the race uses the winner's value instead of building its own"""
+        key = self.namespace.key(1)
+        caching._acquire(key)
+
+        def winner_finishes(seconds):
+            self.namespace.set("built elsewhere", 1)
+            caching._release(key)
+
+        with patch("marketplace.caching.time.sleep", side_effect=winner_finishes):
+            self.assertEqual(self.namespace.get_or_set(1, compute=self.compute("mine")), "built elsewhere")
+        self.assertEqual(self.builds, [])
+
+    def test_failed_build_releases_the_lock(self):
+        """An exception while building propagates and does not leave the key locked"""
+        def fail():
+            raise RuntimeError("database down")
+
+        with self.assertRaises(RuntimeError):
+            self.namespace.get_or_set(1, compute=fail)
+        self.assertIsNone(cache.get(caching._lock_key(self.namespace.key(1))))
+
+
+class WarmCachesTests(TestCase):
+    """warm_caches fills the page caches for the busiest games, listings, sellers and flat pages"""
+
+    def setUp(self):
+        caching.local_tier.clear()
+        cache.clear()
+        self.seller = User.objects.create_user(username="warmseller", password="testpass")
+        buyer = User.objects.create_user(username="warmbuyer", password="testpass")
+        self.game = Game.objects.create(title="Warm Game")
+        self.category = Category.objects.create(name="Warm Items")
+        self.link = GameCategory.objects.create(game=self.game, category=self.category)
+        self.product = Product.objects.create(
+            seller=self.seller, game=self.game, category=self.category,
+            listing_title="Warm listing title", description="Warm listing description",
+            price=Decimal("10.00"), stock=5,
+        )
+        Order.objects.create(
+            buyer=buyer, seller=self.seller, product=self.product, total_price=Decimal("10.00"),
+            status="COMPLETED", listing_title_snapshot=self.product.listing_title,
+            game_snapshot=self.game, category_snapshot=self.category,
+        )
+        FlatPage.objects.create(title="Rules", slug="rules", content="Be nice")
+
+    def warm(self, *args):
+        out = StringIO()
+        call_command("warm_caches", "--workers", "1", *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_warmed_entries_are_served_from_cache(self):
+        """After warming, visitors get every ranked page from the cache"""
+        output = self.warm()
+        self.assertIn("Warmed 8 entries (0 already warm, 0 failed)", output)
+        self.assertIsNotNone(caching.HOME_GAMES.get())
+        self.assertIsNotNone(caching.GAME_DETAIL.get(self.game.pk))
+        self.assertIsNotNone(caching.GAME_CATEGORY.get(self.game.pk, self.category.pk))
+        self.assertIsNotNone(caching.CATEGORY_FILTERS.get(self.link.pk))
+        self.assertEqual(caching.PRODUCT_DETAIL.get(self.product.pk).listing_title, "Warm listing title")
+        self.assertEqual(caching.REVIEW_STATS.get(self.seller.pk)["review_count"], 0)
+        self.assertEqual(caching.FLAT_PAGE.get("rules").content, "Be nice")
+
+        caching.local_tier.clear()
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse("game_detail", args=[self.game.pk])), "Warm Items")
+
+    def test_fresh_entries_are_skipped_unless_forced(self):
+        """A second run only rebuilds what is missing; --force rebuilds everything"""
+        self.warm()
+        caching.bump("product", self.product.pk)
+        self.assertIn("Warmed 1 entries (7 already warm, 0 failed)", self.warm())
+        self.assertIn("Warmed 8 entries (0 already warm, 0 failed)", self.warm("--force"))
+
+    def test_entry_being_built_elsewhere_is_left_alone(self):
+        """Warming never races a worker that holds the rebuild lock"""
+        key = caching.FLAT_PAGE.key("rules")
+        caching._acquire(key)
+        self.assertFalse(caching.FLAT_PAGE.warm("rules", compute=lambda: "built twice"))
+        caching._release(key)
+        self.assertIsNone(caching.FLAT_PAGE.get("rules"))
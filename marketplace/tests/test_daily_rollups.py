@@ -0,0 +1,90 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace.models import DailyMarketplaceStats, Order, RollupWatermark
+from marketplace.tests.helpers import OrderFixtures
+
+
+class DailyRollupTests(OrderFixtures, TestCase):
+    """Daily marketplace rollups are built incrementally and feed the admin dashboard"""
+
+    category_fields = {"commission_rate": Decimal("5.00")}
+    order_fields = {"total_price": Decimal("100.00"), "status": "COMPLETED"}
+
+    def create_order(self, days_ago=0, **fields):
+        order = super().create_order(**fields)
+        if days_ago:
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def test_refresh_groups_orders_listings_and_users_by_day(self):
+        """Commission follows commission_paid, then seller_amount, then the effective rate"""
+        self.create_order(commission_paid=Decimal("12.00"))
+        self.create_order(seller_amount=Decimal("90.00"))
+        self.create_order()
+        self.create_order(status="REFUNDED")
+        self.create_order(status="PROCESSING", days_ago=3)
+
+        self.assertIsNone(DailyMarketplaceStats.objects.refresh())
+        today = timezone.localdate()
+        row = DailyMarketplaceStats.objects.get(day=today, game=self.game, category=self.category)
+        self.assertEqual((row.orders, row.completed_orders, row.refunded_orders), (4, 3, 1))
+        self.assertEqual(row.gmv, Decimal("300.00"))
+        self.assertEqual(row.commission, Decimal("27.00"))
+        self.assertEqual(row.refunds, Decimal("100.00"))
+        self.assertEqual(row.new_listings, 1)
+
+        site_row = DailyMarketplaceStats.objects.get(day=today, game=None, category=None)
+        self.assertEqual(site_row.new_users, 2)
+
+        totals = DailyMarketplaceStats.objects.totals(since=today)
+        self.assertEqual(totals["orders"], 5)
+        self.assertEqual(totals["orders_recent"], 4)
+        series = DailyMarketplaceStats.objects.series(today - timedelta(days=4), today)
+        self.assertEqual([day["orders"] for day in series], [0, 1, 0, 0, 4])
+
+    def test_refresh_only_rewrites_touched_days(self):
+        """Days with no changes since the watermark are left alone"""
+        old_order = self.create_order(status="PROCESSING", days_ago=5)
+        self.create_order(days_ago=2)
+        DailyMarketplaceStats.objects.refresh()
+        untouched_day = timezone.localdate() - timedelta(days=2)
+        DailyMarketplaceStats.objects.filter(day=untouched_day).update(orders=99)
+
+        later = timezone.now() + timedelta(hours=1)
+        RollupWatermark.objects.update(value=later)
+        Order.objects.filter(pk=old_order.pk).update(status="COMPLETED", updated_at=later)
+
+        days = DailyMarketplaceStats.objects.refresh(now=later)
+        self.assertEqual(days, {timezone.localdate() - timedelta(days=5)})
+        old_row = DailyMarketplaceStats.objects.get(day=timezone.localdate() - timedelta(days=5))
+        self.assertEqual((old_row.completed_orders, old_row.gmv), (1, Decimal("100.00")))
+        self.assertEqual(DailyMarketplaceStats.objects.get(day=untouched_day).orders, 99)
+
+        out = StringIO()
+        call_command("build_daily_rollups", "--rebuild", stdout=out)
+        self.assertIn("every day", out.getvalue())
+        self.assertEqual(DailyMarketplaceStats.objects.get(day=untouched_day).orders, 1)
+
+    def test_dashboard_reads_rollups(self):
+        """The admin index shows rollup totals and a chart over the requested range"""
+        self.create_order(commission_paid=Decimal("7.50"))
+        DailyMarketplaceStats.objects.refresh()
+        admin_user = User.objects.create_superuser(username="rollupadmin", password="testpass")
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse("admin:index"), {"stats_days": "7"})
+        self.assertEqual(response.status_code, 200)
+        financial = {metric["label"]: metric["value"] for metric in response.context["metric_groups"]["financial"]}
+        self.assertEqual(financial["Total revenue"], Decimal("100.00"))
+        self.assertEqual(financial["Total profit"], Decimal("7.50"))
+        self.assertEqual(len(response.context["charts"][0]["bars"]), 7)
+        self.assertEqual(response.context["charts"][1]["bars"][-1]["height"], 100)
+        self.assertContains(response, "Revenue per day")
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import warnings
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace.models import Category, Game, Order, Product, Transaction
+
+
+def read_csv(response):
+    return list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+
+
+class StatementExportTests(TestCase):
+    """Statements stream as CSV or JSON with running totals"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="exportuser", password="testpass")
+        self.buyer = User.objects.create_user(username="exportbuyer", password="testpass")
+        self.client.force_login(self.user)
+
+    def add_transaction(self, amount, days_ago, status="COMPLETED"):
+        tx = Transaction.objects.create(
+            user=self.user, amount=Decimal(amount), transaction_type="DEPOSIT",
+            status=status, description=f"Deposit {amount}",
+        )
+        Transaction.objects.filter(pk=tx.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return tx
+
+    def test_transactions_csv_carries_running_balance(self):
+        """The balance column starts from the balance before the range"""
+        self.add_transaction("100.00", 10)
+        self.add_transaction("50.00", 3)
+        self.add_transaction("999.00", 2, status="PENDING")
+        self.add_transaction("-20.00", 1)
+
+        start = (timezone.localdate() - timedelta(days=5)).isoformat()
+        response = self.client.get(reverse("export_transactions"), {"from": start})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment;", response["Content-Disposition"])
+
+        rows = read_csv(response)
+        self.assertEqual([row["amount"] for row in rows], ["50.00", "999.00", "-20.00"])
+        self.assertEqual([row["balance"] for row in rows], ["150.00", "150.00", "130.00"])
+
+    def test_sales_json_tracks_net_earnings(self):
+        """Sales exports list buyers and skip void orders in the running total"""
+        product = Product.objects.create(
+            seller=self.user, game=Game.objects.create(title="Export Game"),
+            category=Category.objects.create(name="Export Keys"),
+            listing_title="Export listing title", description="Export listing description",
+            price=Decimal("100.00"), stock=5,
+        )
+        for status, commission in [("COMPLETED", Decimal("10.00")), ("CANCELLED", None), ("PROCESSING", None)]:
+            Order.objects.create(
+                buyer=self.buyer, seller=self.user, product=product, total_price=Decimal("110.00"),
+                status=status, commission_paid=commission, listing_title_snapshot=product.listing_title,
+            )
+
+        response = self.client.get(reverse("export_sales"), {"format": "json"})
+        self.assertEqual(response["Content-Type"], "application/json")
+        rows = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([row["buyer"] for row in rows], ["exportbuyer"] * 3)
+        self.assertEqual([row["running_net"] for row in rows], ["100.00", "100.00", "210.00"])
+
+        response = self.client.get(reverse("export_purchases"))
+        self.assertEqual(read_csv(response), [])
+
+    def test_invalid_requests_and_staff_exports(self):
+        """Bad parameters are rejected; only staff may export another user"""
+        self.assertEqual(self.client.get(reverse("export_transactions"), {"from": "2025-13-01"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("export_transactions"), {"format": "xml"}).status_code, 400)
+        self.add_transaction("5.00", 1)
+
+        self.client.force_login(self.buyer)
+        rows = read_csv(self.client.get(reverse("export_transactions"), {"user": "exportuser"}))
+        self.assertEqual(rows, [])
+
+        self.buyer.is_staff = True
+        self.buyer.save()
+        rows = read_csv(self.client.get(reverse("export_transactions"), {"user": "exportuser"}))
+        self.assertEqual([row["balance"] for row in rows], ["5.00"])
+
+    def test_csv_neutralises_formulas(self):
+        """Text from other users that a spreadsheet would evaluate is exported as text"""
+        seller = User.objects.create_user(username="@formulaseller", password="testpass")
+        product = Product.objects.create(
+            seller=seller, game=Game.objects.create(title="Formula Game"),
+            category=Category.objects.create(name="Formula Keys"),
+            listing_title="Formula listing title", description="Formula listing description",
+            price=Decimal("100.00"), stock=5,
+        )
+        Order.objects.create(
+            buyer=self.user, seller=seller, product=product, total_price=Decimal("110.00"), status="COMPLETED",
+            listing_title_snapshot='=HYPERLINK("http://example.com","Click")',
+        )
+        self.add_transaction("-20.00", 1)
+
+        rows = read_csv(self.client.get(reverse("export_purchases")))
+        self.assertEqual(rows[0]["title"], '\'=HYPERLINK("http://example.com","Click")')
+        self.assertEqual(rows[0]["seller"], "'@formulaseller")
+        self.assertEqual(read_csv(self.client.get(reverse("export_transactions")))[0]["amount"], "-20.00")
+
+    async def test_asgi_exports_stream_asynchronously(self):
+        """Under ASGI the statement is an async iterator, served without collecting it first"""
+        await self.async_client.aforce_login(self.user)
+        for amount in ("100.00", "-20.00"):
+            await Transaction.objects.acreate(
+                user=self.user, amount=Decimal(amount), transaction_type="DEPOSIT", status="COMPLETED",
+            )
+
+        response = await self.async_client.get(reverse("export_transactions"))
+        self.assertTrue(response.is_async)
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        with warnings.catch_warnings():
+            # Django warns whenever it has to buffer a sync iterator for an async server
+            warnings.simplefilter("error")
+            await ASGIHandler().send_response(response, send)
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual([row["balance"] for row in rows], ["100.00", "80.00"])
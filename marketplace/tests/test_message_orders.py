@@ -0,0 +1,84 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from marketplace.models import Conversation, Message, StockItem
+from marketplace.tests.helpers import OrderFixtures
+
+
+@override_settings(ORDER_EVENTS_ASYNC=False)
+class MessageOrderLinkTests(OrderFixtures, TestCase):
+    """Delivery and system messages point at their order"""
+
+    product_fields = {
+        "automatic_delivery": True,
+        "stock": None,
+        "stock_details": "KEY-1\nKEY-2\nKEY-3",
+        "post_purchase_message": "Enjoy the game!",
+    }
+    order_fields = {"seller_amount": Decimal("100.00")}
+
+    def setUp(self):
+        super().setUp()
+        p1, p2 = sorted((self.buyer.id, self.seller.id))
+        self.conversation = Conversation.objects.create(participant1_id=p1, participant2_id=p2)
+
+    def test_order_detail_reads_linked_delivery_message(self):
+        """Each order shows its own codes, however many orders the pair has"""
+        orders = []
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                order = self.create_order()
+                StockItem.objects.deliver(StockItem.objects.claim(self.product, 1), order)
+            orders.append(order)
+
+        self.assertEqual(orders[0].chat_messages.get(is_system_message=False).content, "KEY-1")
+        self.assertIn(orders[0].order_id, orders[0].chat_messages.get(is_system_message=True).content)
+        self.assertFalse(Message.objects.filter(content="Enjoy the game!", order__isnull=False).exists())
+
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse("order_detail", args=[orders[1].clean_order_id]))
+        self.assertEqual(response.context["delivery_message"].content, "KEY-2")
+
+    def test_order_detail_shows_codes_before_the_message(self):
+        """Codes delivered with the order show on its page before the event pipeline has run"""
+        order = self.create_order()
+        StockItem.objects.deliver(StockItem.objects.claim(self.product, 2), order)
+        self.assertFalse(order.chat_messages.exists())
+
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse("order_detail", args=[order.clean_order_id]))
+        self.assertIsNone(response.context["delivery_message"])
+        self.assertEqual(response.context["delivered_codes"], "KEY-1\nKEY-2")
+        self.assertContains(response, "AUTOMATED DELIVERY")
+
+    def test_backfill_links_legacy_messages(self):
+        """Historical notices are matched by order ID and deliveries by position"""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.create_order()
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.create_order()
+        for code in ["OLD-1", "OLD-2"]:
+            Message.objects.create(
+                conversation=self.conversation, sender=self.seller, content=code, is_auto_reply=True
+            )
+        # Messages written before the column existed
+        Message.objects.update(order=None)
+
+        out = StringIO()
+        call_command("backfill_message_orders", "--dry-run", stdout=out)
+        self.assertIn("Would link 2 system messages and 2 delivery messages", out.getvalue())
+        self.assertFalse(Message.objects.filter(order__isnull=False).exists())
+
+        call_command("backfill_message_orders", stdout=StringIO())
+        self.assertEqual(first.chat_messages.get(is_system_message=False).content, "OLD-1")
+        self.assertEqual(second.chat_messages.get(is_system_message=False).content, "OLD-2")
+        self.assertTrue(second.chat_messages.filter(is_system_message=True).exists())
+        self.assertFalse(Message.objects.filter(content="Enjoy the game!", order__isnull=False).exists())
+
+        out = StringIO()
+        call_command("backfill_message_orders", stdout=out)
+        self.assertIn("Linked 0 system messages and 0 delivery messages", out.getvalue())
@@ -0,0 +1,96 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from marketplace import order_events
+from marketplace.models import Message, OrderEvent, Transaction
+from marketplace.tests.helpers import OrderFixtures
+
+
+@override_settings(ORDER_EVENTS_ASYNC=False)
+class OrderEventPipelineTests(OrderFixtures, TestCase):
+    """Order side effects run after commit, from the OrderEvent outbox"""
+
+    product_fields = {"price": Decimal("400.00"), "stock": 5, "post_purchase_message": "Thanks for buying!"}
+    order_fields = {
+        "total_price": Decimal("440.00"),
+        "seller_amount": Decimal("400.00"),
+        "amount_paid_from_balance": Decimal("440.00"),
+    }
+
+    def test_ledger_commits_with_order_and_messages_follow_commit(self):
+        """Nothing user-facing is written inside the order transaction"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = self.create_order()
+            self.assertEqual(Transaction.objects.filter(order=order).count(), 2)
+            self.assertFalse(Message.objects.exists())
+            self.assertEqual(order.events.get().event_type, OrderEvent.EVENT_CREATED)
+
+        for callback in callbacks:
+            callback()
+
+        event = order.events.get()
+        self.assertIsNotNone(event.processed_at)
+        messages = list(Message.objects.order_by("id").values_list("is_system_message", "content"))
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0][0])
+        self.assertIn("has paid for order", messages[0][1])
+        self.assertEqual(messages[1], (False, "Thanks for buying!"))
+
+    def test_status_change_sends_notice_after_commit(self):
+        """Completing an order posts the confirmation notice through the pipeline"""
+        with self.captureOnCommitCallbacks(execute=True):
+            order = self.create_order()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = "COMPLETED"
+            order.save()
+
+        event = order.events.get(event_type=OrderEvent.EVENT_STATUS_CHANGED)
+        self.assertEqual((event.previous_status, event.status), ("PROCESSING", "COMPLETED"))
+        self.assertIsNotNone(event.processed_at)
+        self.assertTrue(
+            Message.objects.filter(is_system_message=True, content__contains="has been fulfilled").exists()
+        )
+
+    def test_failed_events_are_retried_by_the_sweeper(self):
+        """A handler failure leaves the event pending for process_order_events"""
+        with mock.patch.dict(order_events.HANDLERS, {"created": mock.Mock(side_effect=RuntimeError("boom"))}):
+            with self.captureOnCommitCallbacks(execute=True):
+                order = self.create_order()
+
+        event = order.events.get()
+        self.assertIsNone(event.processed_at)
+        self.assertIsNone(event.claimed_at)
+        self.assertEqual((event.attempts, event.last_error), (1, "boom"))
+        self.assertFalse(Message.objects.exists())
+
+        out = StringIO()
+        call_command("process_order_events", "--stale-after", "0", stdout=out)
+        self.assertIn("Processed 1 order events", out.getvalue())
+        event.refresh_from_db()
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual(Message.objects.count(), 2)
+
+        # Processed events are never run twice
+        self.assertFalse(order_events.process_event(event.pk))
+
+    def test_channel_layer_outage_keeps_messages(self):
+        """Notifications go out after commit; a failing send is logged and the event still completes"""
+        def unavailable(send):
+            return mock.Mock(side_effect=ConnectionError("channel layer down"))
+
+        with mock.patch("asgiref.sync.async_to_sync", unavailable), \
+                mock.patch("marketplace.signals.async_to_sync", unavailable), \
+                self.assertLogs("marketplace", "ERROR") as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            order = self.create_order()
+
+        event = order.events.get()
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertTrue(any("Could not notify user" in line for line in logs.output))
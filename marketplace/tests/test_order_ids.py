@@ -0,0 +1,61 @@
+import re
+from unittest import mock
+
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from marketplace import models as marketplace_models
+from marketplace.models import Order, generate_unique_order_id
+from marketplace.tests.helpers import OrderFixtures
+
+ORDER_ID_RE = re.compile(r"^#[0-9A-HJKMNP-TV-Z]{4}-[0-9A-HJKMNP-TV-Z]{4}-[0-9A-HJKMNP-TV-Z]{4}$")
+
+
+class OrderIdTests(OrderFixtures, TestCase):
+    """Order IDs are time-ordered and only the unique index guards against clashes"""
+
+    order_fields = {"status": "PENDING_PAYMENT"}
+
+    def test_ids_keep_display_format_and_sort_by_time(self):
+        """Later milliseconds compare greater; the last 4 characters are random bits"""
+        with mock.patch("time.time", side_effect=[1760000000.0, 1760000000.0, 1760000000.5]), \
+                mock.patch("secrets.randbits", side_effect=[0xFFFFF, 0, 0]) as randbits:
+            ids = [generate_unique_order_id() for _ in range(3)]
+        randbits.assert_called_with(20)
+        for order_id in ids:
+            self.assertRegex(order_id, ORDER_ID_RE)
+        self.assertEqual(ids[0][:10], ids[1][:10])
+        self.assertEqual((ids[0][11:], ids[1][11:]), ("ZZZZ", "0000"))
+        self.assertLess(max(ids[:2]), ids[2])
+
+    def test_insert_runs_no_existence_query(self):
+        """Creating an order does not look its order_id up first"""
+        with CaptureQueriesContext(connection) as queries:
+            order = self.create_order()
+        self.assertRegex(order.order_id, ORDER_ID_RE)
+        lookups = [
+            q["sql"] for q in queries.captured_queries
+            if q["sql"].startswith("SELECT") and '"marketplace_order"."order_id" =' in q["sql"]
+        ]
+        self.assertEqual(lookups, [])
+
+    def test_clash_retries_with_a_new_id(self):
+        """A duplicate order_id is caught by the unique index and regenerated"""
+        existing = self.create_order()
+        with mock.patch.object(
+            marketplace_models, "generate_unique_order_id",
+            side_effect=[existing.order_id, "#0000-0000-0001"],
+        ):
+            with transaction.atomic():
+                order = self.create_order()
+        self.assertEqual(order.order_id, "#0000-0000-0001")
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_other_integrity_errors_are_not_retried(self):
+        """Errors unrelated to order_id propagate after a single attempt"""
+        generator = mock.Mock(wraps=generate_unique_order_id)
+        with mock.patch.object(marketplace_models, "generate_unique_order_id", generator):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                self.create_order(total_price=None)
+        self.assertEqual(generator.call_count, 1)
@@ -0,0 +1,138 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace.models import Category, Game, Order, Product, Transaction, UserOrderCount
+from marketplace.pagination import decode_cursor, keyset_paginate
+
+AJAX = {"HTTP_X_REQUESTED_WITH": "XMLHttpRequest"}
+
+
+class OrderListTests(TestCase):
+    """Purchases, sales and transactions page by cursor and count from rollups"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user(username="listbuyer", password="testpass")
+        self.seller = User.objects.create_user(username="ListSeller", password="testpass")
+        self.other_seller = User.objects.create_user(username="listsellertwo", password="testpass")
+        self.game = Game.objects.create(title="List Game")
+        self.category = Category.objects.create(name="List Accounts")
+
+    def create_orders(self, count, seller=None, status="COMPLETED"):
+        seller = seller or self.seller
+        product = Product.objects.create(
+            seller=seller, game=self.game, category=self.category,
+            listing_title="Paged listing title", description="Paged listing description",
+            price=Decimal("10.00"), stock=count,
+        )
+        orders = [
+            Order.objects.create(
+                buyer=self.buyer, seller=seller, product=product, total_price=Decimal("11.00"),
+                status=status, listing_title_snapshot=product.listing_title,
+                game_snapshot=self.game, category_snapshot=self.category,
+            )
+            for _ in range(count)
+        ]
+        # Several orders share a timestamp so the id tiebreak is exercised
+        Order.objects.filter(pk__in=[order.pk for order in orders[:4]]).update(created_at=timezone.now())
+        return orders
+
+    def test_keyset_pages_cover_every_row_once(self):
+        """Walking cursors returns each order exactly once, newest first"""
+        self.create_orders(7)
+        expected = list(Order.objects.order_by("-created_at", "-id").values_list("pk", flat=True))
+
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(Order.objects.all(), cursor, per_page=3)
+            seen.extend(order.pk for order in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertIsNone(decode_cursor("not-a-cursor"))
+
+    def test_purchases_view_and_ajax_share_filters(self):
+        """The page and its "show more" requests are one view with one filter path"""
+        self.create_orders(30)
+        self.create_orders(2, seller=self.other_seller)
+        self.client.force_login(self.buyer)
+        url = reverse("my_purchases")
+
+        response = self.client.get(url, {"seller_name": "listseller"})
+        page = response.context["orders"]
+        self.assertEqual(len(page), 25)
+        self.assertIsNone(response.context["total_orders"])
+
+        with self.assertNumQueries(6):
+            # session, user, exact + case-insensitive seller lookup, page rows, filter-option prefetch
+            more = self.client.get(url, {"seller_name": "listseller", "cursor": page.next_cursor}, **AJAX).json()
+        self.assertFalse(more["has_next"])
+        self.assertEqual(more["html"].count('class="purchase-row'), 5)
+
+        order = Order.objects.filter(seller=self.other_seller).first()
+        response = self.client.get(url, {"order_number": order.clean_order_id.lower()})
+        self.assertEqual([o.pk for o in response.context["orders"]], [order.pk])
+
+    def test_totals_come_from_rollup(self):
+        """Counts follow creates, status changes and deletes without COUNT queries"""
+        orders = self.create_orders(3, status="PROCESSING")
+        orders[0].status = "COMPLETED"
+        orders[0].save()
+        orders[1].delete()
+
+        counts = UserOrderCount.objects.counts_for(self.seller.id)
+        self.assertEqual(counts[(UserOrderCount.ROLE_SELLER, "PROCESSING")], 1)
+        self.assertEqual(counts[(UserOrderCount.ROLE_SELLER, "COMPLETED")], 1)
+
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse("my_sales"), {"status": "PROCESSING"})
+        self.assertEqual(response.context["total_orders"], 1)
+        self.assertEqual(response.context["active_sales_count"], 1)
+
+        # A rebuild from the orders table agrees with the maintained counters
+        UserOrderCount.objects.rebuild([self.seller.id, self.buyer.id])
+        self.assertEqual(UserOrderCount.objects.counts_for(self.seller.id), counts)
+
+    def test_new_status_row_is_seeded_not_recounted(self):
+        """A user's first order in a status inserts that row and leaves the others alone"""
+        self.create_orders(2, status="COMPLETED")
+        # Stand-in for increments a concurrent order write has made but not committed
+        UserOrderCount.objects.filter(user=self.seller, status="COMPLETED").update(count=5)
+
+        self.create_orders(1, status="PROCESSING")
+        counts = UserOrderCount.objects.counts_for(self.seller.id)
+        self.assertEqual(counts[(UserOrderCount.ROLE_SELLER, "PROCESSING")], 1)
+        self.assertEqual(counts[(UserOrderCount.ROLE_SELLER, "COMPLETED")], 5)
+
+    def test_funds_transactions_page_by_cursor(self):
+        """The funds page serves its own "show more" requests"""
+        for index in range(30):
+            Transaction.objects.create(
+                user=self.buyer, amount=Decimal("1.00"), transaction_type="DEPOSIT",
+                status="COMPLETED", description=f"Deposit {index}",
+            )
+        Transaction.objects.filter(user=self.buyer).update(created_at=timezone.now() - timedelta(days=1))
+        self.client.force_login(self.buyer)
+
+        response = self.client.get(reverse("funds"), {"filter": "deposits"})
+        page = response.context["transactions"]
+        self.assertEqual(len(page), 25)
+        more = self.client.get(reverse("funds"), {"filter": "deposits", "cursor": page.next_cursor}, **AJAX).json()
+        self.assertEqual(more["html"].count('class="transaction-row'), 5)
+        self.assertFalse(more["has_next"])
+
+    def test_benchmark_command_runs(self):
+        """benchmark_order_pages walks both pagination modes"""
+        self.create_orders(3)
+        out = StringIO()
+        call_command("benchmark_order_pages", "listbuyer", "--pages", "2", "--per-page", "2", stdout=out)
+        self.assertIn("keyset", out.getvalue())
@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from marketplace.models import Category, Game, GameCategory, Product, SiteConfiguration, get_default_commission_rate
+
+
+class BuyerPriceAnnotationTests(TestCase):
+    """Listing querysets price every card in SQL with the same priority as the models"""
+
+    def setUp(self):
+        cache.clear()
+        self.config = SiteConfiguration.objects.create(default_commission_rate=Decimal("10.00"))
+        self.game = Game.objects.create(title="Pricing Game")
+        self.category = Category.objects.create(name="Pricing Accounts")
+        self.rated_category = Category.objects.create(name="Pricing Items", commission_rate=Decimal("20.00"))
+        GameCategory.objects.create(game=self.game, category=self.category)
+
+        self.default_seller = User.objects.create_user(username="defaultseller", password="testpass")
+        self.override_seller = User.objects.create_user(username="overrideseller", password="testpass")
+        self.override_seller.profile.commission_rate = Decimal("50.00")
+        self.override_seller.profile.save(update_fields=["commission_rate"])
+
+        # Net 400 at the 50% override costs the buyer more than net 500 at 10%
+        self.cheap_net = self.create_product(self.override_seller, self.category, "400.00")
+        self.dear_net = self.create_product(self.default_seller, self.category, "500.00")
+        self.category_rated = self.create_product(self.default_seller, self.rated_category, "300.00")
+
+    def create_product(self, seller, category, price):
+        return Product.objects.create(
+            seller=seller,
+            game=self.game,
+            category=category,
+            listing_title=f"Pricing listing at {price}",
+            description="Pricing description long enough",
+            price=Decimal(price),
+            stock=5,
+        )
+
+    def test_annotation_matches_python_pricing(self):
+        """Annotated rows agree with the per-object commission lookup"""
+        for product in Product.objects.with_buyer_price():
+            fresh = Product.objects.get(pk=product.pk)
+            self.assertEqual(product.effective_commission_rate, fresh.get_commission_rate())
+            self.assertEqual(product.buyer_price, fresh.buyer_price)
+            self.assertEqual(product.buyer_price_value, fresh.buyer_price)
+
+        rates = dict(Product.objects.with_buyer_price().values_list("pk", "effective_commission_rate"))
+        self.assertEqual(rates[self.cheap_net.pk], Decimal("50.00"))
+        self.assertEqual(rates[self.dear_net.pk], Decimal("10.00"))
+        self.assertEqual(rates[self.category_rated.pk], Decimal("20.00"))
+
+    def test_cards_do_not_query_per_listing(self):
+        """Rendering buyer prices for a page of listings needs no per-row or config queries"""
+        get_default_commission_rate()
+        with CaptureQueriesContext(connection) as queries:
+            products = list(Product.objects.with_buyer_price())
+            [product.buyer_price for product in products]
+            [product.get_buyer_total(3) for product in products]
+        self.assertEqual(len(queries.captured_queries), 1)
+
+    def test_site_default_is_cached_until_saved(self):
+        """Admin changes to the default rate reach the next lookup"""
+        self.assertEqual(get_default_commission_rate(), Decimal("10.00"))
+        with self.assertNumQueries(0):
+            get_default_commission_rate()
+
+        self.config.default_commission_rate = Decimal("15.00")
+        self.config.save()
+        self.assertEqual(get_default_commission_rate(), Decimal("15.00"))
+        self.assertEqual(Product.objects.get(pk=self.dear_net.pk).buyer_price, Decimal("575.00"))
+
+    def test_price_sort_uses_buyer_price(self):
+        """Sorting by price orders listings by what the buyer pays, not the seller's net"""
+        url = reverse("listing_page", args=[self.game.pk, self.category.pk])
+
+        response = self.client.get(url, {"sort": "price_asc"})
+        self.assertEqual([p.pk for p in response.context["listings"]], [self.dear_net.pk, self.cheap_net.pk])
+
+        response = self.client.get(url, {"sort": "price_desc"})
+        self.assertEqual([p.pk for p in response.context["listings"]], [self.cheap_net.pk, self.dear_net.pk])
@@ -0,0 +1,86 @@
+import json
+from decimal import Decimal
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import caching
+from marketplace.models import Category, Game, GameCategory, Product
+from marketplace.profiling import QueryBudgetMixin, QueryProfilerMiddleware, fingerprint
+
+
+class QueryProfilerTests(QueryBudgetMixin, TestCase):
+    """The opt-in profiler reports per-request query, cache and template cost"""
+
+    def setUp(self):
+        caching.local_tier.clear()
+        cache.clear()
+        self.seller = User.objects.create_user(username="profiledseller", password="testpass")
+        self.game = Game.objects.create(title="Profiled Game")
+        self.category = Category.objects.create(name="Profiled Items")
+        GameCategory.objects.create(game=self.game, category=self.category)
+        for i in range(3):
+            Product.objects.create(
+                seller=self.seller, game=self.game, category=self.category,
+                listing_title=f"Profiled listing {i}", description="Profiled listing description",
+                price=Decimal("10.00"), stock=5,
+            )
+
+    def test_fingerprints_ignore_literals(self):
+        """Queries differing only in values share a fingerprint"""
+        self.assertEqual(
+            fingerprint('SELECT * FROM "t" WHERE "id" = 5 AND "name" = \'x\''),
+            fingerprint('SELECT * FROM "t"  WHERE "id" = 61 AND "name" = \'it\'\'s\''),
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM "t" WHERE "id" IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM "t" WHERE "id" IN (%s)'),
+        )
+
+    @override_settings(QUERY_PROFILER_ENABLED=True)
+    def test_server_timing_for_staff_only(self):
+        """Staff responses carry db, cache, template and total timings"""
+        url = reverse("game_detail", args=[self.game.pk])
+        self.assertNotIn("Server-Timing", self.client.get(url))
+
+        staff = User.objects.create_user(username="profiler", password="testpass", is_staff=True)
+        self.client.force_login(staff)
+        timing = self.client.get(url)["Server-Timing"]
+        for metric in ("db;dur=", "queries", "cache;dur=", "tpl;dur=", "total;dur="):
+            self.assertIn(metric, timing)
+
+    @override_settings(QUERY_PROFILER_ENABLED=True, QUERY_PROFILER_SLOW_MS=10 ** 6, QUERY_PROFILER_REPEAT_THRESHOLD=3)
+    def test_repeated_queries_are_logged(self):
+        """A request running one query shape per row is logged with that fingerprint"""
+        def listing_sellers(request):
+            names = [Product.objects.get(pk=product.pk).seller.username for product in Product.objects.all()]
+            return HttpResponse(", ".join(names))
+
+        request = RequestFactory().get("/listings/")
+        request.user = AnonymousUser()
+        middleware = QueryProfilerMiddleware(listing_sellers)
+        with self.assertLogs("marketplace.profiling", "WARNING") as logs:
+            response = middleware(request)
+        self.assertNotIn("Server-Timing", response)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["event_type"], "slow_request")
+        self.assertEqual(entry["queries"], 7)
+        self.assertEqual([shape["count"] for shape in entry["repeated"]], [3, 3])
+
+        with override_settings(QUERY_PROFILER_REPEAT_THRESHOLD=4), self.assertNoLogs("marketplace.profiling"):
+            middleware(request)
+
+    def test_query_budgets(self):
+        """Cached catalog pages and the profile page stay within their query budgets"""
+        self.client.get(reverse("home"))
+        with self.assertQueryBudget(3):
+            self.client.get(reverse("home"))
+        with self.assertQueryBudget(12):
+            self.client.get(reverse("public_profile", args=[self.seller.username]))
+
+        with self.assertRaisesMessage(AssertionError, "budget is 0. Most repeated:"):
+            with self.assertQueryBudget(0):
+                list(Product.objects.filter(pk=1))
@@ -0,0 +1,115 @@
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from marketplace import login_security, rate_limit
+
+
+class SlidingWindowTests(TestCase):
+    """rate_limit.hit allows `limit` actions in any window of `period` seconds"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_window_rejects_over_limit_and_reports_reset(self):
+        """The hit after the limit is rejected with the time until a slot frees"""
+        with patch("marketplace.rate_limit.time.time", return_value=1000.0):
+            results = [rate_limit.hit("probe", "1.2.3.4", 3, 60) for _ in range(4)]
+        self.assertEqual([bool(r) for r in results], [True, True, True, False])
+        self.assertEqual([r.remaining for r in results], [2, 1, 0, 0])
+        self.assertEqual(results[-1].reset_after, 60)
+        self.assertEqual(results[-1].retry_after, 60)
+
+        # Other identifiers have their own window
+        self.assertTrue(rate_limit.hit("probe", "5.6.7.8", 3, 60))
+
+    def test_window_slides_and_rejections_do_not_extend_it(self):
+        """Old hits age out one by one; hammering a full window does not push it back"""
+        for moment in (1000.0, 1020.0, 1040.0):
+            with patch("marketplace.rate_limit.time.time", return_value=moment):
+                rate_limit.hit("probe", "ip", 3, 60)
+        with patch("marketplace.rate_limit.time.time", return_value=1059.0):
+            self.assertFalse(rate_limit.hit("probe", "ip", 3, 60))
+        with patch("marketplace.rate_limit.time.time", return_value=1061.0):
+            allowed = rate_limit.hit("probe", "ip", 3, 60)
+        self.assertTrue(allowed)
+        self.assertEqual(allowed.remaining, 0)
+        self.assertEqual(allowed.reset_after, 19)
+
+    def test_requests_are_limited_per_user_and_address(self):
+        """check() keys logged-in users by id and address, and sets the standard headers"""
+        user = User.objects.create_user(username="limited", password="testpass")
+        request = RequestFactory().post("/", REMOTE_ADDR="10.0.0.1")
+        request.user = user
+        for _ in range(2):
+            self.assertTrue(rate_limit.check(request, "probe", limit=2, period=60))
+        limited = rate_limit.check(request, "probe", limit=2, period=60)
+        self.assertFalse(limited)
+
+        response = limited.add_headers(self.client.get("/"))
+        self.assertEqual(response["X-RateLimit-Remaining"], "0")
+        self.assertEqual(response["Retry-After"], str(limited.retry_after))
+
+        request.user = User.objects.create_user(username="neighbour", password="testpass")
+        self.assertTrue(rate_limit.check(request, "probe", limit=2, period=60))
+
+
+class RedisFailureTests(TestCase):
+    """If Redis fails, limits are kept in this process's memory rather than failing the request"""
+
+    def setUp(self):
+        cache.clear()
+        rate_limit._fallback_cache.clear()
+        # Redis is down: the scripts fail, and so would any call on the shared cache
+        down = Mock(side_effect=ConnectionError("Redis is down"))
+        self.enterContext(patch.object(rate_limit, "_redis_connection", return_value=object()))
+        self.enterContext(patch.object(rate_limit, "_run_script", down))
+        self.enterContext(patch.object(
+            rate_limit, "cache", Mock(make_key=str, get=down, set=down, incr=down, delete=down)
+        ))
+
+    def test_windows_fall_back_to_process_memory(self):
+        """The sliding window keeps limiting, and reset() does not raise"""
+        with self.assertLogs("marketplace.rate_limit", "ERROR"):
+            results = [rate_limit.hit("probe", "1.2.3.4", 2, 60) for _ in range(3)]
+        self.assertEqual([bool(r) for r in results], [True, True, False])
+
+        with self.assertLogs("marketplace.rate_limit", "ERROR"):
+            rate_limit.reset("probe", "1.2.3.4")
+            self.assertTrue(rate_limit.hit("probe", "1.2.3.4", 2, 60))
+
+    def test_counters_fall_back_to_process_memory(self):
+        """Fixed-window counters keep counting, so SecurityMiddleware still enforces budgets"""
+        with self.assertLogs("marketplace.rate_limit", "ERROR"):
+            rate_limit.incr_counters({"requests:{ip}": 1, "api_requests:{ip}": 1}, 3600)
+            counts = rate_limit.incr_counters({"requests:{ip}": 10}, 3600)
+        self.assertEqual(counts, {"requests:{ip}": 11})
+
+
+class LoginLockoutTests(TestCase):
+    """Failed logins fill a sliding window per address and username, then lock"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="lockme", password="testpass")
+
+    def fail(self):
+        request = RequestFactory().post("/accounts/login/", REMOTE_ADDR="10.0.0.9")
+        authenticate(request, username="lockme", password="wrong")
+
+    def test_lockout_after_limit_and_reset_on_login(self):
+        """The limit-th failure locks both keys; a successful login clears the window"""
+        for _ in range(login_security.ATTEMPT_LIMIT - 1):
+            self.fail()
+        self.assertFalse(login_security.is_user_locked("lockme"))
+        self.fail()
+        self.assertTrue(login_security.is_user_locked("lockme"))
+        self.assertTrue(login_security.is_ip_locked("10.0.0.9"))
+
+        cache.delete("login_lock:user:lockme")
+        self.client.login(username="lockme", password="testpass")
+        self.fail()
+        self.assertFalse(login_security.is_user_locked("lockme"))
@@ -0,0 +1,62 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from marketplace import security_middleware
+from marketplace.security_middleware import SecurityMiddleware
+
+
+class SecurityCounterTests(TestCase):
+    """Per-IP request budgets are read and incremented in one counter call per request"""
+
+    def setUp(self):
+        cache.clear()
+        self.middleware = SecurityMiddleware(lambda request: HttpResponse())
+        self.factory = RequestFactory()
+
+    def process(self, path, ip="203.0.113.5", **extra):
+        request = self.factory.get(path, REMOTE_ADDR=ip, **extra)
+        request.user = AnonymousUser()
+        return self.middleware.process_request(request)
+
+    def test_one_counter_call_per_request(self):
+        """Admin, API and general counters move together in a single call"""
+        with patch.object(
+            security_middleware, "incr_counters", wraps=security_middleware.incr_counters
+        ) as counters:
+            self.assertIsNone(self.process("/api/notifications/"))
+        self.assertEqual(counters.call_count, 1)
+        self.assertEqual(cache.get("requests:{203.0.113.5}"), 1)
+        self.assertEqual(cache.get("api_requests:{203.0.113.5}"), 1)
+        self.assertIsNone(cache.get("admin_requests:{203.0.113.5}"))
+
+    def test_budget_exhausted_returns_429(self):
+        """The request after the hourly budget is rejected with rate limit headers"""
+        cache.set("requests:{203.0.113.5}", 5000, 3600)
+        response = self.process("/")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["X-RateLimit-Limit"], "5000")
+        self.assertEqual(response["Retry-After"], "3600")
+        self.assertIsNone(self.process("/", ip="203.0.113.6"))
+
+    def test_suspicious_requests_are_blocked_and_penalised(self):
+        """Any listed pattern in the path or query, or a scanner user agent, costs extra budget"""
+        self.assertEqual(self.process("/media/../../etc/passwd").status_code, 400)
+        self.assertEqual(cache.get("requests:{203.0.113.5}"), 10)
+        self.assertEqual(self.process("/", HTTP_USER_AGENT="sqlmap/1.7").status_code, 400)
+        self.assertEqual(cache.get("requests:{203.0.113.5}"), 30)
+        self.assertIsNone(self.process("/game/1/?q=evaluation"))
+
+    def test_benchmark_reports_percentiles(self):
+        """benchmark_security_middleware prints latency percentiles and enforces a p99 budget"""
+        out = StringIO()
+        call_command("benchmark_security_middleware", "--requests", "200", stdout=out)
+        self.assertIn("p99 us", out.getvalue())
+        self.assertIn("process_request over 200 requests", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("benchmark_security_middleware", "--requests", "50", "--max-p99-us", "0.001", stdout=out)
@@ -0,0 +1,75 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from marketplace import site_config
+from marketplace.models import Category, Game, GameCategory, Product, SiteConfiguration
+
+
+def config_queries(captured):
+    return [q["sql"] for q in captured if "marketplace_siteconfiguration" in q["sql"]]
+
+
+class SiteConfigSnapshotTests(TestCase):
+    """Each worker serves the site configuration from memory until the version moves"""
+
+    def setUp(self):
+        cache.clear()
+        site_config.clear_site_config()
+        self.config = SiteConfiguration.objects.create(default_commission_rate=Decimal("12.00"))
+
+    def test_snapshot_is_reused_until_version_bumps(self):
+        """Only a version change, e.g. a save in another worker, reloads the row"""
+        self.assertEqual(site_config.get_site_config().default_commission_rate, Decimal("12.00"))
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                site_config.get_site_config()
+
+        # Another worker saved the configuration and bumped the shared version
+        SiteConfiguration.objects.filter(pk=self.config.pk).update(default_commission_rate=Decimal("8.00"))
+        self.assertEqual(site_config.get_site_config().default_commission_rate, Decimal("12.00"))
+        site_config.bump_site_config_version()
+        self.assertEqual(site_config.get_site_config().default_commission_rate, Decimal("8.00"))
+
+        self.config.refresh_from_db()
+        self.config.default_commission_rate = Decimal("9.50")
+        self.config.save()
+        self.assertEqual(site_config.get_site_config().default_commission_rate, Decimal("9.50"))
+
+    def test_version_checked_once_per_request(self):
+        """Inside a request scope the shared version key is read a single time"""
+        site_config.get_site_config()
+        with mock.patch.object(site_config.cache, "get", wraps=site_config.cache.get) as cache_get:
+            with site_config.request_scope():
+                for _ in range(10):
+                    site_config.get_site_config()
+        self.assertEqual(cache_get.call_count, 1)
+
+    def test_hot_views_run_no_config_queries(self):
+        """Listing and product pages price every card without touching SiteConfiguration"""
+        game = Game.objects.create(title="Snapshot Game")
+        category = Category.objects.create(name="Snapshot Accounts")
+        GameCategory.objects.create(game=game, category=category)
+        seller = User.objects.create_user(username="snapshotseller", password="testpass")
+        products = [
+            Product.objects.create(
+                seller=seller, game=game, category=category,
+                listing_title=f"Snapshot listing number {index}",
+                description="Snapshot description long enough",
+                price=Decimal("400.00"), stock=3,
+            )
+            for index in range(3)
+        ]
+
+        # Warm this worker's snapshot, as any earlier request would have
+        site_config.get_site_config()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("listing_page", args=[game.pk, category.pk]), {"sort": "price_asc"})
+            self.client.get(reverse("product_detail", args=[products[0].pk]))
+        self.assertEqual(config_queries(queries.captured_queries), [])
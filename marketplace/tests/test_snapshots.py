@@ -0,0 +1,98 @@
+import time
+from decimal import Decimal
+from io import StringIO
+
+import msgpack
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace import caching
+from marketplace.models import Category, Filter, FilterOption, Game, GameCategory, Product
+from marketplace.snapshots import _LAYOUTS, ProductSnapshot, codec
+
+
+class SnapshotCacheTests(TestCase):
+    """Catalog and product pages are cached as msgpack-encoded snapshots, not pickled models"""
+
+    def setUp(self):
+        caching.local_tier.clear()
+        cache.clear()
+        self.seller = User.objects.create_user(username="snapseller", password="testpass")
+        self.seller.profile.last_seen = timezone.now()
+        self.seller.profile.save()
+        self.game = Game.objects.create(title="Snapshot Game")
+        self.category = Category.objects.create(name="Snapshot Keys")
+        GameCategory.objects.create(game=self.game, category=self.category)
+        platform = Filter.objects.create(internal_name="Snapshot Platform", name="Platform")
+        self.product = Product.objects.create(
+            seller=self.seller, game=self.game, category=self.category,
+            listing_title="Snapshot listing title", description="Snapshot listing description",
+            price=Decimal("10.00"), stock=5,
+        )
+        self.product.filter_options.add(FilterOption.objects.create(filter=platform, value="PC"))
+
+    def test_codec_round_trips_product_snapshots(self):
+        """Decimals, aware datetimes and nested snapshots survive encoding"""
+        product = Product.objects.with_full_details().with_buyer_price().get(pk=self.product.pk)
+        snapshot = ProductSnapshot.from_product(product)
+        decoded = codec.loads(codec.dumps(snapshot))
+
+        self.assertEqual(decoded, snapshot)
+        self.assertEqual(decoded.buyer_price, product.buyer_price)
+        self.assertEqual(decoded.seller.profile.last_seen, self.seller.profile.last_seen)
+        self.assertTrue(decoded.seller.profile.is_online)
+        self.assertEqual([option.filter_name for option in decoded.filter_options], ["Platform"])
+        self.assertEqual(decoded.seller, self.seller)
+        self.assertNotEqual(decoded.seller, User(pk=self.seller.pk + 1))
+
+    def test_shared_entries_hold_bytes(self):
+        """The shared tier stores the codec payload, never model instances"""
+        self.client.get(reverse("product_detail", args=[self.product.pk]))
+        payload = cache.get(caching.PRODUCT_DETAIL.key(self.product.pk))[2]
+        self.assertIsInstance(payload, bytes)
+        with self.assertRaises(TypeError):
+            codec.dumps(self.product)
+
+    def test_entries_from_another_layout_are_misses(self):
+        """Keys carry the snapshot layout, and an entry that no longer decodes is rebuilt"""
+        key = caching.PRODUCT_DETAIL.key(self.product.pk)
+        self.assertEqual(key, f"ns:product_detail:v{codec.layout_version}:{self.product.pk}")
+
+        # A ProductSnapshot written before a field was added or removed
+        code, _ = _LAYOUTS[ProductSnapshot]
+        stale = msgpack.packb(msgpack.ExtType(code, msgpack.packb([self.product.pk])))
+        cache.set(key, ((), (), stale, time.time() + 300, 0.1), 300)
+        with self.assertLogs("marketplace.caching", "WARNING"):
+            response = self.client.get(reverse("product_detail", args=[self.product.pk]))
+        self.assertContains(response, "Snapshot listing title")
+        self.assertIsInstance(codec.loads(cache.get(key)[2]), ProductSnapshot)
+
+    def test_cached_pages_render_without_the_orm(self):
+        """Once cached, the home and game pages render for visitors without queries"""
+        for url in (reverse("home"), reverse("game_detail", args=[self.game.pk])):
+            self.client.get(url)
+            caching.local_tier.clear()
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertContains(response, "Snapshot Game")
+
+    def test_product_page_uses_the_snapshot(self):
+        """The product page shows cached filter values and hides the buy box from its seller"""
+        self.client.get(reverse("product_detail", args=[self.product.pk]))
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse("product_detail", args=[self.product.pk]))
+        self.assertContains(response, "Snapshot listing title")
+        self.assertContains(response, "Platform")
+        self.assertEqual(response.context["product"].seller, self.seller)
+
+    def test_size_report_compares_encodings(self):
+        """The size report prints pickled vs snapshot sizes per namespace"""
+        out = StringIO()
+        call_command("cache_size_report", "--sample", "5", stdout=out)
+        self.assertIn("product_detail", out.getvalue())
+        self.assertIn("home_games_list", out.getvalue())
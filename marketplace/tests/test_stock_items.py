@@ -0,0 +1,165 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from marketplace.forms import ProductForm
+from marketplace.models import (
+    GameCategory, Message, Order, Product, Profile, StockItem, Transaction, UserBalance,
+)
+from marketplace.tests.helpers import OrderFixtures
+
+
+class StockItemTests(OrderFixtures, TestCase):
+    """Automatic-delivery codes live in StockItem rows with a maintained count"""
+
+    category_fields = {"commission_rate": Decimal("10.00")}
+    product_fields = {
+        "listing_title": "Instant Delivery Gift Card",
+        "price": Decimal("400.00"),
+        "automatic_delivery": True,
+        "stock": None,
+        "stock_details": "CODE-1\nCODE-2\n\nCODE-3\n",
+    }
+    order_fields = {"total_price": Decimal("440.00")}
+
+    def setUp(self):
+        super().setUp()
+        self.game_category_link = GameCategory.objects.create(
+            game=self.game, category=self.category, allows_automated_delivery=True
+        )
+
+    def test_saved_codes_become_rows(self):
+        """The stock_details blob is split into rows on save and never kept"""
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_details, "")
+        self.assertEqual(self.product.stock_count, 3)
+        self.assertEqual(list(StockItem.objects.export_codes(self.product)), ["CODE-1", "CODE-2", "CODE-3"])
+
+        self.product.stock_details = "CODE-4"
+        self.product.save()
+        self.assertEqual(self.product.available_stock_items, 4)
+
+    def test_claim_and_deliver_move_the_count(self):
+        """Claims take the oldest codes, and the last sale deactivates the listing"""
+        self.assertIsNone(StockItem.objects.claim(self.product, 4))
+
+        order = self.create_order()
+        items = StockItem.objects.claim(self.product, 2)
+        self.assertEqual([item.content for item in items], ["CODE-1", "CODE-2"])
+        StockItem.objects.deliver(items, order)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock_items, 1)
+        self.assertTrue(self.product.is_active)
+        self.assertEqual(order.delivered_stock_items.count(), 2)
+
+        StockItem.objects.deliver(StockItem.objects.claim(self.product, 1), self.create_order())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock_items, 0)
+        self.assertFalse(self.product.is_active)
+        self.assertIsNone(StockItem.objects.claim(self.product, 1))
+
+    def test_stale_save_keeps_the_count(self):
+        """Saving an instance loaded before a sale must not restore the old count"""
+        stale = Product.objects.get(pk=self.product.pk)
+        StockItem.objects.deliver(StockItem.objects.claim(self.product, 1), self.create_order())
+
+        stale.listing_title = "Instant Delivery Gift Card (EU)"
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock_items, 2)
+        self.assertEqual(self.product.listing_title, "Instant Delivery Gift Card (EU)")
+
+    def test_form_imports_file_and_replaces_unsold(self):
+        """Uploaded files are appended, and replace_stock swaps out unsold codes"""
+        data = {
+            "listing_title": self.product.listing_title,
+            "description": self.product.description,
+            "post_purchase_message": "",
+            "price": "400.00",
+            "automatic_delivery": "on",
+            "stock_details": "CODE-4",
+        }
+        upload = SimpleUploadedFile("codes.txt", b"CODE-5\r\nCODE-6\n", content_type="text/plain")
+        form = ProductForm(
+            data, {"stock_file": upload}, instance=self.product, game_category_link=self.game_category_link
+        )
+        self.assertTrue(form.is_valid(), form.errors.as_json())
+        form.save()
+        self.assertEqual(self.product.available_stock_items, 6)
+
+        form = ProductForm(
+            {**data, "stock_details": "", "replace_stock": "on"},
+            instance=Product.objects.get(pk=self.product.pk),
+            game_category_link=self.game_category_link,
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn("stock_details", form.errors)
+
+        form = ProductForm(
+            {**data, "stock_details": "NEW-1\nNEW-2", "replace_stock": "on"},
+            instance=Product.objects.get(pk=self.product.pk),
+            game_category_link=self.game_category_link,
+        )
+        self.assertTrue(form.is_valid(), form.errors.as_json())
+        product = form.save()
+        self.assertEqual(product.available_stock_items, 2)
+        self.assertEqual(list(StockItem.objects.export_codes(product)), ["NEW-1", "NEW-2"])
+
+    def test_checkout_delivers_claimed_codes(self):
+        """Buying two codes sends them to the buyer and links them to the order"""
+        Transaction.objects.create(
+            user=self.buyer, amount=Decimal("2000.00"), transaction_type="DEPOSIT", status="COMPLETED"
+        )
+        self.client.force_login(self.buyer)
+        session = self.client.session
+        session["checkout_data"] = {"product_id": self.product.id, "quantity": 2}
+        session.save()
+
+        with override_settings(ORDER_EVENTS_ASYNC=False), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("process_checkout", args=[self.product.pk]), {"quantity": "2"})
+        order = Order.objects.get(buyer=self.buyer)
+        self.assertRedirects(
+            response, reverse("order_detail", args=[order.clean_order_id]), fetch_redirect_response=False
+        )
+        self.assertEqual(
+            sorted(order.delivered_stock_items.values_list("content", flat=True)), ["CODE-1", "CODE-2"]
+        )
+        self.assertTrue(Message.objects.filter(content="CODE-1\nCODE-2", is_auto_reply=True).exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock_items, 1)
+
+    def test_checkout_rechecks_balance_under_lock(self):
+        """A second checkout is refused once the first has spent the balance, whatever the cache says"""
+        Transaction.objects.create(
+            user=self.buyer, amount=Decimal("500.00"), transaction_type="DEPOSIT", status="COMPLETED"
+        )
+        self.client.force_login(self.buyer)
+        url = reverse("process_checkout", args=[self.product.pk])
+        for _ in range(2):
+            session = self.client.session
+            session["checkout_data"] = {"product_id": self.product.id, "quantity": 1}
+            session.save()
+            # What a concurrent request that read the cache before the first purchase would see
+            with patch.object(Profile, "available_balance", Decimal("500.00")):
+                response = self.client.post(url, {"quantity": "1"})
+
+        self.assertRedirects(response, reverse("funds"), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.filter(buyer=self.buyer).count(), 1)
+        self.assertEqual(UserBalance.objects.get(user=self.buyer).available, Decimal("60.00"))
+
+    def test_export_streams_only_unsold_codes(self):
+        """Sellers can download the codes still in stock; other users cannot"""
+        StockItem.objects.deliver(StockItem.objects.claim(self.product, 1), self.create_order())
+        url = reverse("export_stock_items", args=[self.product.pk])
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.seller)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"CODE-2\nCODE-3\n")
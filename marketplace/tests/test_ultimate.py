@@ -11,6 +11,7 @@ from django.test import TestCase
 from django.db import IntegrityError
 from django.utils import timezone
 
+from marketplace.caching import MESSAGE_COUNT
 from marketplace.models import (
     Category,
     Game,
@@ -263,10 +264,17 @@ class UltimateMarketplaceFlowTests(TestCase):
         hold.refresh_from_db()
         self.assertTrue(hold.can_be_released())
 
+        # Balance reads never write; the scheduled release frees expired holds
+        self.assertEqual(profile.available_balance, Decimal("65.00"))
+        hold.refresh_from_db()
+        self.assertFalse(hold.is_released)
+
+        self.assertEqual(HeldFund.objects.release_due(), {self.seller.id: Decimal("60.00")})
+
         self.assertEqual(
             profile.available_balance,
             Decimal("125.00"),
-            "Auto-release should free held funds once the hold period passes",
+            "Releasing due funds should free held funds once the hold period passes",
         )
         hold.refresh_from_db()
         self.assertTrue(hold.is_released)
@@ -363,14 +371,13 @@ class UltimateMarketplaceFlowTests(TestCase):
             participant2=self.buyer,
             moderator=moderator,
         )
-        cache_key = f"conversation_message_count_{conversation.id}"
-        cache.set(cache_key, 10)
+        MESSAGE_COUNT.set(10, conversation.id)
         message = Message.objects.create(
             conversation=conversation,
             sender=self.buyer,
             content="Hello there!",
         )
-        self.assertIsNone(cache.get(cache_key))
+        self.assertIsNone(MESSAGE_COUNT.get(conversation.id))
         self.assertIn(moderator, conversation.get_participants())
         self.assertTrue(conversation.is_participant(self.seller))
         self.assertFalse(message.is_system_message)
@@ -1,10 +1,20 @@
+import datetime
 from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from marketplace.models import Category, Game, Order, Product
+from marketplace import models as marketplace_models
+from marketplace.caching import USER_BALANCE
+from marketplace.models import Category, Game, HeldFund, Order, Product, Transaction, UserBalance
+from marketplace.wallet import get_wallet_snapshot
 
 
 class BalanceCacheInvalidationTests(TestCase):
@@ -47,11 +57,10 @@ class BalanceCacheInvalidationTests(TestCase):
         )
 
     def test_order_completion_clears_cached_balances(self):
-        balance_cache_key = f"user_balance_{self.seller.id}"
 
         initial_balance = self.seller.profile.balance
         self.assertEqual(initial_balance, Decimal("0.00"))
-        cached_value = cache.get(balance_cache_key)
+        cached_value = USER_BALANCE.get(self.seller.id)
         self.assertIsNotNone(cached_value, "Balance should be cached after first access")
 
         self.order.status = "COMPLETED"
@@ -59,7 +68,7 @@ class BalanceCacheInvalidationTests(TestCase):
         self.order.save()
 
         self.assertIsNone(
-            cache.get(balance_cache_key),
+            USER_BALANCE.get(self.seller.id),
             "Balance cache should be cleared when order completes",
         )
 
@@ -70,3 +79,216 @@ class BalanceCacheInvalidationTests(TestCase):
             Decimal("0.00"),
             "Available balance should not go negative after hold is applied",
         )
+
+
+class UserBalanceLedgerTests(TestCase):
+    """The running balance row must always equal the ledger it mirrors"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="ledger", email="ledger@example.com", password="testpass"
+        )
+        self.buyer = User.objects.create_user(
+            username="ledgerbuyer", email="ledgerbuyer@example.com", password="testpass"
+        )
+        category = Category.objects.create(name="Accounts")
+        game = Game.objects.create(title="Ledger Game")
+        product = Product.objects.create(
+            seller=self.user,
+            game=game,
+            category=category,
+            listing_title="Ledger Listing",
+            description="Ledger Description",
+            price=Decimal("500.00"),
+            stock=1,
+        )
+        self.order = Order.objects.create(
+            buyer=self.buyer,
+            seller=self.user,
+            product=product,
+            total_price=Decimal("500.00"),
+            status="PENDING_PAYMENT",
+        )
+
+    def assertRowMatchesLedger(self):
+        row = UserBalance.objects.get(user=self.user)
+        expected = UserBalance.objects.ledger_totals([self.user.id]).get(
+            self.user.id, (Decimal("0.00"), Decimal("0.00"))
+        )
+        self.assertEqual((row.balance, row.held), expected)
+        return row
+
+    def test_ledger_writes_move_the_balance_row(self):
+        """Creates, status changes, bulk updates and deletes all keep the row in step"""
+        deposit = Transaction.objects.create(
+            user=self.user, amount=Decimal("200.00"), transaction_type="DEPOSIT",
+            status="PENDING", description="Deposit",
+        )
+        self.assertEqual(self.user.profile.balance, Decimal("0.00"))
+
+        deposit.status = "COMPLETED"
+        deposit.save()
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("200.00"))
+
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("-50.00"), transaction_type="WITHDRAWAL",
+            status="COMPLETED", description="Withdrawal",
+        )
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("150.00"))
+
+        Transaction.objects.filter(pk=deposit.pk).update_with_balances(
+            status="COMPLETED", amount=Decimal("250.00")
+        )
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("200.00"))
+        self.assertEqual(self.user.profile.balance, Decimal("200.00"))
+
+        deposit.delete()
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("-50.00"))
+
+    def test_held_funds_move_the_held_column(self):
+        """Held funds add to `held` until released, and available is balance minus held"""
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("300.00"), transaction_type="ORDER_SALE",
+            status="COMPLETED", description="Sale", order=self.order,
+        )
+        hold = HeldFund.objects.create(
+            user=self.user, order=self.order, amount=Decimal("120.00"),
+            release_at=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        wallet = self.assertRowMatchesLedger()
+        self.assertEqual(wallet.held, Decimal("120.00"))
+        self.assertEqual(wallet.available, Decimal("180.00"))
+
+        self.assertTrue(hold.release_fund())
+        self.assertEqual(self.assertRowMatchesLedger().held, Decimal("0.00"))
+
+    def test_wallet_read_is_a_single_query(self):
+        """balance, held and available come from one primary-key read"""
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("75.00"), transaction_type="DEPOSIT",
+            status="COMPLETED", description="Deposit",
+        )
+        profile = self.user.profile
+        with self.assertNumQueries(1):
+            wallet = profile.wallet
+            self.assertEqual(
+                (wallet.balance, wallet.held, wallet.available),
+                (Decimal("75.00"), Decimal("0.00"), Decimal("75.00")),
+            )
+
+    def test_verify_balances_reports_and_fixes_drift(self):
+        """verify_balances recomputes from the ledger and rewrites drifted rows"""
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("90.00"), transaction_type="DEPOSIT",
+            status="COMPLETED", description="Deposit",
+        )
+        UserBalance.objects.filter(user=self.user).update(balance=Decimal("10.00"))
+
+        out = StringIO()
+        call_command("verify_balances", stdout=out)
+        self.assertIn("1 drifted", out.getvalue())
+
+        call_command("verify_balances", "--fix", stdout=StringIO())
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("90.00"))
+
+        out = StringIO()
+        call_command("verify_balances", stdout=out)
+        self.assertIn("no drift found", out.getvalue())
+
+    def test_missing_rows_are_read_without_writing_and_seeded_by_writes(self):
+        """for_user never inserts; the next ledger write seeds a zero row and moves it"""
+        UserBalance.objects.filter(user=self.user).delete()
+        with self.assertNumQueries(3):
+            row = UserBalance.objects.for_user(self.user)
+        self.assertEqual((row.balance, row.held), (Decimal("0.00"), Decimal("0.00")))
+        self.assertFalse(UserBalance.objects.filter(user=self.user).exists())
+
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("30.00"), transaction_type="DEPOSIT",
+            status="COMPLETED", description="Deposit",
+        )
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("30.00"))
+
+        # Seeding an existing row leaves its totals alone
+        UserBalance.objects.seed([self.user.id])
+        self.assertEqual(self.assertRowMatchesLedger().balance, Decimal("30.00"))
+
+    def test_release_due_is_set_based(self):
+        """Expired holds are released in bulk and only expired ones are touched"""
+        other_order = Order.objects.create(
+            buyer=self.buyer, seller=self.user, product=self.order.product,
+            total_price=Decimal("500.00"), status="PENDING_PAYMENT",
+        )
+        expired = HeldFund.objects.create(
+            user=self.user, order=self.order, amount=Decimal("40.00"),
+            release_at=timezone.now() - datetime.timedelta(minutes=5),
+        )
+        pending = HeldFund.objects.create(
+            user=self.user, order=other_order, amount=Decimal("25.00"),
+            release_at=timezone.now() + datetime.timedelta(hours=5),
+        )
+        self.assertEqual(self.user.profile.held_balance, Decimal("65.00"))
+
+        # Reading the balance must not write anything
+        with CaptureQueriesContext(connection) as queries:
+            self.user.profile.available_balance
+        self.assertFalse([q for q in queries.captured_queries if not q["sql"].startswith("SELECT")])
+        self.assertFalse(HeldFund.objects.get(pk=expired.pk).is_released)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(HeldFund.objects.release_due(), {self.user.id: Decimal("40.00")})
+        self.assertTrue(any(
+            q["sql"].startswith("UPDATE") and "RETURNING" in q["sql"] for q in queries.captured_queries
+        ))
+        self.assertTrue(HeldFund.objects.get(pk=expired.pk).is_released)
+        self.assertFalse(HeldFund.objects.get(pk=pending.pk).is_released)
+        self.assertEqual(self.assertRowMatchesLedger().held, Decimal("25.00"))
+        self.assertEqual(self.user.profile.held_balance, Decimal("25.00"))
+
+        # Nothing left to release on a second run
+        self.assertEqual(HeldFund.objects.release_due(), {})
+
+        # Backends without UPDATE ... RETURNING lock and update by primary key
+        HeldFund.objects.filter(pk=pending.pk).update(release_at=timezone.now())
+        with patch.object(marketplace_models, "_can_return_from_update", return_value=False):
+            self.assertEqual(HeldFund.objects.release_due(), {self.user.id: Decimal("25.00")})
+        self.assertEqual(self.assertRowMatchesLedger().held, Decimal("0.00"))
+
+    def test_wallet_snapshot_reads_in_two_queries(self):
+        """Balances and every held-funds bucket come from two queries per request"""
+        now = timezone.now()
+        for index, hours in enumerate([-1, 5, 30, 60, 90]):
+            order = Order.objects.create(
+                buyer=self.buyer, seller=self.user, product=self.order.product,
+                total_price=Decimal("100.00"), status="PENDING_PAYMENT",
+            )
+            HeldFund.objects.create(
+                user=self.user, order=order, amount=Decimal("10.00") * (index + 1),
+                release_at=now + datetime.timedelta(hours=hours),
+            )
+
+        request = RequestFactory().get("/funds/")
+        request.user = self.user
+        with self.assertNumQueries(2):
+            wallet = get_wallet_snapshot(request)
+            self.assertEqual(wallet.held, Decimal("150.00"))
+            self.assertEqual(wallet.available, -Decimal("150.00"))
+            summary = wallet.held_funds_summary
+            self.assertIs(get_wallet_snapshot(request), wallet)
+            get_wallet_snapshot(request).held_funds_summary
+
+        self.assertEqual(
+            [(item["label"], item["count"], item["total_amount"]) for item in summary],
+            [
+                ("available_now", 1, Decimal("10.00")),
+                ("next_24h", 1, Decimal("20.00")),
+                ("next_48h", 1, Decimal("30.00")),
+                ("later", 2, Decimal("90.00")),
+            ],
+        )
+        self.assertEqual(wallet.held_funds_count, 5)
+        self.assertEqual(
+            [item["total_amount"] for item in self.user.profile.get_held_funds_summary()],
+            [item["total_amount"] for item in summary],
+        )
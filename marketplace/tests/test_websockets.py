@@ -0,0 +1,192 @@
+"""
+WebSocket Tests - Multiplexed consumer and frame negotiation
+Tests stream subscription, authorization and event routing over a single socket
+"""
+import json
+
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from marketplace.consumers import MultiplexConsumer, NotificationConsumer
+from marketplace.models import Conversation, Message
+from marketplace.ws_framing import SHORT_KEYS, SUBPROTOCOL_MSGPACK, decode_frame, encode_frame
+
+
+class MultiplexConsumerTest(TransactionTestCase):
+    """Test the ws/multiplex/ consumer"""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user('mux1', 'mux1@test.com', 'pass123')
+        self.user2 = User.objects.create_user('mux2', 'mux2@test.com', 'pass123')
+        self.outsider = User.objects.create_user('mux3', 'mux3@test.com', 'pass123')
+        self.conversation = Conversation.objects.create(
+            participant1=self.user1, participant2=self.user2
+        )
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/multiplex/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def _send(self, communicator, payload):
+        await communicator.send_to(text_data=json.dumps(payload))
+        return json.loads(await communicator.receive_from())
+
+    def test_subscribe_chat_and_receive_tagged_message(self):
+        """Chat events arrive tagged with the stream and the partner username"""
+        async def scenario():
+            communicator = await self._connect(self.user1)
+            ack = await self._send(communicator, {'action': 'subscribe', 'stream': 'chat', 'username': 'mux2'})
+            self.assertEqual(ack['type'], 'subscribed')
+            self.assertEqual(ack['conversation_id'], self.conversation.id)
+
+            await get_channel_layer().group_send(f'chat_{self.conversation.id}', {
+                'type': 'chat_message',
+                'message_html': '<p>hi</p>',
+                'message_id': 1,
+                'conversation_id': self.conversation.id,
+            })
+            frame = json.loads(await communicator.receive_from())
+            self.assertEqual(frame['stream'], 'chat')
+            self.assertEqual(frame['username'], 'mux2')
+            self.assertEqual(frame['type'], 'new_message')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_chat_subscription_requires_participation(self):
+        """Users cannot join chat groups of conversations they are not part of"""
+        async def scenario():
+            communicator = await self._connect(self.outsider)
+            reply = await self._send(communicator, {'action': 'subscribe', 'stream': 'chat', 'username': 'mux2'})
+            self.assertEqual(reply['type'], 'error')
+            self.assertEqual(reply['error'], 'forbidden')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_unsubscribe_stops_chat_events(self):
+        """Events from a room the socket left are not forwarded"""
+        async def scenario():
+            communicator = await self._connect(self.user1)
+            await self._send(communicator, {'action': 'subscribe', 'stream': 'chat', 'username': 'mux2'})
+            reply = await self._send(communicator, {'action': 'unsubscribe', 'stream': 'chat', 'username': 'mux2'})
+            self.assertEqual(reply['type'], 'unsubscribed')
+
+            await get_channel_layer().group_send(f'chat_{self.conversation.id}', {
+                'type': 'chat_message',
+                'message_html': '<p>late</p>',
+                'message_id': 2,
+                'conversation_id': self.conversation.id,
+            })
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_notifications_stream_and_chat_share_one_socket(self):
+        """Notifications and chat read receipts flow over the same connection"""
+        Message.objects.create(conversation=self.conversation, sender=self.user2, content='Unread')
+
+        async def scenario():
+            communicator = await self._connect(self.user1)
+            ack = await self._send(communicator, {'action': 'subscribe', 'stream': 'notifications'})
+            self.assertEqual(ack, {'type': 'subscribed', 'stream': 'notifications'})
+
+            # Joining the chat marks the unread message as read and pushes a receipt
+            await communicator.send_to(text_data=json.dumps(
+                {'action': 'subscribe', 'stream': 'chat', 'username': 'mux2'}
+            ))
+            frames = [json.loads(await communicator.receive_from()) for _ in range(2)]
+            types = {frame['type'] for frame in frames}
+            self.assertEqual(types, {'read_receipt_update', 'subscribed'})
+            receipt = next(frame for frame in frames if frame['type'] == 'read_receipt_update')
+            self.assertEqual(receipt['stream'], 'notifications')
+            self.assertEqual(receipt['data']['unread_conversations_count'], 0)
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+
+    def test_unauthenticated_connection_rejected(self):
+        """Anonymous users cannot open the multiplexed socket"""
+        from django.contrib.auth.models import AnonymousUser
+
+        async def scenario():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/multiplex/')
+            communicator.scope['user'] = AnonymousUser()
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(scenario)()
+
+
+class FrameNegotiationTest(TransactionTestCase):
+    """Test MessagePack / JSON frame negotiation"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('framer', 'framer@test.com', 'pass123')
+
+    def test_short_keys_round_trip(self):
+        """MessagePack frames use short keys and decode back to the original payload"""
+        self.assertEqual(len(set(SHORT_KEYS.values())), len(SHORT_KEYS))
+        payload = {'type': 'new_message', 'data': {'unread_conversations_count': 2, 'conversation_id': 7}}
+        frame = encode_frame(payload, 'msgpack')
+        self.assertEqual(msgpack.unpackb(frame['bytes_data']), {'t': 'new_message', 'd': {'uc': 2, 'c': 7}})
+        self.assertEqual(decode_frame(bytes_data=frame['bytes_data'], frame_format='msgpack'), payload)
+
+    def test_binary_frames_rejected_on_json_sockets(self):
+        """Binary frames are only accepted when MessagePack was negotiated"""
+        with self.assertRaises(ValueError):
+            decode_frame(bytes_data=msgpack.packb({'t': 'ping'}))
+
+    def test_msgpack_subprotocol_negotiated(self):
+        """Clients offering the MessagePack subprotocol receive binary frames"""
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                NotificationConsumer.as_asgi(), '/ws/notifications/', subprotocols=[SUBPROTOCOL_MSGPACK]
+            )
+            communicator.scope['user'] = self.user
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, SUBPROTOCOL_MSGPACK)
+
+            await get_channel_layer().group_send('notifications_framer', {
+                'type': 'send_notification',
+                'notification_type': 'presence_update',
+                'data': {'username': 'other', 'is_online': True},
+            })
+            frame = msgpack.unpackb(await communicator.receive_from())
+            self.assertEqual(frame, {'t': 'presence_update', 'd': {'u': 'other', 'o': True}})
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_legacy_clients_keep_json(self):
+        """Clients without a subprotocol still get JSON text frames"""
+        async def scenario():
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+            communicator.scope['user'] = self.user
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertIsNone(subprotocol)
+
+            await get_channel_layer().group_send('notifications_framer', {
+                'type': 'send_notification',
+                'notification_type': 'presence_update',
+                'data': {'username': 'other', 'is_online': True},
+            })
+            frame = json.loads(await communicator.receive_from())
+            self.assertEqual(frame['type'], 'presence_update')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
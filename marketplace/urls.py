@@ -32,6 +32,7 @@ urlpatterns = [
     path('sell/<int:game_pk>/<int:category_pk>/', views.create_product, name='product_form'),
     path('listing/<int:pk>/edit/', views.edit_product, name='edit_product'), # New URL for editing
     path('listing/<int:pk>/delete/', views.delete_product, name='delete_product'), # New URL for deleting
+    path('listing/<int:pk>/stock/export/', views.export_stock_items, name='export_stock_items'),
     path('sell/<int:game_pk>/<int:category_pk>/my-listings/', views.my_listings_in_category, name='my_listings_in_category'),
 
     # Order Management & Reviews
@@ -50,10 +51,13 @@ urlpatterns = [
 
     # User-specific pages
     path('my-sales/', views.my_sales, name='my_sales'),
+    path('my-sales/export/', views.export_statement, {'kind': 'sales'}, name='export_sales'),
     path('my-purchases/', views.my_purchases, name='my_purchases'),
+    path('my-purchases/export/', views.export_statement, {'kind': 'purchases'}, name='export_purchases'),
     path('my-messages/', views.messages_view, name='my_messages'),
     path('my-messages/<str:username>/', views.messages_view, name='conversation_detail'),
     path('funds/', views.funds_view, name='funds'),
+    path('funds/export/', views.export_statement, {'kind': 'transactions'}, name='export_transactions'),
     path('settings/', views.settings_view, name='settings'),
     path('profile/<str:username>/', views.public_profile_view, name='public_profile'),
     path('ajax/load-more-reviews/<str:username>/', views.load_more_reviews, name='load_more_reviews'),
@@ -63,9 +67,6 @@ urlpatterns = [
     path('ajax/update-listing-visibility/', views.ajax_update_listing_visibility, name='ajax_update_listing_visibility'),
     path('ajax/boost-listings/<int:game_pk>/', views.boost_listings, name='boost_listings'),
     path('support-center/', views.support_center_view, name='support_center'),
-    path('ajax/load-more-purchases/', views.load_more_purchases, name='load_more_purchases'),
-    path('ajax/load-more-sales/', views.load_more_sales, name='load_more_sales'),
-    path('ajax/load-more-transactions/', views.load_more_transactions, name='load_more_transactions'),
     path('ajax/load-more-listings/<int:game_pk>/<int:category_pk>/', views.load_more_listings, name='load_more_listings'),
     path('order-confirmation/<str:order_id>/', views.order_confirmation_view, name='order_confirmation'),
     
@@ -5,13 +5,13 @@ from django.http import JsonResponse, HttpResponseForbidden, HttpResponse, Http4
 from datetime import timedelta
 from django.utils import timezone
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth import forms as auth_forms
 from django.views import generic
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.db import models
-from django.db.models import Sum, Q, Count, Avg, F, OuterRef, Subquery, Prefetch
+from django.db.models import Sum, Q, Count, Avg, F, OuterRef, Subquery, Prefetch, Case, When, Value
 from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 import string
@@ -194,38 +194,6 @@ def validate_uploaded_file(uploaded_file, max_size_mb=5, allowed_types=None):
     
     return True
 
-def check_rate_limit(request, action, limit=10, period=300):
-    """
-    Simple rate limiting using Django cache.
-    Returns True if action is allowed, False if rate limit exceeded.
-    
-    Args:
-        request: Django request object
-        action: String identifying the action (e.g., 'login', 'message', 'order')
-        limit: Number of allowed actions per period
-        period: Time period in seconds (default: 5 minutes)
-    """
-    # Use IP address for rate limiting
-    user_ip = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip()
-    if not user_ip:
-        user_ip = request.META.get('REMOTE_ADDR', '')
-    
-    # Create cache key
-    if request.user.is_authenticated:
-        cache_key = f'rate_limit_{action}_{request.user.id}_{user_ip}'
-    else:
-        cache_key = f'rate_limit_{action}_{user_ip}'
-    
-    # Get current count
-    current_count = cache.get(cache_key, 0)
-    
-    if current_count >= limit:
-        return False
-    
-    # Increment counter immediately to prevent race conditions
-    cache.set(cache_key, current_count + 1, period)
-    return True
-
 def sanitize_user_input(text, max_length=10000):
     """
     Sanitize user input to prevent XSS and other injection attacks.
@@ -248,36 +216,80 @@ def sanitize_user_input(text, max_length=10000):
 
 def get_cached_message_count(conversation):
     """Get message count with caching to avoid repeated count() queries"""
-    cache_key = f'conversation_message_count_{conversation.id}'
-    count = cache.get(cache_key)
-    if count is None:
-        count = conversation.messages.count()
-        cache.set(cache_key, count, 300)  # Cache for 5 minutes
-    return count
+    return caching.MESSAGE_COUNT.get_or_set(conversation.id, compute=conversation.messages.count)
 
 def get_cached_review_stats(seller):
     """Get review statistics with caching to avoid repeated aggregate queries"""
-    cache_key = f'review_stats_{seller.id}'
-    stats = cache.get(cache_key)
-    if stats is None:
-        from django.db.models import Avg, Count
-        stats = Review.objects.filter(seller=seller).aggregate(
-            average_rating=Avg('rating'), 
-            review_count=Count('id')
-        )
-        # Cache for 10 minutes - reviews don't change very frequently
-        cache.set(cache_key, stats, 600)
-    return stats
+    return caching.REVIEW_STATS.get_or_set(seller.id, compute=lambda: load_review_stats(seller.id))
+
+def load_review_stats(seller_id):
+    from django.db.models import Avg, Count
+    return Review.objects.filter(seller_id=seller_id).aggregate(
+        average_rating=Avg('rating'),
+        review_count=Count('id')
+    )
 from django.conf import settings
 
 from .models import (
     Game, Category, Product, Order, Review, ReviewReply, FlatPage,
-    Conversation, Message, WithdrawalRequest, DepositRequest, SupportTicket, SiteConfiguration, Profile, Transaction, GameCategory, UserGameBoost, ProductImage, BlockedUser, get_effective_commission_rate_for_listing
+    Conversation, Message, WithdrawalRequest, DepositRequest, SupportTicket, SiteConfiguration, Profile, Transaction, GameCategory, UserGameBoost, ProductImage, BlockedUser, StockItem, UserBalance, UserOrderCount, get_effective_commission_rate_for_listing
 )
 from .forms import (
     ProductForm, ReviewForm, ReviewReplyForm, WithdrawalRequestForm, DepositRequestForm, SupportTicketForm,
     ProfilePictureForm, ProfileUpdateForm, CustomUserCreationForm
 )
+from . import caching, rate_limit
+from .exports import EXPORT_FORMATS, order_statement, parse_date_range, stream_csv, stream_for, stream_json, transaction_statement
+from .pagination import keyset_paginate
+from .snapshots import (
+    CategorySnapshot, FlatPageSnapshot, GameCategorySnapshot, GameSnapshot, ProductSnapshot,
+)
+from .wallet import get_wallet_snapshot
+
+
+# Builders for the cached catalog and product entries. The views pass them to
+# get_or_set; warm_caches calls them to fill the same entries after a deploy.
+
+def load_home_games():
+    # Fetch games with properly ordered categories in a single query
+    games_queryset = Game.objects.prefetch_related(
+        Prefetch(
+            'categories', 
+            queryset=Category.objects.order_by('gamecategory__id'),
+            to_attr='ordered_categories'
+        )
+    ).order_by(Lower('title'))
+    return tuple(GameSnapshot.from_game(game, game.ordered_categories) for game in games_queryset)
+
+def load_game_detail(pk):
+    game = get_object_or_404(Game, pk=pk)
+    # Get categories in admin panel setup order (by GameCategory ID)
+    categories = game.categories.filter(
+        gamecategory__game=game
+    ).order_by('gamecategory__id')
+    return {
+        'game': GameSnapshot.from_game(game),
+        'categories': tuple(CategorySnapshot.from_category(category) for category in categories),
+    }
+
+def load_game_category(game_pk, category_pk):
+    game = get_object_or_404(Game, pk=game_pk)
+    current_category = get_object_or_404(Category, pk=category_pk)
+    game_category_link = get_object_or_404(
+        GameCategory.objects.select_related('primary_filter'), game=game, category=current_category
+    )
+    return (
+        GameSnapshot.from_game(game), CategorySnapshot.from_category(current_category),
+        GameCategorySnapshot.from_link(game_category_link),
+    )
+
+def load_product_detail(pk):
+    return ProductSnapshot.from_product(
+        get_object_or_404(Product.objects.with_full_details().with_buyer_price(), pk=pk)
+    )
+
+def load_flat_page(slug):
+    return FlatPageSnapshot.from_page(get_object_or_404(FlatPage, slug=slug))
 
 
 def live_search(request):
@@ -295,43 +307,39 @@ def live_search(request):
     if not re.match(r'^[a-zA-Z0-9\s\-_:\.\'\"]+$', query):
         return JsonResponse({'error': 'Invalid characters in search query'}, status=400)
 
-    cache_key = f'search_{query.lower()}'
-    cached_results = cache.get(cache_key)
-
-    if cached_results is not None:
-        return JsonResponse(cached_results, safe=False)
-
-    # DEV NOTE: For a more scalable solution at a larger scale,
-    # a dedicated search index (e.g., Elasticsearch or PostgreSQL's trigram index)
-    # on the 'title' field of the Game model is recommended.
-    games_queryset = Game.objects.filter(title__istartswith=query).prefetch_related('categories')[:6]
+    def search_games():
+        # DEV NOTE: For a more scalable solution at a larger scale,
+        # a dedicated search index (e.g., Elasticsearch or PostgreSQL's trigram index)
+        # on the 'title' field of the Game model is recommended.
+        games_queryset = Game.objects.filter(title__istartswith=query).prefetch_related('categories')[:6]
     
-    results = []
-    for game in games_queryset:
-        try:
-            # Order categories by GameCategory ID (admin setup order)
-            ordered_categories = game.categories.filter(
-                gamecategory__game=game
-            ).order_by('gamecategory__id')
+        results = []
+        for game in games_queryset:
+            try:
+                # Order categories by GameCategory ID (admin setup order)
+                ordered_categories = game.categories.filter(
+                    gamecategory__game=game
+                ).order_by('gamecategory__id')
             
-            game_url = reverse_lazy('game_detail', kwargs={'pk': game.pk})
-            categories_data = []
-            for cat in ordered_categories:
-                try:
-                    cat_url = reverse_lazy('listing_page', kwargs={'game_pk': game.pk, 'category_pk': cat.pk})
-                    categories_data.append({'name': cat.name, 'url': cat_url})
-                except Exception:
-                    continue
+                game_url = reverse('game_detail', kwargs={'pk': game.pk})
+                categories_data = []
+                for cat in ordered_categories:
+                    try:
+                        cat_url = reverse('listing_page', kwargs={'game_pk': game.pk, 'category_pk': cat.pk})
+                        categories_data.append({'name': cat.name, 'url': cat_url})
+                    except Exception:
+                        continue
             
-            results.append({
-                'name': game.title,
-                'url': game_url,
-                'categories': categories_data
-            })
-        except Exception:
-            continue
-
-    cache.set(cache_key, results, 120)  # Cache for 2 minutes
+                results.append({
+                    'name': game.title,
+                    'url': game_url,
+                    'categories': categories_data
+                })
+            except Exception:
+                continue
+        return results
+
+    results = caching.SEARCH.get_or_set(query.lower(), compute=search_games)
     return JsonResponse(results, safe=False)
 
 class RegisterView(generic.CreateView):
@@ -366,20 +374,7 @@ class RegisterView(generic.CreateView):
 
 def home(request):
     # Cache games for 10 minutes since they don't change frequently
-    cache_key = 'home_games_list'
-    all_games = cache.get(cache_key)
-
-    if all_games is None:
-        # Fetch games with properly ordered categories in a single query
-        games_queryset = Game.objects.prefetch_related(
-            Prefetch(
-                'categories', 
-                queryset=Category.objects.order_by('gamecategory__id'),
-                to_attr='ordered_categories'
-            )
-        ).order_by(Lower('title'))
-        all_games = list(games_queryset)
-        cache.set(cache_key, all_games, 600)  # 10 minutes
+    all_games = caching.HOME_GAMES.get_or_set(compute=load_home_games)
 
     letters = list(string.ascii_uppercase)
     context = {'games': all_games, 'letters': letters}
@@ -425,15 +420,8 @@ def search_results(request):
 
 def product_detail(request, pk):
     # Cache product details for 5 minutes since they don't change frequently
-    cache_key = f'product_detail_{pk}'
-    cached_data = cache.get(cache_key)
-    
-    if cached_data:
-        product, seller = cached_data
-    else:
-        product = get_object_or_404(Product.objects.with_full_details(), pk=pk)
-        seller = product.seller
-        cache.set(cache_key, (product, seller), 300)  # 5 minutes
+    product = caching.PRODUCT_DETAIL.get_or_set(pk, compute=lambda: load_product_detail(pk))
+    seller = product.seller
     
     messages = []
     active_conversation = None
@@ -443,21 +431,18 @@ def product_detail(request, pk):
     if request.user.is_authenticated and request.user != seller:
         # Check if users have blocked each other
         is_blocked = BlockedUser.objects.filter(
-            Q(blocker=request.user, blocked=seller) |
-            Q(blocker=seller, blocked=request.user)
+            Q(blocker=request.user, blocked_id=seller.pk) |
+            Q(blocker_id=seller.pk, blocked=request.user)
         ).exists()
-        if request.user.id < seller.id:
-            p1, p2 = request.user, seller
-        else:
-            p1, p2 = seller, request.user
-        conversation, created = Conversation.objects.get_or_create(participant1=p1, participant2=p2)
+        p1, p2 = sorted((request.user.id, seller.pk))
+        conversation, created = Conversation.objects.get_or_create(participant1_id=p1, participant2_id=p2)
         active_conversation = conversation
         # MODIFIED: Fetch the last 100 messages initially for better infinite scroll
         message_manager = conversation.messages
         message_count = get_cached_message_count(conversation)
         messages = message_manager.order_by('timestamp')[max(0, message_count - 100):]
         has_more_messages = message_count > 100
-    all_reviews = Review.objects.with_full_details().by_seller(seller).recent_first()
+    all_reviews = Review.objects.with_full_details().by_seller(seller.pk).recent_first()
     rating_filter = request.GET.get('rating')
     if rating_filter and rating_filter.isdigit() and 1 <= int(rating_filter) <= 5:
         reviews_to_display = all_reviews.filter(rating=int(rating_filter))
@@ -468,10 +453,8 @@ def product_detail(request, pk):
     page_obj = paginator.get_page(page_number)
     review_stats = get_cached_review_stats(seller)
 
-    ordered_filter_options = product.filter_options.select_related('filter').order_by('filter__order')
-
     # Efficient random selection: get total count, then use random offset
-    similar_products_query = Product.objects.filter(game=product.game, is_active=True).exclude(pk=pk)
+    similar_products_query = Product.objects.filter(game_id=product.game.pk, is_active=True).exclude(pk=pk)
     total_count = similar_products_query.count()
     if total_count > 0:
         # Get up to 5 random products using efficient offset method
@@ -491,7 +474,7 @@ def product_detail(request, pk):
         'review_count': review_stats['review_count'],
         'current_rating_filter': rating_filter,
         'profile_user': seller,
-        'ordered_filter_options': ordered_filter_options,
+        'ordered_filter_options': product.filter_options,
         'has_more_messages': has_more_messages if 'has_more_messages' in locals() else False,
         'is_blocked': is_blocked,
     }
@@ -499,35 +482,16 @@ def product_detail(request, pk):
 
 def game_detail_view(request, pk):
     # Cache game details for 5 minutes
-    cache_key = f'game_detail_{pk}'
-    cached_data = cache.get(cache_key)
-
-    if cached_data is None:
-        game = get_object_or_404(Game, pk=pk)
-        # Get categories in admin panel setup order (by GameCategory ID)
-        categories = list(game.categories.filter(
-            gamecategory__game=game
-        ).order_by('gamecategory__id'))
-        cached_data = {'game': game, 'categories': categories}
-        cache.set(cache_key, cached_data, 300)  # 5 minutes
-
-    context = cached_data
+    context = caching.GAME_DETAIL.get_or_set(pk, compute=lambda: load_game_detail(pk))
     return render(request, 'marketplace/game_detail.html', context)
 
 
 
 def listing_page_view(request, game_pk, category_pk):
     # Cache game and category data for 10 minutes
-    cache_key = f'game_category_{game_pk}_{category_pk}'
-    cached_data = cache.get(cache_key)
-    
-    if cached_data:
-        game, current_category, game_category_link = cached_data
-    else:
-        game = get_object_or_404(Game, pk=game_pk)
-        current_category = get_object_or_404(Category, pk=category_pk)
-        game_category_link = get_object_or_404(GameCategory, game=game, category=current_category)
-        cache.set(cache_key, (game, current_category, game_category_link), 600)  # 10 minutes
+    game, current_category, game_category_link = caching.GAME_CATEGORY.get_or_set(
+        game_pk, category_pk, compute=lambda: load_game_category(game_pk, category_pk)
+    )
 
     filter_online_only = request.GET.get('online_only')
     filter_auto_delivery = request.GET.get('auto_delivery_only')
@@ -541,9 +505,9 @@ def listing_page_view(request, game_pk, category_pk):
         game=OuterRef('game')
     ).order_by('-boosted_at').values('boosted_at')[:1]
 
-    listings_query = Product.objects.with_full_details().filter(
-        game=game,
-        category=current_category,
+    listings_query = Product.objects.with_full_details().with_buyer_price().filter(
+        game_id=game.pk,
+        category_id=current_category.pk,
         is_active=True,
         seller__profile__show_listings_on_site=True
     ).annotate(
@@ -565,14 +529,14 @@ def listing_page_view(request, game_pk, category_pk):
             listings_query = listings_query.filter(listing_title__icontains=filter_q)
 
     if sort_order == 'price_asc':
-        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), 'price')
+        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), 'buyer_price_value')
     elif sort_order == 'price_desc':
-        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), '-price')
+        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), '-buyer_price_value')
     else:
         listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), '-created_at')
 
 
-    category_filters = game_category_link.filters.all().prefetch_related('options')
+    category_filters = game_category_link.filter_tree()
     active_filters = {}
 
     for f in category_filters:
@@ -587,11 +551,11 @@ def listing_page_view(request, game_pk, category_pk):
     listings = paginator.get_page(page_number)
 
     # Get categories in admin panel setup order (by GameCategory ID)
-    all_categories = game.categories.filter(
-        gamecategory__game=game
+    all_categories = Category.objects.filter(
+        gamecategory__game_id=game.pk
     ).annotate(
         listing_count=Count('product', filter=Q(
-            product__game=game,
+            product__game_id=game.pk,
             product__is_active=True,
             product__seller__profile__show_listings_on_site=True
           ))
@@ -645,7 +609,7 @@ def load_more_listings(request, game_pk, category_pk):
         game=OuterRef('game')
     ).order_by('-boosted_at').values('boosted_at')[:1]
 
-    listings_query = Product.objects.filter(
+    listings_query = Product.objects.with_buyer_price().filter(
         game=game,
         category=current_category,
         is_active=True,
@@ -672,13 +636,13 @@ def load_more_listings(request, game_pk, category_pk):
             listings_query = listings_query.filter(listing_title__icontains=filter_q)
 
     if sort_order == 'price_asc':
-        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), 'price')
+        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), 'buyer_price_value')
     elif sort_order == 'price_desc':
-        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), '-price')
+        listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), '-buyer_price_value')
     else:
         listings_query = listings_query.order_by(F('boost_time').desc(nulls_last=True), '-created_at')
 
-    category_filters = game_category_link.filters.all().prefetch_related('options')
+    category_filters = game_category_link.filter_tree()
     active_filters = {}
 
     for f in category_filters:
@@ -723,7 +687,7 @@ def public_profile_view(request, username):
     grouped_listings = []
     for game_category in seller_game_categories:
         # Fetch products for this specific game-category combination
-        products_for_combo = Product.objects.filter(
+        products_for_combo = Product.objects.with_buyer_price().filter(
             seller=profile_user, 
             is_active=True, 
             game=game_category.game,
@@ -817,7 +781,7 @@ def my_listings_in_category(request, game_pk, category_pk):
     game_category_link = get_object_or_404(GameCategory, game=game, category=category)
     seller_can_create_listing = game_category_link.seller_can_list(request.user)
 
-    listings = Product.objects.filter(
+    listings = Product.objects.with_buyer_price().filter(
         seller=request.user,
         game=game,
         category=category,
@@ -838,7 +802,7 @@ def my_listings_in_category(request, game_pk, category_pk):
 
 
 def flat_page_view(request, slug):
-    page = get_object_or_404(FlatPage, slug=slug)
+    page = caching.FLAT_PAGE.get_or_set(slug, compute=lambda: load_flat_page(slug))
     return render(request, 'marketplace/flat_page.html', {'page': page})
 
 def privacy_policy_view(request):
@@ -877,7 +841,7 @@ def facebook_data_deletion(request):
                 return HttpResponseForbidden('Invalid signature')
         
         # Rate limit to prevent abuse
-        if not check_rate_limit(request, 'fb_deletion', limit=10, period=3600):
+        if not rate_limit.check(request, 'fb_deletion', limit=10, period=3600):
             return HttpResponseForbidden('Rate limit exceeded')
         
         # For production, you would handle actual data deletion here
@@ -931,7 +895,7 @@ def create_product(request, game_pk, category_pk):
         
         # Rate limiting: 5 listing creations per hour per game
         rate_limit_key = f'create_listing_game_{game_pk}'
-        if not check_rate_limit(request, rate_limit_key, limit=5, period=3600):
+        if not rate_limit.check(request, rate_limit_key, limit=5, period=3600):
             cache.delete(processing_key)  # Clear lock before returning
             messages.error(request, f'Too many listing creation attempts for {game.title}. Please try again later.')
             # Create form without validating to preserve user data
@@ -1004,7 +968,7 @@ def edit_product(request, pk):
     if request.method == 'POST':
         # Rate limiting: 10 listing edits per hour per game
         rate_limit_key = f'edit_listing_game_{product.game.pk}'
-        if not check_rate_limit(request, rate_limit_key, limit=10, period=3600):
+        if not rate_limit.check(request, rate_limit_key, limit=10, period=3600):
             messages.error(request, f'Too many edit attempts for {product.game.title}. Please try again later.')
             # Stay on the same edit form page
             form = ProductForm(
@@ -1057,10 +1021,6 @@ def edit_product(request, pk):
             if filter_options_to_add:
                 updated_product.filter_options.set(filter_options_to_add)
 
-            # Clear product detail cache to show updated data immediately
-            cache_key = f'product_detail_{updated_product.pk}'
-            cache.delete(cache_key)
-
             messages.success(request, 'Your listing has been updated.')
             return redirect('product_detail', pk=updated_product.pk)
     else:
@@ -1080,6 +1040,15 @@ def edit_product(request, pk):
     }
     return render(request, 'marketplace/product_form.html', context)
 
+@login_required
+def export_stock_items(request, pk):
+    """Download a listing's unsold automatic-delivery codes, one per line"""
+    product = get_object_or_404(Product, pk=pk, seller=request.user)
+    lines = (f"{code}\n" for code in StockItem.objects.export_codes(product))
+    response = StreamingHttpResponse(lines, content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="listing-{product.pk}-codes.txt"'
+    return response
+
 @login_required
 def delete_product(request, pk):
     product = get_object_or_404(Product, pk=pk, seller=request.user)
@@ -1099,7 +1068,7 @@ def create_order(request, pk):
         messages.error(request, 'Invalid request method.')
         return redirect('product_detail', pk=pk)
 
-    product = get_object_or_404(Product, pk=pk, is_active=True)
+    product = get_object_or_404(Product.objects.with_buyer_price(), pk=pk, is_active=True)
 
     if product.seller == request.user:
         messages.error(request, 'You cannot purchase your own listing.')
@@ -1200,57 +1169,29 @@ def order_detail(request, order_id):
     page_obj = paginator.get_page(page_number)
     review_stats = get_cached_review_stats(order.seller)
     
-    # Find the specific delivery message for this order by looking at message sequence
+    # Automatic-delivery messages are linked to their order when sent
+    # (backfill_message_orders links older ones). The message is written by
+    # the order event pipeline after checkout commits, so the buyer can get
+    # here first; the delivered StockItem rows commit with the order.
     delivery_message = None
-    if order.product and order.product.automatic_delivery:
-        # Get all auto-reply delivery messages (not post-purchase messages) in chronological order
-        all_delivery_messages = conversation.messages.filter(
-            sender=order.seller,
+    delivered_codes = ''
+    if not order.product or order.product.automatic_delivery:
+        delivery_message = order.chat_messages.filter(
             is_auto_reply=True,
             is_system_message=False,
-        ).exclude(
-            content=order.product.post_purchase_message if order.product.post_purchase_message else ''
-        ).order_by('timestamp')
-        
-        # Get all orders between these users for this product, ordered by creation time
-        all_orders = Order.objects.filter(
-            buyer=order.buyer,
-            seller=order.seller,
-            product=order.product
-        ).order_by('created_at')
-        
-        # Find the position of current order in the sequence
-        order_list = list(all_orders)
-        try:
-            order_position = order_list.index(order)
-            # Get the delivery message at the same position
-            delivery_messages_list = list(all_delivery_messages)
-            if order_position < len(delivery_messages_list):
-                delivery_message = delivery_messages_list[order_position]
-        except (ValueError, IndexError):
-            pass
-            
-    elif not order.product:
-        # For deleted products, try to find by timestamp with tight window
-        delivery_message = conversation.messages.filter(
-            sender=order.seller,
-            is_auto_reply=True,
-            is_system_message=False,
-            timestamp__gte=order.created_at - timezone.timedelta(seconds=10),
-            timestamp__lte=order.created_at + timezone.timedelta(seconds=10)
-        ).exclude(
-            content__icontains='thank you'
-        ).exclude(
-            content__icontains='purchase'
-        ).first()
-    
+        ).order_by('timestamp').first()
+        if delivery_message:
+            delivered_codes = delivery_message.content
+        else:
+            delivered_codes = "\n".join(order.delivered_stock_items.order_by('id').values_list('content', flat=True))
+
     # Check if users have blocked each other
     is_blocked = (
         BlockedUser.objects.filter(blocker=request.user, blocked=other_user).exists() or
         BlockedUser.objects.filter(blocker=other_user, blocked=request.user).exists()
     )
     
-    context = { 'order': order, 'other_user': other_user, 'messages': messages, 'active_conversation': conversation, 'review_form': review_form, 'existing_review': existing_review, 'reviews': page_obj, 'average_rating': review_stats['average_rating'], 'review_count': review_stats['review_count'], 'current_rating_filter': rating_filter, 'profile_user': order.seller, 'ordered_filter_options': ordered_filter_options, 'has_more_messages': has_more_messages, 'delivery_message': delivery_message, 'is_blocked': is_blocked, }
+    context = { 'order': order, 'other_user': other_user, 'messages': messages, 'active_conversation': conversation, 'review_form': review_form, 'existing_review': existing_review, 'reviews': page_obj, 'average_rating': review_stats['average_rating'], 'review_count': review_stats['review_count'], 'current_rating_filter': rating_filter, 'profile_user': order.seller, 'ordered_filter_options': ordered_filter_options, 'has_more_messages': has_more_messages, 'delivery_message': delivery_message, 'delivered_codes': delivered_codes, 'is_blocked': is_blocked, }
     return render(request, 'marketplace/order_detail.html', context)
 
 @login_required
@@ -1403,89 +1344,87 @@ def delete_review_reply(request, reply_pk):
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
 
 
-def _filter_orders(request, queryset):
-    """Helper function to filter orders based on request parameters."""
-    order_number_query = request.GET.get('order_number', '').strip()
+ORDERS_PER_PAGE = 25
+
+
+def _matching_user_ids(username):
+    """Exact username match via its unique index, falling back to case-insensitive."""
+    user_ids = list(User.objects.filter(username=username).values_list('pk', flat=True))
+    if not user_ids:
+        user_ids = list(User.objects.filter(username__iexact=username).values_list('pk', flat=True)[:10])
+    return user_ids
+
+
+def _filter_orders(request, queryset, counterparty):
+    """
+    Applies the order list filters. Order numbers match by order_id prefix
+    (or primary key); on PostgreSQL the prefix LIKE can use the
+    varchar_pattern_ops "_like" index Django creates beside order_id's
+    unique index, which the plain btree cannot serve outside the C locale.
+    The counterparty is resolved to user ids first, by exact username where
+    possible; the case-insensitive fallback scans auth_user.
+    Returns (queryset, is_search).
+    """
+    order_number_query = request.GET.get('order_number', '').strip().lstrip('#').upper()
     status_query = request.GET.get('status', '').strip()
-    
-    # Differentiate between buyer and seller name based on the view
-    seller_name_query = request.GET.get('seller_name', '').strip()
-    buyer_name_query = request.GET.get('buyer_name', '').strip()
-
-    if order_number_query and order_number_query.isdigit():
-        queryset = queryset.filter(id=order_number_query)
-    if seller_name_query:
-        queryset = queryset.filter(seller__username__icontains=seller_name_query)
-    if buyer_name_query:
-        queryset = queryset.filter(buyer__username__icontains=buyer_name_query)
-    if status_query:
+    name_query = request.GET.get(f'{counterparty}_name', '').strip()
+
+    if order_number_query:
+        match = Q(order_id__startswith=f'#{order_number_query}')
+        if order_number_query.isdigit():
+            match |= Q(id=int(order_number_query))
+        queryset = queryset.filter(match)
+    if name_query:
+        queryset = queryset.filter(**{f'{counterparty}_id__in': _matching_user_ids(name_query)})
+    if status_query in dict(Order.STATUS_CHOICES):
         queryset = queryset.filter(status=status_query)
-        
-    return queryset
 
-@login_required
-def my_purchases(request):
-    orders_list = Order.objects.with_full_details().filter(buyer=request.user).recent_first()
-    orders_list = _filter_orders(request, orders_list)
-    
-    paginator = Paginator(orders_list, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    context = { 
-        'orders': page_obj, 
-        'statuses_for_filter': Order.STATUS_CHOICES, 
-        'filter_values': request.GET, 
-    }
-    return render(request, 'marketplace/my_purchases.html', context)
+    return queryset, bool(order_number_query or name_query)
 
-def load_more_purchases(request):
-    orders_list = Order.objects.filter(buyer=request.user).select_related(
-        'product__game', 'product__category', 'seller__profile', 
-        'game_snapshot', 'category_snapshot'
-    ).order_by('-created_at')
-    orders_list = _filter_orders(request, orders_list)
-    
-    paginator = Paginator(orders_list, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    html_list = [render_to_string('marketplace/partials/purchase_row.html', {'order': order}) for order in page_obj]
-    html = "".join(html_list)
-    
-    return JsonResponse({'html': html, 'has_next': page_obj.has_next()})
 
-@login_required
-def my_sales(request):
-    orders_list = Order.objects.with_full_details().filter(seller=request.user).recent_first()
-    orders_list = _filter_orders(request, orders_list)
+def _order_list_view(request, role, template_name, row_template):
+    """
+    Shared by my_purchases and my_sales. Pages are keyset-paginated; the
+    "Show more" button requests the same URL with the next cursor and gets
+    the rendered rows back as JSON.
+    """
+    counterparty = 'seller' if role == UserOrderCount.ROLE_BUYER else 'buyer'
+    orders_list = Order.objects.with_full_details().filter(**{role: request.user})
+    orders_list, is_search = _filter_orders(request, orders_list, counterparty)
+    page_obj = keyset_paginate(orders_list, request.GET.get('cursor'), ORDERS_PER_PAGE)
 
-    paginator = Paginator(orders_list, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        html = "".join(render_to_string(row_template, {'order': order}) for order in page_obj)
+        return JsonResponse({'html': html, 'has_next': page_obj.has_next(), 'next_cursor': page_obj.next_cursor})
+
+    # Totals come from the per-user rollup; free-text searches show no total
+    total_orders = None
+    if not is_search:
+        status_query = request.GET.get('status', '').strip()
+        total_orders = sum(
+            count for (count_role, status), count in UserOrderCount.objects.counts_for(request.user.id).items()
+            if count_role == role and (not status_query or status == status_query)
+        )
 
-    context = { 
-        'orders': page_obj, 
-        'statuses_for_filter': Order.STATUS_CHOICES, 
-        'filter_values': request.GET, 
+    context = {
+        'orders': page_obj,
+        'total_orders': total_orders,
+        'statuses_for_filter': Order.STATUS_CHOICES,
+        'filter_values': request.GET,
     }
-    return render(request, 'marketplace/my_sales.html', context)
-
-def load_more_sales(request):
-    orders_list = Order.objects.filter(seller=request.user).select_related(
-        'product__game', 'product__category', 'buyer__profile', 
-        'game_snapshot', 'category_snapshot'
-    ).order_by('-created_at')
-    orders_list = _filter_orders(request, orders_list)
+    return render(request, template_name, context)
 
-    paginator = Paginator(orders_list, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+@login_required
+def my_purchases(request):
+    return _order_list_view(
+        request, UserOrderCount.ROLE_BUYER, 'marketplace/my_purchases.html', 'marketplace/partials/purchase_row.html'
+    )
 
-    html_list = [render_to_string('marketplace/partials/sale_row.html', {'order': order}) for order in page_obj]
-    html = "".join(html_list)
-    
-    return JsonResponse({'html': html, 'has_next': page_obj.has_next()})
+@login_required
+def my_sales(request):
+    return _order_list_view(
+        request, UserOrderCount.ROLE_SELLER, 'marketplace/my_sales.html', 'marketplace/partials/sale_row.html'
+    )
 
 
 @login_required
@@ -1535,7 +1474,7 @@ def messages_view(request, username=None):
                     ).exclude(sender=request.user).values('conversation').distinct().count()
 
                     # Clear cached navbar counters so a refresh also shows correct numbers
-                    cache.delete(f'user_notifications_{request.user.id}')
+                    caching.bump('notifications', request.user.id)
 
                     async_to_sync(channel_layer.group_send)(
                         f'notifications_{request.user.username}',
@@ -1556,13 +1495,38 @@ def messages_view(request, username=None):
     return render(request, 'marketplace/my_messages.html', context)
 
 
+TRANSACTIONS_PER_PAGE = 25
+TRANSACTION_FILTERS = {
+    'deposits': ['DEPOSIT'],
+    'withdrawals': ['WITHDRAWAL'],
+    'orders': ['ORDER_PURCHASE', 'ORDER_SALE'],
+    'miscellaneous': ['MISCELLANEOUS'],
+}
+
+
+def _filter_transactions(user, filter_by):
+    transactions_list = Transaction.objects.filter(user=user).select_related('order', 'withdrawal', 'deposit')
+    if filter_by in TRANSACTION_FILTERS:
+        transactions_list = transactions_list.filter(transaction_type__in=TRANSACTION_FILTERS[filter_by])
+    return transactions_list
+
 @login_required
 def funds_view(request):
-    # Get total balance, available balance and held balance
-    total_balance = request.user.profile.balance
-    available_balance = request.user.profile.available_balance
-    held_balance = request.user.profile.held_balance
-    held_funds_summary = request.user.profile.get_held_funds_summary()
+    filter_by = request.GET.get('filter')
+    if request.method == 'GET' and request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        # "Show more" on the transactions list
+        page_obj = keyset_paginate(
+            _filter_transactions(request.user, filter_by), request.GET.get('cursor'), TRANSACTIONS_PER_PAGE
+        )
+        html = "".join(render_to_string('marketplace/partials/transaction_row.html', {'tx': tx}) for tx in page_obj)
+        return JsonResponse({'html': html, 'has_next': page_obj.has_next(), 'next_cursor': page_obj.next_cursor})
+
+    # Balance row + held-funds schedule: two wallet queries for the whole page
+    wallet = get_wallet_snapshot(request)
+    total_balance = wallet.balance
+    available_balance = wallet.available
+    held_balance = wallet.held
+    held_funds_summary = wallet.held_funds_summary
     
     # Only get detailed breakdown if specifically requested and limit to recent ones
     show_details = request.GET.get('show_held_details') == '1'
@@ -1570,15 +1534,6 @@ def funds_view(request):
     if show_details:
         held_funds_details = request.user.profile.get_held_funds_details()[:20]  # Limit to 20 most recent
     
-    transactions_list = Transaction.objects.filter(user=request.user).select_related('order', 'withdrawal', 'deposit')
-    filter_by = request.GET.get('filter')
-    if filter_by == 'deposits': transactions_list = transactions_list.filter(transaction_type='DEPOSIT')
-    elif filter_by == 'withdrawals': transactions_list = transactions_list.filter(transaction_type='WITHDRAWAL')
-    elif filter_by == 'orders': transactions_list = transactions_list.filter(transaction_type__in=['ORDER_PURCHASE', 'ORDER_SALE'])
-    elif filter_by == 'miscellaneous': transactions_list = transactions_list.filter(transaction_type='MISCELLANEOUS')
-    paginator = Paginator(transactions_list, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
     withdrawal_form = WithdrawalRequestForm(user=request.user, balance=available_balance)
     deposit_form = DepositRequestForm()
     
@@ -1635,6 +1590,9 @@ def funds_view(request):
     })
     
     pending_deposits = request.user.deposit_requests.filter(status=DepositRequest.STATUS_PENDING).count()
+    page_obj = keyset_paginate(
+        _filter_transactions(request.user, filter_by), request.GET.get('cursor'), TRANSACTIONS_PER_PAGE
+    )
     
     context = {
         'balance': total_balance,
@@ -1652,19 +1610,41 @@ def funds_view(request):
     }
     return render(request, 'marketplace/funds.html', context)
 
-def load_more_transactions(request):
-    transactions_list = Transaction.objects.filter(user=request.user).select_related('order', 'withdrawal', 'deposit')
-    filter_by = request.GET.get('filter')
-    if filter_by == 'deposits': transactions_list = transactions_list.filter(transaction_type='DEPOSIT')
-    elif filter_by == 'withdrawals': transactions_list = transactions_list.filter(transaction_type='WITHDRAWAL')
-    elif filter_by == 'orders': transactions_list = transactions_list.filter(transaction_type__in=['ORDER_PURCHASE', 'ORDER_SALE'])
-    elif filter_by == 'miscellaneous': transactions_list = transactions_list.filter(transaction_type='MISCELLANEOUS')
-    paginator = Paginator(transactions_list, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    html_list = [render_to_string('marketplace/partials/transaction_row.html', {'tx': tx}) for tx in page_obj]
-    html = "".join(html_list)
-    return JsonResponse({'html': html, 'has_next': page_obj.has_next()})
+@login_required
+def export_statement(request, kind):
+    """
+    Streams a CSV or JSON statement of the user's transactions, sales or
+    purchases over an optional ?from=YYYY-MM-DD&to=YYYY-MM-DD range.
+    Staff may pass ?user=<username> to export someone else's statement.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse("Unsupported export format.", status=400)
+    try:
+        start_at, end_at = parse_date_range(request.GET.get('from'), request.GET.get('to'))
+    except ValueError:
+        return HttpResponse("Dates must be valid and in YYYY-MM-DD format, with from before to.", status=400)
+
+    user = request.user
+    if request.GET.get('user') and request.user.is_staff:
+        user = get_object_or_404(User, username=request.GET['user'])
+
+    if kind == 'transactions':
+        header, rows = transaction_statement(user, start_at, end_at)
+    else:
+        header, rows = order_statement(user, 'seller' if kind == 'sales' else 'buyer', start_at, end_at)
+
+    if export_format == 'json':
+        response = StreamingHttpResponse(
+            stream_for(request, stream_json(header, rows)), content_type='application/json'
+        )
+    else:
+        response = StreamingHttpResponse(
+            stream_for(request, stream_csv(header, rows)), content_type='text/csv; charset=utf-8'
+        )
+    filename = f"{kind}-{user.username}-{timezone.localdate():%Y%m%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @login_required
 def settings_view(request):
@@ -1731,8 +1711,12 @@ def load_more_reviews(request, username):
 def send_chat_message(request, username):
     if request.method == 'POST':
         # Rate limiting: 30 messages per minute
-        if not check_rate_limit(request, 'send_message', limit=30, period=60):
-            return JsonResponse({'status': 'error', 'message': 'Too many messages. Please slow down.'}, status=429)
+        limited = rate_limit.check(request, 'send_message', limit=30, period=60)
+        if not limited:
+            return limited.add_headers(JsonResponse(
+                {'status': 'error', 'message': 'Too many messages. Please slow down.', 'retry_after': limited.retry_after},
+                status=429,
+            ))
         
         other_user = get_object_or_404(User, username=username)
         
@@ -1914,7 +1898,7 @@ def report_dispute(request, conversation_id):
 @login_required
 def checkout_view(request, pk):
     """Display checkout confirmation page for balance-only payments"""
-    product = get_object_or_404(Product, pk=pk, is_active=True)
+    product = get_object_or_404(Product.objects.with_buyer_price(), pk=pk, is_active=True)
     
     if product.seller == request.user:
         messages.error(request, 'You cannot purchase your own listing.')
@@ -1984,11 +1968,16 @@ def process_checkout(request, pk):
         return redirect('product_detail', pk=pk)
     
     # Rate limiting: 10 orders per hour
-    if not check_rate_limit(request, 'create_order', limit=10, period=3600):
-        messages.error(request, 'Too many order attempts. Please try again later.')
+    limited = rate_limit.check(request, 'create_order', limit=10, period=3600)
+    if not limited:
+        messages.error(
+            request, f'Too many order attempts. Please try again in {max(1, limited.retry_after // 60)} minute(s).'
+        )
         return redirect('product_detail', pk=pk)
     
-    product = get_object_or_404(Product.objects.select_for_update(), pk=pk)
+    # No product row lock here: stock is taken with conditional updates and
+    # SKIP LOCKED item claims so concurrent buyers of a listing don't queue.
+    product = get_object_or_404(Product.objects.with_buyer_price(), pk=pk)
     
     if product.seller == request.user:
         messages.error(request, 'You cannot purchase your own listing.')
@@ -2018,16 +2007,15 @@ def process_checkout(request, pk):
         request.session.pop('checkout_data', None)
         return redirect('product_detail', pk=product.pk)
     
-    total_price = product.get_buyer_total(quantity)
-    
-    # Get user's current available balance
-    user_balance = request.user.profile.available_balance
-    
     from decimal import Decimal
-    user_balance = Decimal(str(user_balance))
-    total_price = Decimal(str(total_price))
+    total_price = Decimal(str(product.get_buyer_total(quantity)))
     
-    if user_balance < total_price:
+    # Lock the buyer's balance row for the rest of the transaction: a second
+    # checkout from the same buyer waits here until this one has committed its
+    # purchase, then re-reads the balance it left behind.
+    wallet = UserBalance.objects.lock(request.user.id)
+    
+    if wallet.available < total_price:
         request.session.pop('checkout_data', None)
         messages.error(
             request,
@@ -2046,30 +2034,21 @@ def create_order_with_balance(request, product, quantity, total_price):
     
     # Check stock availability
     order_status = 'PROCESSING'
-    item_to_deliver = None
+    claimed_items = None
     
     if product.automatic_delivery:
-        stock_items = [item for item in product.stock_details.splitlines() if item.strip()]
-        if len(stock_items) < quantity:
-            messages.error(request, f'Not enough stock available. Only {len(stock_items)} left.')
+        claimed_items = StockItem.objects.claim(product, quantity)
+        if claimed_items is None:
+            messages.error(request, 'Not enough stock available.')
             return redirect('checkout', pk=product.pk)
-        
-        items_to_deliver_list = stock_items[:quantity]
-        product.stock_details = "\n".join(stock_items[quantity:])
-        item_to_deliver = "\n".join(items_to_deliver_list)
-        
-        if not product.stock_details.strip():
-            product.is_active = False
-        product.save()
     else:
         # For non-auto-delivery, only check stock if it's specified
         if product.stock is not None:
-            if product.stock >= quantity:
-                product.stock -= quantity
-                if product.stock == 0:
-                    product.is_active = False
-                product.save()
-            else:
+            taken = Product.objects.filter(pk=product.pk, stock__gte=quantity).update(
+                stock=F('stock') - quantity,
+                is_active=Case(When(stock=quantity, then=Value(False)), default=F('is_active')),
+            )
+            if not taken:
                 messages.error(request, 'Not enough stock available.')
                 return redirect('checkout', pk=product.pk)
     
@@ -2091,28 +2070,10 @@ def create_order_with_balance(request, product, quantity, total_price):
     )
     order.filter_options_snapshot.set(product.filter_options.all())
     
-    # Create conversation and messages
-    p1, p2 = sorted((order.buyer.id, order.seller.id))
-    conversation, created = Conversation.objects.get_or_create(participant1_id=p1, participant2_id=p2)
-    
-    if product.automatic_delivery and item_to_deliver:
-        Message.objects.create(
-            conversation=conversation,
-            sender=product.seller,
-            content=item_to_deliver,
-            is_system_message=False,
-            is_auto_reply=True
-        )
-    
-    # Send the post-purchase message if it exists
-    if product.post_purchase_message:
-        Message.objects.create(
-            conversation=conversation,
-            sender=product.seller,
-            content=product.post_purchase_message,
-            is_system_message=False,
-            is_auto_reply=True
-        )
+    # The delivered codes, post-purchase message, system notice and
+    # notifications are sent by the order event pipeline once this commits.
+    if claimed_items:
+        StockItem.objects.deliver(claimed_items, order)
     
     return redirect('order_detail', order_id=order.clean_order_id)
 
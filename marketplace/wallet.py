@@ -0,0 +1,68 @@
+# marketplace/wallet.py
+"""
+Request-scoped view of a user's wallet.
+
+Pages that show balances used to read `profile.balance`, `available_balance`,
+`held_balance` and the held-funds schedule separately, each with its own
+queries. A WalletSnapshot reads the running balance row once and the
+held-funds schedule once (both lazily), and get_wallet_snapshot() memoizes it
+on the request so every caller in the same request shares those two reads.
+"""
+
+
+class WalletSnapshot:
+    def __init__(self, user):
+        self.user = user
+        self._row = None
+        self._schedule = None
+
+    @property
+    def row(self):
+        """The user's UserBalance row (query 1)."""
+        if self._row is None:
+            from .models import UserBalance
+            self._row = UserBalance.objects.for_user(self.user)
+        return self._row
+
+    @property
+    def balance(self):
+        return self.row.balance
+
+    @property
+    def held(self):
+        return self.row.held
+
+    @property
+    def available(self):
+        return self.row.available
+
+    @property
+    def held_funds_schedule(self):
+        """All held-fund buckets, totals and counts (query 2)."""
+        if self._schedule is None:
+            from .models import HeldFund
+            self._schedule = HeldFund.objects.filter(user=self.user).release_schedule()
+        return self._schedule
+
+    @property
+    def held_funds_summary(self):
+        """Same shape as Profile.get_held_funds_summary()."""
+        return self.held_funds_schedule['buckets']
+
+    @property
+    def held_funds_count(self):
+        return self.held_funds_schedule['count']
+
+    def refresh(self):
+        """Drops the memoized reads, e.g. after this request moved money."""
+        self._row = None
+        self._schedule = None
+
+
+def get_wallet_snapshot(request):
+    """Returns the WalletSnapshot for request.user, creating it once per request."""
+    snapshot = getattr(request, '_wallet_snapshot', None)
+    if snapshot is None or snapshot.user.pk != request.user.pk:
+        snapshot = WalletSnapshot(request.user)
+        request._wallet_snapshot = snapshot
+    return snapshot
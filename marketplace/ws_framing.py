@@ -0,0 +1,135 @@
+# marketplace/ws_framing.py
+"""
+Negotiated WebSocket framing for the realtime consumers.
+
+Clients pick a wire format through the WebSocket subprotocol header:
+
+    new WebSocket(url, ['gb.msgpack.v1'])   -> MessagePack binary frames, short keys
+    new WebSocket(url, ['gb.json.v1'])      -> compact JSON text frames
+    new WebSocket(url)                      -> JSON text frames (legacy clients)
+
+Payloads are built with the long, readable keys everywhere in the code base;
+only the MessagePack encoder shortens them, and its decoder expands them again,
+so consumers never have to know which format a socket negotiated.
+"""
+import json
+
+import msgpack
+
+SUBPROTOCOL_MSGPACK = 'gb.msgpack.v1'
+SUBPROTOCOL_JSON = 'gb.json.v1'
+
+FORMAT_JSON = 'json'
+FORMAT_MSGPACK = 'msgpack'
+
+# Server preference order when a client offers several subprotocols
+SUPPORTED_SUBPROTOCOLS = {
+    SUBPROTOCOL_MSGPACK: FORMAT_MSGPACK,
+    SUBPROTOCOL_JSON: FORMAT_JSON,
+}
+
+# Long key -> short key for MessagePack frames. Keys not listed are sent as-is.
+SHORT_KEYS = {
+    'type': 't',
+    'stream': 's',
+    'username': 'u',
+    'data': 'd',
+    'error': 'e',
+    'action': 'a',
+    'timestamp': 'ts',
+    'message_html': 'h',
+    'message_id': 'm',
+    'conversation_id': 'c',
+    'unread_conversations_count': 'uc',
+    'last_message_content': 'lc',
+    'last_message_timestamp': 'lt',
+    'sender_username': 'su',
+    'is_online': 'o',
+    'last_seen_iso': 'ls',
+    'message': 'mg',
+    'active_purchases_count': 'ap',
+    'active_sales_count': 'as',
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def negotiate_subprotocol(scope):
+    """
+    Returns (subprotocol, frame_format) for the connection. The subprotocol is
+    None when the client did not offer one we support, which keeps plain
+    `new WebSocket(url)` clients on the legacy JSON frames.
+    """
+    offered = scope.get('subprotocols') or []
+    for subprotocol, frame_format in SUPPORTED_SUBPROTOCOLS.items():
+        if subprotocol in offered:
+            return subprotocol, frame_format
+    return None, FORMAT_JSON
+
+
+def _rename_keys(value, mapping):
+    if isinstance(value, dict):
+        return {mapping.get(key, key): _rename_keys(item, mapping) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rename_keys(item, mapping) for item in value]
+    return value
+
+
+def shorten_keys(payload):
+    return _rename_keys(payload, SHORT_KEYS)
+
+
+def expand_keys(payload):
+    return _rename_keys(payload, LONG_KEYS)
+
+
+def encode_frame(payload, frame_format=FORMAT_JSON):
+    """
+    Encodes a payload for AsyncWebsocketConsumer.send(). Returns the keyword
+    arguments to pass, i.e. {'text_data': ...} or {'bytes_data': ...}.
+    """
+    if frame_format == FORMAT_MSGPACK:
+        return {'bytes_data': msgpack.packb(shorten_keys(payload), use_bin_type=True)}
+    return {'text_data': _json_encoder.encode(payload)}
+
+
+def decode_frame(text_data=None, bytes_data=None, frame_format=FORMAT_JSON):
+    """
+    Decodes an inbound frame into a dict with long keys. Binary frames are
+    only accepted on MessagePack sockets. Raises ValueError on malformed input.
+    """
+    if bytes_data is not None:
+        if frame_format != FORMAT_MSGPACK:
+            raise ValueError("Binary frames require the MessagePack subprotocol")
+        try:
+            payload = msgpack.unpackb(bytes_data, raw=False)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Malformed MessagePack frame: {e}") from e
+        payload = expand_keys(payload)
+    else:
+        payload = json.loads(text_data or '')
+
+    if not isinstance(payload, dict):
+        raise ValueError("WebSocket frames must be objects")
+    return payload
+
+
+class FramedConsumerMixin:
+    """
+    Adds subprotocol negotiation to an AsyncWebsocketConsumer. Consumers call
+    accept_negotiated() instead of accept() and send_frame() instead of
+    send(text_data=json.dumps(...)).
+    """
+
+    frame_format = FORMAT_JSON
+
+    async def accept_negotiated(self):
+        subprotocol, self.frame_format = negotiate_subprotocol(self.scope)
+        await self.accept(subprotocol=subprotocol)
+
+    async def send_frame(self, payload):
+        await self.send(**encode_frame(payload, self.frame_format))
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        return decode_frame(text_data, bytes_data, self.frame_format)